@@ -12,6 +12,13 @@ TEAM_SIZE = 5 							# Number of players on a team
 NUM_TEAMS = 2
 APP_NAME = ("mm_%s" % GAME_NAME) 	    # Generated name of app
 Q_SEGMENT_SIZE = 750					# How many teams each Celery worker will process
+Q_SEGMENT_OVERLAP = 25                  # How many teams neighbouring segments share, so edge teams can pair both ways
+Q_CLAIM_TIMEOUT = 60                    # Seconds before a worker's claim on a team expires (crashed worker)
+MM_QUEUE_WORKERS = 4                    # Threads processing a segment's sub-queues (e.g. regions) concurrently
+MM_QUEUE_BACKEND = 'sql'                # Where queue state lives: 'sql' (Party table), 'redis' or 'fake_redis' (tests)
+MM_QUEUE_SYNC_MARGIN = 30               # Seconds each 'sql' index sync re-reads before the last one (late commits)
+MM_QUEUE_REDIS_URL = 'redis://localhost:6379/1'  # Redis of the 'redis' queue backend
+MM_QUEUE_REDIS_PREFIX = 'mm_queue:'     # Key prefix of the Redis queue backends
 SUPPORTS_REGIONS = True                 # Toggle multi-region support. Turn off if each region gets it's own MM system
 PLUGIN_DIRECTORY = 'models'            # Path (w/out ending /) where plugins are located
 
@@ -21,6 +28,47 @@ PLUGIN_DIRECTORY = 'models'            # Path (w/out ending /) where plugins are
    ---------------------------------------'''
 MM_MATCH_MAX_DURATION = 120 			# Max num minutes a match can exist
 MM_NUM_MATCH_WINNERS = 1                # Number of possible winners within a match
+MM_PAIRING_STRATEGY = 'max_weight'      # How a segment is paired: 'greedy' (adjacent pairs) or 'max_weight'
+MM_PAIRING_BAND = 6                     # How many parties down the sorted segment a party may be paired with
+MM_PAIRING_ELO_WINDOW = 500             # Max avg elo gap of a non-adjacent pair (sparse edges of the pairing graph)
+MM_PAIRING_MATCH_BONUS = 1.0            # Weight added per match on top of its quality. Raise to favour match count
+MM_BULK_BATCH_SIZE = 500                # Max rows written by a single bulk UPDATE / INSERT
+MM_SWEEP_CHUNK_SIZE = 500               # Max expired matches closed by a single UPDATE
+MM_RESULT_BATCH_SIZE = 100              # Max closed matches handed to the result stack at once
+MM_NOTIFY_MATCHES = True                # Push new matches to their teams' status channels (see notify.py)
+
+
+'''------------------------------------------
+             Matchmaking Tracing
+   ---------------------------------------'''
+MM_TRACE_ENABLED = False                # Record wall time and DB queries of every stack stage
+MM_TRACE_SINKS = ('logger',)            # Where stage records go: 'logger', 'ring_buffer', 'json_lines' (tracing.py)
+MM_TRACE_COUNT_PARTIES = False          # Also COUNT waiting parties before / after each queue stage (2 queries)
+MM_TRACE_RING_SIZE = 2000               # Stage records kept in memory by the ring buffer sink
+MM_TRACE_FILE = 'mm_trace.jsonl'        # JSON-lines file of the json_lines sink, read by mm_trace_report
+MM_TRACE_FILE_MAX_BYTES = 10 * 2 ** 20  # Size at which the JSON-lines file is rotated to MM_TRACE_FILE.1
+MM_TRACE_FILE_BACKUPS = 3               # Rotated JSON-lines files kept (MM_TRACE_FILE.1 is the newest)
+
+
+'''------------------------------------------
+             Matchmaking Daemon
+   ---------------------------------------'''
+MM_DAEMON_BATCH_WINDOW = 0.25           # Seconds arrivals are gathered for before pairing them (absorbs bursts)
+MM_DAEMON_POLL_INTERVAL = 0.5           # Seconds between reads of the queue index for enqueue / leave events
+MM_DAEMON_NEIGHBOURS = 12               # Queued parties on each side (by elo) an arrival is paired against
+MM_DAEMON_SWEEP_INTERVAL = 30           # Seconds between full batch passes, which expedite unmatched parties
+MM_DAEMON_REPORT_INTERVAL = 60          # Seconds between time-to-match reports
+MM_DAEMON_STATS_SIZE = 1000             # Recent time-to-match samples kept for the median
+
+
+'''------------------------------------------
+               Team Chat Relay
+   ---------------------------------------'''
+CHAT_COALESCE_WINDOW = 0.1              # Seconds a channel's messages are gathered into one layer send
+CHAT_QUEUE_SIZE = 50                    # Max pending messages per chat channel
+CHAT_OVERFLOW = 'slow_down'             # Full queue: 'slow_down' (reject and tell the sender) or 'drop' (oldest)
+CHAT_MAX_LENGTH = 500                   # Longer messages are truncated
+CHAT_REPORT_INTERVAL = 60               # Seconds between per-channel throughput reports
 
 
 '''------------------------------------------
@@ -42,8 +90,43 @@ ELO_RANK_INCREMENT = 500					# How ranks are sequestered (Trueskill sigma)
 ELO_INCREMENT_RANGE = 250					# Distance in rank that guarantees 76% 'fairness' (1/2 * sigma)
 ELO_MODIFIER = 25						# How elo is adjusted per game
 ELO_DEFAULT_FAIRNESS_THRESHOLD = 0.45 	# Lowest match fairness is 42% change of draw
-ELO_EXPEDITED_FAIRNESS_MODIFIER = 0.05 	# Decrease team's fairness threshold by 5% each time a match cannot be found
-ELO_EXPEDITED_MAX_PASSES = 3 			# How many times a team can be passed over before a match is FORCED
+ELO_EXPEDITED_FAIRNESS_MODIFIER = 0.05 	# Per-pass fairness decrease of synthetic segments (queue lanes widen by wait)
+ELO_EXPEDITED_MAX_PASSES = 3 			# Passes at which a pairing mask FORCES a match (the queue's lanes force by wait)
+SKILL_BACKEND = 'numpy'                 # Rate / match quality: 'numpy' (closed forms) or 'trueskill', pairing is numpy
+
+
+'''------------------------------------------
+                 Queue Lanes
+   ---------------------------------------'''
+MM_LANES = (                            # Checked in order: (name, scheduling weight, p99 wait target in seconds)
+    ('plus',        3,  60),            # A player of the party is a Plus member
+    ('expedited',   2,  120),           # Passed over at least once
+    ('normal',      1,  180),
+)
+MM_LANE_FAIRNESS_FLOOR = 0.2            # Fairness threshold a party widens down to, a match is FORCED past it
+MM_LANE_MAX_WAIT_FACTOR = 2.0           # Match is FORCED by this many times a lane's target at the latest (low gain)
+MM_LANE_WAIT_SAMPLES = 1000             # Recent waits per lane the p99 is measured on
+MM_LANE_MIN_SAMPLES = 50                # Waits a lane needs before its gain is adjusted
+MM_LANE_GAIN_STEP = 1.02                # Gain is multiplied / divided by this each tick p99 is over / under target
+MM_LANE_GAIN_RANGE = (0.5, 4.0)         # Bounds of a lane's widening gain
+MM_LANE_TARGET_SLACK = 0.8              # Gain only eases off once p99 is under this fraction of the target
+
+
+'''------------------------------------------
+                 Leaderboard
+   ---------------------------------------'''
+LEADERBOARD_MIN_ELO = 0                 # Elo range of the rating histogram, players outside it share an end bucket
+LEADERBOARD_MAX_ELO = 10000
+LEADERBOARD_SUB_BUCKET = 5              # Elo points per fine histogram bucket (rank / percentile resolution)
+LEADERBOARD_MAX_AGE = 300               # Seconds before a process rebuilds its histogram from the Player table
+
+
+'''------------------------------------------
+                Match Archive
+   ---------------------------------------'''
+MM_ARCHIVE_DIR = 'mm_archive'           # Where mm_archive_matches writes its columnar .npz files (see archive.py)
+MM_ARCHIVE_AFTER_DAYS = 30              # Matches closed this many days ago leave the hot tables
+MM_ARCHIVE_CHUNK_SIZE = 5000            # Matches per archive file, each moved in its own transaction
 
 
 '''------------------------------------------
@@ -66,3 +149,4 @@ This value will be assigned to the "op" key in a websocket message
 '''
 OP_NEW_MATCH = 'new-match'
 OP_CHAT_MSG = 'chat-msg'
+OP_CHAT_SLOW_DOWN = 'chat-slow-down'
@@ -0,0 +1,363 @@
+"""
+Hot / cold split of completed matches
+
+mm_archive_matches moves matches closed more than MM_ARCHIVE_AFTER_DAYS ago out of the
+Match, MatchTeamSlot and MatchRosterSlot tables, into compressed columnar .npz files:
+
+    * One file per chunk of MM_ARCHIVE_CHUNK_SIZE matches, named by its first and last match pk
+    * A file holds the ARCHIVE_COLUMNS of its matches, team slots and roster slots (the
+      per-player elo deltas), times as UTC epoch microseconds
+    * Each file has a small manifest-<first>-<last>.npz beside it: its min / max end_time and
+      sorted player ids, so reads skip files that cannot hold the range or players asked for.
+      Files without a manifest are read whole
+    * A chunk's file is written before its rows are deleted, in the same transaction. If the
+      transaction fails the file and its manifest are removed and the matches stay hot
+    * Matches a party is still locked to stay hot
+
+Reads merge the archive with the hot tables, so history and rating replay work the same
+wherever a match lives
+"""
+import datetime
+import os
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .app_settings import ELO_AVG_RATING, MM_ARCHIVE_DIR, MM_ARCHIVE_AFTER_DAYS, MM_ARCHIVE_CHUNK_SIZE
+from .models.core_models import Match, MatchTeamSlot, MatchRosterSlot
+
+ARCHIVE_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+ARCHIVE_NO_TIME = -1  # Stored for a None start / end time
+ARCHIVE_TIME_COLUMNS = ('start_time', 'end_time')
+
+
+""" Columns archived per table
+        - (archive column, model field, dtype, value stored for None)
+"""
+ARCHIVE_COLUMNS = {
+    'matches': (
+        ('match_id',            'id',               np.int64,   -1),
+        ('start_time',          'start_time',       np.int64,   ARCHIVE_NO_TIME),
+        ('end_time',            'end_time',         np.int64,   ARCHIVE_NO_TIME),
+        ('winner_id',           'winner_id',        np.int64,   -1),
+        ('is_disputed',         'is_disputed',      bool,       False),
+        ('declared_results',    'declared_results', 'U2',       ''),
+    ),
+    'teams': (
+        ('match_id',            'match_id',         np.int64,   -1),
+        ('team_id',             'team_id',          np.int64,   -1),
+        ('result',              'result',           bool,       False),
+        ('invalid',             'invalid',          bool,       False),
+    ),
+    'rosters': (
+        ('match_id',            'match_id',         np.int64,   -1),
+        ('player_id',           'player_id',        np.int64,   -1),
+        ('team_id',             'team_id',          np.int64,   -1),
+        ('elo_modifier',        'elo_modifier',     np.float64, 0.0),
+    ),
+}
+ARCHIVE_MODELS = {
+    'matches':                  Match,
+    'teams':                    MatchTeamSlot,
+    'rosters':                  MatchRosterSlot,
+}
+
+_manifest_cache = {}  # manifest path -> (mtime, manifest)
+
+
+def archive_to_timestamp(value):
+    """ Returns a datetime as UTC epoch microseconds, ARCHIVE_NO_TIME for None """
+    if value is None:
+        return ARCHIVE_NO_TIME
+    return (value - ARCHIVE_EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def archive_from_timestamp(value):
+    """ Returns the UTC datetime of epoch microseconds, None for ARCHIVE_NO_TIME """
+    if value == ARCHIVE_NO_TIME:
+        return None
+    return ARCHIVE_EPOCH + datetime.timedelta(microseconds=int(value))
+
+
+def archive_build_columns(table, rows):
+    """ Turns value rows of a table's model fields into {archive column: array} """
+    columns = {}
+    for idx, (column, field, dtype, missing) in enumerate(ARCHIVE_COLUMNS[table]):
+        values = [row[idx] for row in rows]
+        if column in ARCHIVE_TIME_COLUMNS:
+            values = [archive_to_timestamp(value) for value in values]
+        columns[column] = np.array([missing if value is None else value for value in values], dtype=dtype)
+    return columns
+
+
+def archive_read_hot(table, matches):
+    """ Reads a table's columns of matches (pks or a Match QuerySet) from the hot tables """
+    fields = [field for column, field, dtype, missing in ARCHIVE_COLUMNS[table]]
+    model = ARCHIVE_MODELS[table]
+    queryset = model.objects.filter(pk__in=matches) if model is Match else model.objects.filter(match__in=matches)
+    return archive_build_columns(table, list(queryset.order_by('pk').values_list(*fields)))
+
+
+def archive_write_file(path, tables):
+    """ Writes {table: columns} to a compressed .npz file, replacing it atomically """
+    temp_path = os.path.join(os.path.dirname(path), '.%s.tmp' % os.path.basename(path))
+    with open(temp_path, 'wb') as archive_file:
+        np.savez_compressed(archive_file, **{'%s_%s' % (table, column): values
+                                             for table, columns in tables.items()
+                                             for column, values in columns.items()})
+    os.replace(temp_path, path)
+
+
+def archive_load_file(path):
+    """ Reads {table: columns} back from an archive file """
+    with np.load(path, allow_pickle=False) as archive:
+        return {table: {column: archive['%s_%s' % (table, column)] for column, field, dtype, missing in columns}
+                for table, columns in ARCHIVE_COLUMNS.items()}
+
+
+def archive_get_manifest_path(path):
+    """ Returns the manifest path of an archive file, matches-<first>-<last>.npz -> manifest-<first>-<last>.npz """
+    return os.path.join(os.path.dirname(path), 'manifest-' + os.path.basename(path)[len('matches-'):])
+
+
+def archive_build_manifest(tables):
+    """ Builds the manifest of {table: columns}: {'min_end_time', 'max_end_time', 'player_ids'} """
+    end_times = tables['matches']['end_time']
+    return {
+        'min_end_time': np.array([end_times.min() if len(end_times) else ARCHIVE_NO_TIME], dtype=np.int64),
+        'max_end_time': np.array([end_times.max() if len(end_times) else ARCHIVE_NO_TIME], dtype=np.int64),
+        'player_ids': np.unique(tables['rosters']['player_id']),
+    }
+
+
+def archive_write_chunk(path, tables):
+    """ Writes an archive file, then its manifest """
+    archive_write_file(path, tables)
+    archive_write_file(archive_get_manifest_path(path), {'manifest': archive_build_manifest(tables)})
+
+
+def archive_remove_chunk(path):
+    """ Removes an archive file and its manifest, if written """
+    for chunk_path in (path, archive_get_manifest_path(path)):
+        try:
+            os.remove(chunk_path)
+        except FileNotFoundError:
+            pass
+
+
+def archive_load_manifest(path):
+    """
+    Reads an archive file's manifest, None if it has none
+        - Cached per process until the manifest file changes
+    """
+    manifest_path = archive_get_manifest_path(path)
+    try:
+        mtime = os.path.getmtime(manifest_path)
+    except OSError:
+        return None
+
+    cached = _manifest_cache.get(manifest_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with np.load(manifest_path, allow_pickle=False) as manifest_file:
+        manifest = {
+            'min_end_time': int(manifest_file['manifest_min_end_time'][0]),
+            'max_end_time': int(manifest_file['manifest_max_end_time'][0]),
+            'player_ids': manifest_file['manifest_player_ids'],
+        }
+    _manifest_cache[manifest_path] = (mtime, manifest)
+    return manifest
+
+
+def archive_may_match(manifest, start=None, end=None, player_pks=None):
+    """ Whether a file with this manifest may hold matches closed in [start, end) of player_pks """
+    if start is not None and manifest['max_end_time'] < archive_to_timestamp(start):
+        return False
+    if end is not None and manifest['min_end_time'] >= archive_to_timestamp(end):
+        return False
+    if player_pks is not None and not np.isin(list(player_pks), manifest['player_ids']).any():
+        return False
+    return True
+
+
+def archive_list_files(archive_dir=MM_ARCHIVE_DIR):
+    """ Returns the archive's files, oldest match pks first """
+    if not os.path.isdir(archive_dir):
+        return []
+
+    names = [name for name in os.listdir(archive_dir) if name.startswith('matches-') and name.endswith('.npz')]
+    return [os.path.join(archive_dir, name) for name in sorted(names, key=lambda name: int(name.split('-')[1]))]
+
+
+def archive_empty_columns(table):
+    return {column: np.zeros(0, dtype=dtype) for column, field, dtype, missing in ARCHIVE_COLUMNS[table]}
+
+
+def archive_select(columns, mask):
+    return {column: values[mask] for column, values in columns.items()}
+
+
+def archive_concatenate(table, parts):
+    """ Joins the columns of several reads of a table """
+    if not parts:
+        return archive_empty_columns(table)
+    return {column: np.concatenate([part[column] for part in parts]) for column in parts[0]}
+
+
+def archive_filter(tables, start=None, end=None, player_pks=None, exclude_pks=()):
+    """
+    Keeps the matches of {table: columns} closed in [start, end), and their slots
+        - player_pks : only keeps the roster slots of these players, and their matches
+        - exclude_pks : match pks dropped (already read from elsewhere)
+    """
+    end_times = tables['matches']['end_time']
+    keep = np.ones(len(end_times), dtype=bool)
+    if start is not None:
+        keep &= end_times >= archive_to_timestamp(start)
+    if end is not None:
+        keep &= end_times < archive_to_timestamp(end)
+    if len(exclude_pks):
+        keep &= ~np.isin(tables['matches']['match_id'], list(exclude_pks))
+
+    rosters = tables['rosters']
+    in_matches = np.isin(rosters['match_id'], tables['matches']['match_id'][keep])
+    if player_pks is not None:
+        in_matches &= np.isin(rosters['player_id'], list(player_pks))
+        keep &= np.isin(tables['matches']['match_id'], rosters['match_id'][in_matches])
+
+    match_pks = tables['matches']['match_id'][keep]
+    return {
+        'matches': archive_select(tables['matches'], keep),
+        'teams': archive_select(tables['teams'], np.isin(tables['teams']['match_id'], match_pks)),
+        'rosters': archive_select(rosters, in_matches),
+    }
+
+
+def archive_read(start=None, end=None, player_pks=None, include_hot=True, archive_dir=MM_ARCHIVE_DIR):
+    """
+    Reads completed matches closed in [start, end), archived or hot
+        - player_pks : only reads these players' roster slots and their matches
+        - A match found in several places is read once, hot rows first, then the newest file
+        - Files whose manifest rules out the range or players are not opened
+        - Returns {'matches', 'teams', 'rosters'}, each {archive column: array}
+    """
+    parts = []
+    seen_pks = set()
+
+    if include_hot:
+        hot_matches = Match.objects.exclude(end_time=None)
+        if start is not None:
+            hot_matches = hot_matches.filter(end_time__gte=start)
+        if end is not None:
+            hot_matches = hot_matches.filter(end_time__lt=end)
+        if player_pks is not None:
+            hot_matches = hot_matches.filter(players__in=list(player_pks)).distinct()
+
+        hot = {table: archive_read_hot(table, hot_matches.values('pk')) for table in ARCHIVE_COLUMNS}
+        parts.append(archive_filter(hot, player_pks=player_pks))
+        seen_pks.update(hot['matches']['match_id'].tolist())
+
+    for path in reversed(archive_list_files(archive_dir)):
+        manifest = archive_load_manifest(path)
+        if manifest is not None and not archive_may_match(manifest, start, end, player_pks):
+            continue
+
+        part = archive_filter(archive_load_file(path), start, end, player_pks, seen_pks)
+        parts.append(part)
+        seen_pks.update(part['matches']['match_id'].tolist())
+
+    return {table: archive_concatenate(table, [part[table] for part in parts]) for table in ARCHIVE_COLUMNS}
+
+
+def archive_get_rating_deltas(player_pks=None, start=None, end=None, include_hot=True, archive_dir=MM_ARCHIVE_DIR):
+    """
+    Returns the elo deltas of completed matches as columns, in the order matches closed
+        - {'match_id', 'end_time', 'player_id', 'team_id', 'won', 'is_disputed', 'elo_modifier'}
+    """
+    tables = archive_read(start, end, player_pks, include_hot, archive_dir)
+    matches = tables['matches']
+    rosters = tables['rosters']
+
+    # Join each roster slot to its match
+    match_order = np.argsort(matches['match_id'])
+    match_idx = match_order[np.searchsorted(matches['match_id'], rosters['match_id'], sorter=match_order)] \
+        if len(matches['match_id']) else np.zeros(0, dtype=int)
+    end_times = matches['end_time'][match_idx]
+    order = np.lexsort((rosters['match_id'], end_times))
+
+    return {
+        'match_id': rosters['match_id'][order],
+        'end_time': end_times[order],
+        'player_id': rosters['player_id'][order],
+        'team_id': rosters['team_id'][order],
+        'won': (matches['winner_id'][match_idx] == rosters['team_id'])[order],
+        'is_disputed': matches['is_disputed'][match_idx][order],
+        'elo_modifier': rosters['elo_modifier'][order],
+    }
+
+
+def archive_replay_player_elo(player_pk, initial_elo=ELO_AVG_RATING, archive_dir=MM_ARCHIVE_DIR):
+    """ Replays a player's elo deltas, returns (end times, elo after each match) """
+    deltas = archive_get_rating_deltas([player_pk], archive_dir=archive_dir)
+    return deltas['end_time'], initial_elo + np.cumsum(deltas['elo_modifier'])
+
+
+def archive_get_player_history(player_pk, limit=None, archive_dir=MM_ARCHIVE_DIR):
+    """ Returns a player's completed matches, most recent first, as [{match_id, end_time, team_id, won, ...}] """
+    deltas = archive_get_rating_deltas([player_pk], archive_dir=archive_dir)
+    history = []
+
+    for idx in reversed(range(len(deltas['match_id']))):
+        if limit is not None and len(history) >= limit:
+            break
+        history.append({
+            'match_id': int(deltas['match_id'][idx]),
+            'end_time': archive_from_timestamp(deltas['end_time'][idx]),
+            'team_id': int(deltas['team_id'][idx]),
+            'won': bool(deltas['won'][idx]),
+            'is_disputed': bool(deltas['is_disputed'][idx]),
+            'elo_modifier': float(deltas['elo_modifier'][idx]),
+        })
+
+    return history
+
+
+def archive_matches(before=None, archive_dir=MM_ARCHIVE_DIR, chunk_size=MM_ARCHIVE_CHUNK_SIZE, dry_run=False):
+    """
+    Moves matches closed before a cutoff (default MM_ARCHIVE_AFTER_DAYS ago) to archive files
+        - Chunks of chunk_size matches walk the end_time index in pk order, each chunk's
+          file write and DELETE sharing one transaction. A chunk whose transaction fails
+          has its files removed
+        - Returns (matches archived, [files written])
+    """
+    before = before or timezone.now() - datetime.timedelta(days=MM_ARCHIVE_AFTER_DAYS)
+    closed = Match.objects.filter(end_time__lt=before, parties=None).order_by('pk')
+    num_archived = 0
+    paths = []
+    last_pk = None
+
+    if not dry_run and not os.path.isdir(archive_dir):
+        os.makedirs(archive_dir)
+
+    while True:
+        chunk = closed if last_pk is None else closed.filter(pk__gt=last_pk)
+        match_pks = list(chunk.values_list('pk', flat=True)[:chunk_size])
+        if not match_pks:
+            return num_archived, paths
+        last_pk = match_pks[-1]
+
+        if not dry_run:
+            path = os.path.join(archive_dir, 'matches-%s-%s.npz' % (match_pks[0], match_pks[-1]))
+            try:
+                with transaction.atomic():
+                    archive_write_chunk(path, {table: archive_read_hot(table, match_pks)
+                                               for table in ARCHIVE_COLUMNS})
+                    Match.objects.filter(pk__in=match_pks).delete()  # Slots and award keys cascade
+            except Exception:
+                archive_remove_chunk(path)  # The matches stay hot, their archived copy would be orphaned
+                raise
+            paths.append(path)
+
+        num_archived += len(match_pks)
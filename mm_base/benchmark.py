@@ -0,0 +1,307 @@
+"""
+Benchmarks for Matchmaking
+
+Synthetic queue generators and timed runs of the matchmaking hot paths
+"""
+import logging
+import time
+import tracemalloc
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+
+from .app_settings import APP_NAME, TEAM_SIZE, REGIONS, ELO_AVG_RATING, ELO_RANK_INCREMENT, ELO_INCREMENT_RANGE, \
+    ELO_EXPEDITED_MAX_PASSES, Q_SEGMENT_SIZE, MM_BULK_BATCH_SIZE
+from .matchmaking import mm_setup_environment, mm_get_queued_segments
+from .models.core_models import Player, Team, Party, Match, MatchTeamSlot, MatchRosterSlot
+from .models.core_middleware import mm_core_process_queue
+from .models.mm_tutor.middleware import mentor_assign_students
+from .models.mm_tutor.plugin_settings import RANGE_EXTENSION
+from .pairing import MM_PAIRING_STRATEGIES, MM_PAIRING_BAND, pairing_build_elo_window_mask
+from .queue_index import queue_index_get
+from .skill import skill_calculate_quality_matrix, skill_build_match_mask, skill_build_segment_arrays, \
+    skill_is_match, skill_commit_match_results, skill_get_expedited_fairness
+from .tracing import TraceQueryCounter
+
+BENCH_SEED_BATCH_SIZE = 5000  # Parties seeded per bulk insert round
+BENCH_QUALITY_BINS = 20  # Histogram bins of match quality over [0, 1]
+
+
+def bench_generate_segment(segment_size, rng, elo_spread=ELO_RANK_INCREMENT):
+    """
+    Generates the rating arrays of a synthetic queue segment sorted by avg elo
+        - Returns (roster_sizes, mu_sums, sigma_sq_sums, thresholds, passes)
+    """
+    party_mu = rng.normal(ELO_AVG_RATING, elo_spread, (segment_size, 1))
+    player_mu = party_mu + rng.normal(0, elo_spread / 5.0, (segment_size, TEAM_SIZE))
+    player_sigma = rng.uniform(50, ELO_INCREMENT_RANGE, (segment_size, TEAM_SIZE))
+    passes = rng.randint(0, ELO_EXPEDITED_MAX_PASSES + 1, segment_size)
+
+    roster_sizes = np.full(segment_size, float(TEAM_SIZE))
+    mu_sums = player_mu.sum(axis=1)
+    sigma_sq_sums = (player_sigma ** 2).sum(axis=1)
+    thresholds = skill_get_expedited_fairness(passes)
+
+    order = np.argsort(mu_sums)
+    return roster_sizes[order], mu_sums[order], sigma_sq_sums[order], thresholds[order], passes[order]
+
+
+def bench_pairing(segment_size=750, ticks=10, seed=0, band=MM_PAIRING_BAND, elo_spread=ELO_RANK_INCREMENT):
+    """
+    Compares the pairing strategies over the same synthetic segments
+        - A wider elo_spread gives a sparser queue where pairing choices matter
+        - Returns {strategy: {matches_per_tick, mean_quality, seconds_per_tick}}
+    """
+    rng = np.random.RandomState(seed)
+    segments = [bench_generate_segment(segment_size, rng, elo_spread) for _ in range(ticks)]
+    results = {}
+
+    for name, strategy in sorted(MM_PAIRING_STRATEGIES.items()):
+        strategy_band = 1 if name == 'greedy' else band
+        num_matches = 0
+        qualities = []
+        elapsed = 0.0
+
+        for roster_sizes, mu_sums, sigma_sq_sums, thresholds, passes in segments:
+            start = time.perf_counter()
+            quality_band = skill_calculate_quality_matrix(roster_sizes, mu_sums, sigma_sq_sums, band=strategy_band)
+            match_mask = skill_build_match_mask(quality_band, thresholds, passes, band=strategy_band)
+            match_mask &= pairing_build_elo_window_mask(mu_sums / roster_sizes, strategy_band)
+            pairs = strategy(quality_band, match_mask)
+            elapsed += time.perf_counter() - start
+
+            num_matches += len(pairs)
+            qualities.extend(quality_band[idx, next_idx - idx - 1] for idx, next_idx in pairs)
+
+        results[name] = {
+            'matches_per_tick': num_matches / float(ticks),
+            'mean_quality': float(np.mean(qualities)) if qualities else 0.0,
+            'seconds_per_tick': elapsed / ticks,
+        }
+
+    return results
+
+
+def bench_mentor(num_students=10000, num_mentors=1000, seed=0, elo_spread=ELO_RANK_INCREMENT):
+    """
+    Times the mentor engine on a synthetic queue of student and mentor parties
+        - Mentors are drawn from a higher elo curve than students, like real tutors
+        - Returns {pairs, upper_bound, seconds}, upper_bound being min(mentors, students with a mentor in range)
+    """
+    rng = np.random.RandomState(seed)
+    student_elos = rng.normal(ELO_AVG_RATING - elo_spread / 2.0, elo_spread, num_students)
+    mentor_elos = rng.normal(ELO_AVG_RATING + elo_spread / 2.0, elo_spread, num_mentors)
+
+    start = time.perf_counter()
+    pairs = mentor_assign_students(mentor_elos, student_elos, RANGE_EXTENSION)
+    seconds = time.perf_counter() - start
+
+    sorted_mentor_elos = np.sort(mentor_elos)
+    in_range = (np.searchsorted(sorted_mentor_elos, student_elos + RANGE_EXTENSION, side='right') -
+                np.searchsorted(sorted_mentor_elos, student_elos - RANGE_EXTENSION, side='left')) > 0
+
+    return {
+        'students': num_students,
+        'mentors': num_mentors,
+        'pairs': len(pairs),
+        'upper_bound': int(min(num_mentors, in_range.sum())),
+        'seconds': seconds,
+    }
+
+
+def bench_seed_database(num_players, rng, batch_size=BENCH_SEED_BATCH_SIZE):
+    """
+    Seeds users, players, teams and queued parties into an empty database
+        - Each party's players cluster around a party skill drawn from N(ELO_AVG_RATING, ELO_RANK_INCREMENT)
+        - Parties are spread evenly across REGIONS
+        - Returns {'players', 'parties'}
+    """
+    regions = [code for code, name in REGIONS if code is not None]
+    num_parties = num_players // TEAM_SIZE
+    queued_at = timezone.now()
+
+    for first_party in range(0, num_parties, batch_size):
+        party_ids = range(first_party + 1, min(first_party + batch_size, num_parties) + 1)
+        party_mu = rng.normal(ELO_AVG_RATING, ELO_RANK_INCREMENT, (len(party_ids), 1))
+        player_elo = np.maximum(party_mu + rng.normal(0, ELO_INCREMENT_RANGE / 2.0, (len(party_ids), TEAM_SIZE)), 0)
+        player_sigma = rng.uniform(50, ELO_INCREMENT_RANGE, (len(party_ids), TEAM_SIZE))
+        users, players, teams, team_players, parties = [], [], [], [], []
+
+        for row, party_id in enumerate(party_ids):
+            player_ids = [(party_id - 1) * TEAM_SIZE + slot + 1 for slot in range(TEAM_SIZE)]
+            roster = [(player_id, int(player_elo[row, slot]), float(player_sigma[row, slot]))
+                      for slot, player_id in enumerate(player_ids)]
+
+            users.extend(User(id=player_id, username='bench-%s' % player_id) for player_id in player_ids)
+            players.extend(Player(user_id=player_id, elo=elo, elo_weight=sigma) for player_id, elo, sigma in roster)
+            team_players.extend(Team.players.through(team_id=party_id, player_id=player_id)
+                                for player_id in player_ids)
+
+            team = Team(id=party_id, name='bench-%s' % party_id, captain_id=player_ids[0])
+            team.set_rating_vector(roster)
+            teams.append(team)
+
+            party = Party(id=party_id, team_id=party_id, players_id=player_ids[0], is_queued=True,
+                          queued_at=queued_at, region=regions[party_id % len(regions)])
+            party.set_rating_vector(roster)
+            parties.append(party)
+
+        User.objects.bulk_create(users, batch_size=MM_BULK_BATCH_SIZE)
+        Player.objects.bulk_create(players, batch_size=MM_BULK_BATCH_SIZE)
+        Team.objects.bulk_create(teams, batch_size=MM_BULK_BATCH_SIZE)
+        Team.players.through.objects.bulk_create(team_players, batch_size=MM_BULK_BATCH_SIZE)
+        Party.objects.bulk_create(parties, batch_size=MM_BULK_BATCH_SIZE)
+
+    return {'players': num_parties * TEAM_SIZE, 'parties': num_parties}
+
+
+def bench_measure(func, *args):
+    """
+    Runs func(*args) measuring wall time, DB queries and peak Python memory
+        - Returns func's result dict extended with the measurements
+    """
+    counter = TraceQueryCounter()
+    tracemalloc.start()
+    start = time.time()
+
+    try:
+        with connection.execute_wrapper(counter):
+            result = func(*args)
+    finally:
+        seconds = time.time() - start
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    result.update({'seconds': seconds, 'db_queries': counter.count, 'db_time': counter.seconds,
+                   'peak_memory_bytes': peak_memory})
+    return result
+
+
+def bench_skill(segment_size):
+    """ Scores the adjacent pairs of one segment with skill_is_match and with the vectorized quality band """
+    parties = list(Party.objects.filter(pk__in=mm_get_queued_segments(segment_size, overlap=0)[0]))
+    num_pairs = len(parties) - 1
+
+    start = time.time()
+    for idx in range(num_pairs):
+        skill_is_match(parties[idx], parties[idx + 1])
+    pairwise_seconds = time.time() - start
+
+    start = time.time()
+    skill_calculate_quality_matrix(*skill_build_segment_arrays(parties), band=1)
+    vectorized_seconds = time.time() - start
+
+    return {
+        'pairs': num_pairs,
+        'pairwise_pairs_per_sec': num_pairs / pairwise_seconds if pairwise_seconds else None,
+        'vectorized_pairs_per_sec': num_pairs / vectorized_seconds if vectorized_seconds else None,
+    }
+
+
+def bench_process_queue(segment_size):
+    """ Runs the core matchmaking pass over every queued segment """
+    logger = logging.getLogger('%s.mm_benchmark' % APP_NAME)
+    num_matches = 0
+
+    for segment_pks in mm_get_queued_segments(segment_size, overlap=0):
+        num_matches += mm_core_process_queue(Party.objects.filter(pk__in=segment_pks), logger)
+
+    return {'matches': num_matches}
+
+
+def bench_match_quality():
+    """ Returns the quality distribution of every created match """
+    match_teams = {}
+    for slot in MatchTeamSlot.objects.select_related('team').order_by('pk'):
+        match_teams.setdefault(slot.match_id, []).append(slot.team)
+
+    pairs = [teams for teams in match_teams.values() if len(teams) == 2]
+    if not pairs:
+        return {'mean': None, 'percentiles': {}, 'histogram': []}
+
+    roster_sizes, mu_sums, sigma_sq_sums = skill_build_segment_arrays([team for pair in pairs for team in pair])
+    qualities = skill_calculate_quality_matrix(roster_sizes, mu_sums, sigma_sq_sums, band=1)[::2, 0]
+    histogram, edges = np.histogram(qualities, bins=BENCH_QUALITY_BINS, range=(0.0, 1.0))
+
+    return {
+        'mean': float(qualities.mean()),
+        'percentiles': {str(pct): float(np.percentile(qualities, pct)) for pct in (10, 50, 90, 99)},
+        'histogram': [int(count) for count in histogram],
+    }
+
+
+def bench_prepare_results(rng):
+    """ Finishes every created match with a random winner and its roster slots (not timed) """
+    match_teams = {}
+    for match_id, team_id in MatchTeamSlot.objects.order_by('pk').values_list('match_id', 'team_id'):
+        match_teams.setdefault(match_id, []).append(team_id)
+
+    teams = Team.objects.in_bulk([team_id for team_ids in match_teams.values() for team_id in team_ids])
+    matches = list(Match.objects.filter(pk__in=list(match_teams)))
+    roster_slots = []
+
+    for match in matches:
+        match.winner_id = match_teams[match.pk][rng.randint(len(match_teams[match.pk]))]
+        for team_id in match_teams[match.pk]:
+            roster_slots.extend(MatchRosterSlot(match_id=match.pk, team_id=team_id, player_id=player_pk)
+                                for player_pk, mu, sigma in teams[team_id].get_rating_vector())
+
+    Match.objects.bulk_update(matches, ['winner'], batch_size=MM_BULK_BATCH_SIZE)
+    MatchRosterSlot.objects.bulk_create(roster_slots, batch_size=MM_BULK_BATCH_SIZE)
+    return matches
+
+
+def bench_commit_results(matches, batch_size):
+    """ Commits the ratings of every finished match in batches """
+    for first in range(0, len(matches), batch_size):
+        skill_commit_match_results(matches[first:first + batch_size])
+    return {'matches': len(matches)}
+
+
+def bench_run(num_players, seed=0, segment_size=Q_SEGMENT_SIZE, commit_batch_size=MM_BULK_BATCH_SIZE):
+    """
+    Seeds an empty database and times every matchmaking phase against it
+        - Returns a JSON-serializable report
+    """
+    rng = np.random.RandomState(seed)
+    mm_setup_environment()
+    report = {
+        'params': {'players': num_players, 'seed': seed, 'segment_size': segment_size,
+                   'commit_batch_size': commit_batch_size},
+        'phases': {},
+    }
+    phases = report['phases']
+
+    phases['seed'] = bench_measure(bench_seed_database, num_players, rng)
+    queue_index_get()  # Build the queue index outside the timed phases
+    phases['skill'] = bench_measure(bench_skill, segment_size)
+    phases['process_queue'] = bench_measure(bench_process_queue, segment_size)
+
+    matches = bench_prepare_results(rng)
+    phases['commit_results'] = bench_measure(bench_commit_results, matches, commit_batch_size)
+
+    for phase_name in ('process_queue', 'commit_results'):
+        phase = phases[phase_name]
+        phase['matches_per_sec'] = phase['matches'] / phase['seconds'] if phase['seconds'] else None
+        phase['queries_per_match'] = phase['db_queries'] / float(phase['matches']) if phase['matches'] else None
+
+    report['match_quality'] = bench_match_quality()
+    report['mentor'] = bench_mentor(seed=seed)
+    return report
+
+
+def bench_compare(baseline, report):
+    """ Returns {phase: {metric: (baseline, current, ratio)}} for every numeric metric both reports share """
+    comparison = {}
+
+    for phase_name, phase in report['phases'].items():
+        baseline_phase = baseline.get('phases', {}).get(phase_name, {})
+        for metric, value in phase.items():
+            old_value = baseline_phase.get(metric)
+            if isinstance(value, (int, float)) and isinstance(old_value, (int, float)):
+                ratio = value / float(old_value) if old_value else None
+                comparison.setdefault(phase_name, {})[metric] = (old_value, value, ratio)
+
+    return comparison
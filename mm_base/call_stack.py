@@ -1,48 +1,80 @@
 import logging
 
-from .app_settings import APP_NAME
+from django.db import transaction
+from django.db.models.query import QuerySet
+
+from .app_settings import APP_NAME, MM_RESULT_BATCH_SIZE
 from .middleware import MM_QUEUE_STACK, MM_RESULT_STACK
+from .models.core_models import Match
+from .notify import notify_batch
+from .tracing import trace_new_tick, trace_stage
 
 """ -----------------------------------------------------------------------
                                   STACK
     ------------------------------------------------------------------- """
 
 
-def stack_atomic_call_middleware(q_dict, q_queryset, logger, middleware):
-    """ Calls the middleware function atomically.
-            * Returns cached queue on error or None """
-    cached_q_dict = q_dict[:]
-    cached_q_query = q_queryset.all()
+def stack_atomic_call_middleware(q_dict, q_queryset, logger, name, middleware, tick=None):
+    """ Calls the middleware function atomically, inside a DB savepoint
+            * The middleware works on its own copy of q_dict's key map. Sub-queues
+              are lazy querysets, which are never changed in place, so the copy is
+              all the snapshot a rollback needs
+            * A middleware may return a QuerySet to replace the main queue
+            * Returns the stage's [q_dict, q_queryset], or the untouched input on error
+    """
+    stage_q_dict = dict(q_dict)
+
+    def count_parties():
+        return q_queryset.filter(current_match=None).count()
 
     try:
-        middleware(q_dict, q_queryset, logger)
-    except:
-        logger.error('MM_STACK: Middleware exception occurred in %s' % middleware.__name__)
-        return [cached_q_dict, cached_q_query]
+        with trace_stage(tick, 'queue', name, count_parties):
+            with transaction.atomic():
+                result = middleware(stage_q_dict, q_queryset, logger)
+    except Exception:
+        logger.exception('MM_STACK: Middleware exception occurred in %s' % name)
+        # Savepoint is rolled back. Re-clone sub-queues so no stale result cache survives
+        return [{q_name: queue.all() for q_name, queue in q_dict.items()}, q_queryset.all()]
 
-    return None
+    if isinstance(result, QuerySet):
+        q_queryset = result
+
+    return [stage_q_dict, q_queryset]
 
 
 def call_stack(queue_segment_queryset):
-    """ Calls the middleware stack to build queues """
+    """ Calls the middleware stack to build queues, in MM_QUEUE_STACK order """
     q_queryset = queue_segment_queryset
     q_dict = {}  # dictionary of player lists / queues
     stack_logger = logging.getLogger('%s.mm_call_stack' % APP_NAME)  # logger instance
+    tick = trace_new_tick()
 
-    for func in MM_QUEUE_STACK:
-        cached_queue = stack_atomic_call_middleware(q_dict, q_queryset, stack_logger, func)
-        # Restore previous Q state if middleware exception occurs
-        if cached_queue is not None:
-            q_dict = cached_queue[0]
-            q_queryset = cached_queue[1]
+    # Teams of every match made by the stack are notified together, once it completes
+    with notify_batch(tick):
+        for name, func in MM_QUEUE_STACK:
+            # Previous Q state is restored if middleware exception occurs
+            q_dict, q_queryset = stack_atomic_call_middleware(q_dict, q_queryset, stack_logger, name, func, tick)
 
 
-def call_result_stack(match):
-    """ Calls the result stack to process matches """
+def call_result_stack(matches):
+    """ Calls the result stack to process a batch of matches (or a single match), in MM_RESULT_STACK order """
     stack_logger = logging.getLogger('%s.mm_result_stack' % APP_NAME)  # logger instance
+    tick = trace_new_tick()
+    matches = [matches] if isinstance(matches, Match) else list(matches)
+
+    for name, func in MM_RESULT_STACK:
+        try:
+            with trace_stage(tick, 'result', name):
+                with transaction.atomic():
+                    func(matches, stack_logger)
+        except Exception:
+            stack_logger.exception('MM_STACK: Result middleware exception occurred in %s' % name)
+
 
-    for func in MM_RESULT_STACK:
-        func(match, stack_logger)
+def call_result_stack_batched(match_ids, batch_size=MM_RESULT_BATCH_SIZE):
+    """ Calls the result stack on closed matches, batch_size matches at a time """
+    for first in range(0, len(match_ids), batch_size):
+        call_result_stack(Match.objects.filter(pk__in=match_ids[first:first + batch_size]).order_by('pk'))
 
 """
 def mm_build_sub_queue(q_dict, original_q, exclusion_list, q_name, logger):
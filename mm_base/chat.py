@@ -0,0 +1,183 @@
+"""
+Coalescing, back-pressured relay of team and match chat
+
+Chat consumers post messages here instead of sending them one by one:
+
+    * Each chat channel (group) has a bounded queue of CHAT_QUEUE_SIZE pending messages.
+      When full, the new message is rejected and its sender told to slow down, or the
+      oldest pending message is dropped (CHAT_OVERFLOW)
+    * Every CHAT_COALESCE_WINDOW a flusher thread sends each channel's pending messages
+      as ONE group message, so a busy lobby costs the layer one send per window rather
+      than one per message, and match notifications are not starved
+    * Per-channel throughput is logged every CHAT_REPORT_INTERVAL
+    * A channel's counters are dropped when the last socket this process saw join it
+      leaves, or its match is over
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from channels import Group
+
+from .app_settings import APP_NAME, OP_CHAT_MSG, CHAT_COALESCE_WINDOW, CHAT_QUEUE_SIZE, CHAT_OVERFLOW, \
+    CHAT_MAX_LENGTH, CHAT_REPORT_INTERVAL
+
+
+class ChatChannelStats(object):
+    """ Counters of one chat channel """
+    __slots__ = ('received', 'sent', 'sends', 'dropped', 'rejected')
+
+    def __init__(self):
+        self.received = 0  # Messages posted
+        self.sent = 0  # Messages delivered to the layer
+        self.sends = 0  # Layer sends (one per coalesced batch)
+        self.dropped = 0  # Oldest messages dropped on overflow
+        self.rejected = 0  # New messages refused on overflow (sender told to slow down)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def chat_group_send(group_name, messages):
+    """ Sends a channel's coalesced messages as one group message """
+    Group(group_name).send({'text': json.dumps({'op': OP_CHAT_MSG, 'messages': messages})})
+
+
+class ChatRelay(object):
+    """ Process-wide chat relay, see the module docstring """
+
+    def __init__(self, send=chat_group_send, window=CHAT_COALESCE_WINDOW, queue_size=CHAT_QUEUE_SIZE,
+                 overflow=CHAT_OVERFLOW, report_interval=CHAT_REPORT_INTERVAL, logger=None):
+        self.send = send
+        self.window = window
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.report_interval = report_interval
+        self.logger = logger or logging.getLogger('%s.mm_chat' % APP_NAME)
+
+        self._pending = {}  # group name -> deque of messages
+        self._stats = {}  # group name -> ChatChannelStats
+        self._members = {}  # group name -> sockets joined through this process
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._last_report = time.time()
+        self._report_stats = {}  # group name -> (received, sent) at the last report
+
+    def post(self, group_name, sender, text):
+        """
+        Queues a chat message for its channel
+            - Frames whose text is not a non-empty str are dropped
+            - Returns False if the channel is full and the sender should slow down
+        """
+        if not isinstance(text, str) or not text:
+            return True
+
+        message = {'sender': sender, 'text': text[:CHAT_MAX_LENGTH], 'time': time.time()}
+
+        with self._lock:
+            stats = self._stats.setdefault(group_name, ChatChannelStats())
+            pending = self._pending.setdefault(group_name, deque())
+            stats.received += 1
+
+            if len(pending) >= self.queue_size:
+                if self.overflow == 'drop':
+                    pending.popleft()
+                    stats.dropped += 1
+                else:
+                    stats.rejected += 1
+                    return False
+
+            pending.append(message)
+
+        self._start_flusher()
+        return True
+
+    def flush(self):
+        """ Sends every channel's pending messages, one layer send per channel """
+        with self._lock:
+            batches, self._pending = self._pending, {}
+
+        for group_name, messages in batches.items():
+            if not messages:
+                continue
+            try:
+                self.send(group_name, list(messages))
+            except Exception:
+                self.logger.exception('MM_CHAT: Send to %s failed, %s messages lost' % (group_name, len(messages)))
+                continue
+
+            with self._lock:
+                stats = self._stats.get(group_name)
+                if stats is not None:  # Not closed meanwhile
+                    stats.sent += len(messages)
+                    stats.sends += 1
+
+        return sum(len(messages) for messages in batches.values())
+
+    def join(self, group_name):
+        """ Counts a socket joining a channel """
+        with self._lock:
+            self._members[group_name] = self._members.get(group_name, 0) + 1
+
+    def leave(self, group_name, is_closed=False):
+        """ Counts a socket leaving a channel, closes the channel once empty or is_closed (match over) """
+        with self._lock:
+            members = self._members.get(group_name, 0) - 1
+            if members > 0 and not is_closed:
+                self._members[group_name] = members
+                return
+
+            # Pending messages are still sent by the next flush
+            self._members.pop(group_name, None)
+            self._stats.pop(group_name, None)
+            self._report_stats.pop(group_name, None)
+
+    def get_stats(self):
+        """ Returns {group name: counters} """
+        with self._lock:
+            return {group_name: stats.as_dict() for group_name, stats in self._stats.items()}
+
+    def report(self):
+        """ Logs each channel's throughput since the last report, in messages per second """
+        now = time.time()
+        elapsed = max(now - self._last_report, 1e-9)
+        stats = self.get_stats()
+
+        for group_name, counters in sorted(stats.items()):
+            received, sent = self._report_stats.get(group_name, (0, 0))
+            if counters['received'] == received:
+                continue
+            self.logger.info('MM_CHAT: %s in %.1f/s out %.1f/s sends %s dropped %s rejected %s' % (
+                group_name, (counters['received'] - received) / elapsed, (counters['sent'] - sent) / elapsed,
+                counters['sends'], counters['dropped'], counters['rejected']))
+
+        self._report_stats = {group_name: (counters['received'], counters['sent'])
+                              for group_name, counters in stats.items()}
+        self._last_report = now
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, name='mm-chat-relay')
+                self._flusher.daemon = True
+                self._flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.window)
+            self.flush()
+            if time.time() - self._last_report >= self.report_interval:
+                self.report()
+
+
+_chat_relay = ChatRelay()
+
+
+def chat_get_relay():
+    """ Returns the process' chat relay """
+    return _chat_relay
@@ -0,0 +1,96 @@
+import json
+
+from channels import Group
+from channels.auth import channel_session_user, channel_session_user_from_http
+
+from .app_settings import CHAN_TEAM_Q_STATUS, CHAN_TEAM_Q_CHAT, CHAN_TEAM_Q_MATCH_CHAT, OP_CHAT_MSG, \
+    OP_CHAT_SLOW_DOWN, CHAT_COALESCE_WINDOW
+from .chat import chat_get_relay
+from .models.core_models import Team, Match
+
+
+def ws_is_team_member(user, team_name):
+    return user.is_authenticated and Team.objects.filter(name=team_name, players__user=user).exists()
+
+
+def ws_is_match_player(user, match_pk):
+    return user.is_authenticated and Match.objects.filter(pk=match_pk, teams__players__user=user).exists()
+
+
+def ws_subscribe(message, group_name, is_allowed):
+    """ Accepts the socket into group_name, or closes it """
+    if is_allowed:
+        Group(group_name).add(message.reply_channel)
+        message.reply_channel.send({'accept': True})
+    else:
+        message.reply_channel.send({'close': True})
+    return is_allowed
+
+
+def ws_subscribe_chat(message, group_name, is_allowed):
+    if ws_subscribe(message, group_name, is_allowed):
+        chat_get_relay().join(group_name)
+
+
+def ws_unsubscribe_chat(message, group_name, is_closed=False):
+    Group(group_name).discard(message.reply_channel)
+    chat_get_relay().leave(group_name, is_closed)
+
+
+def ws_relay_chat(message, group_name):
+    """ Posts a chat frame to the relay, telling the sender to slow down when the channel is full """
+    try:
+        frame = json.loads(message.content['text'])
+    except (KeyError, ValueError):
+        return
+
+    if not isinstance(frame, dict) or frame.get('op') != OP_CHAT_MSG:
+        return
+
+    if not chat_get_relay().post(group_name, message.user.username, frame.get('text')):
+        message.reply_channel.send({'text': json.dumps({'op': OP_CHAT_SLOW_DOWN,
+                                                        'retry_after': CHAT_COALESCE_WINDOW})})
+
+
+@channel_session_user_from_http
+def ws_team_status_connect(message, team_name):
+    """ Subscribes a team member's socket to the team's status group (new match notifications) """
+    ws_subscribe(message, CHAN_TEAM_Q_STATUS + team_name, ws_is_team_member(message.user, team_name))
+
+
+@channel_session_user
+def ws_team_status_disconnect(message, team_name):
+    Group(CHAN_TEAM_Q_STATUS + team_name).discard(message.reply_channel)
+
+
+@channel_session_user_from_http
+def ws_team_chat_connect(message, team_name):
+    ws_subscribe_chat(message, CHAN_TEAM_Q_CHAT + team_name, ws_is_team_member(message.user, team_name))
+
+
+@channel_session_user
+def ws_team_chat_receive(message, team_name):
+    ws_relay_chat(message, CHAN_TEAM_Q_CHAT + team_name)
+
+
+@channel_session_user
+def ws_team_chat_disconnect(message, team_name):
+    ws_unsubscribe_chat(message, CHAN_TEAM_Q_CHAT + team_name)
+
+
+@channel_session_user_from_http
+def ws_match_chat_connect(message, match_pk):
+    """ Both teams of a match share its chat """
+    ws_subscribe_chat(message, CHAN_TEAM_Q_MATCH_CHAT + match_pk, ws_is_match_player(message.user, match_pk))
+
+
+@channel_session_user
+def ws_match_chat_receive(message, match_pk):
+    ws_relay_chat(message, CHAN_TEAM_Q_MATCH_CHAT + match_pk)
+
+
+@channel_session_user
+def ws_match_chat_disconnect(message, match_pk):
+    # A match that is over (or archived) closes its chat
+    ws_unsubscribe_chat(message, CHAN_TEAM_Q_MATCH_CHAT + match_pk,
+                        not Match.objects.filter(pk=match_pk, end_time=None).exists())
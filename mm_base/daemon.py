@@ -0,0 +1,254 @@
+"""
+Event-driven matchmaker, an alternative to the batch ticks of tasks.py
+
+A long-running asyncio loop that matches parties as soon as they queue:
+
+    * Enqueue / leave events come from the queue index, synced every MM_DAEMON_POLL_INTERVAL.
+      Code running in the daemon's process may also post events directly
+    * Arrivals are gathered for MM_DAEMON_BATCH_WINDOW, then paired against their elo
+      neighbours in the live queue by mm_core_process_queue, the batch tick's own pairing
+    * Every MM_DAEMON_SWEEP_INTERVAL the whole queue runs through call_stack like a batch
+      tick, so unmatched parties are still expedited and eventually forced
+    * Median time-to-match is logged every MM_DAEMON_REPORT_INTERVAL
+
+ORM calls run on one worker thread, so the event loop never blocks on the DB
+"""
+import asyncio
+import logging
+import random
+import statistics
+import time
+import uuid
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, transaction
+
+from .app_settings import APP_NAME, Q_SEGMENT_SIZE, MM_PAIRING_ELO_WINDOW, MM_DAEMON_BATCH_WINDOW, \
+    MM_DAEMON_POLL_INTERVAL, MM_DAEMON_NEIGHBOURS, MM_DAEMON_SWEEP_INTERVAL, MM_DAEMON_REPORT_INTERVAL, \
+    MM_DAEMON_STATS_SIZE
+from .call_stack import call_stack
+from .matchmaking import mm_get_queued_segments, mm_claim_parties, mm_release_parties
+from .models.core_middleware import mm_core_process_queue
+from .models.core_models import Party
+from .notify import notify_batch
+from .queue_index import queue_index_get
+from .tracing import trace_new_tick, trace_stage
+
+DAEMON_ENQUEUE = 'enqueue'
+DAEMON_LEAVE = 'leave'  # Dequeued without a match
+DAEMON_MATCHED = 'matched'  # Matched by anyone (daemon, sweep or a batch worker)
+
+
+def daemon_read_queue_changes(known_pks):
+    """
+    Syncs the queue index and diffs it against the pks queued at the last read
+        - Returns (queued, entered, matched, left) sets of party pks
+    """
+    queued = queue_index_get().get_pks()
+    gone = known_pks - queued
+    matched = set(Party.objects.filter(pk__in=gone).exclude(current_match=None)
+                  .values_list('pk', flat=True)) if gone else set()
+
+    return queued, queued - known_pks, matched, gone - matched
+
+
+def daemon_get_candidates(arrival_pks, neighbours=MM_DAEMON_NEIGHBOURS, elo_window=MM_PAIRING_ELO_WINDOW):
+    """ Returns the arrivals and up to neighbours queued parties on each side of them, inside the elo window """
+    queue_index = queue_index_get(sync=False)
+    candidate_pks = set()
+
+    for pk in arrival_pks:
+        location = queue_index.get_location(pk)
+        if location is None:
+            continue  # Left or matched since it arrived
+
+        region, elo = location
+        region_pks = queue_index.get_range(region, elo - elo_window, elo + elo_window)
+        if pk not in region_pks:
+            continue  # Claimed by a batch worker
+
+        position = region_pks.index(pk)
+        candidate_pks.update(region_pks[max(position - neighbours, 0):position + neighbours + 1])
+
+    return candidate_pks
+
+
+def daemon_match_arrivals(arrival_pks, logger, neighbours=MM_DAEMON_NEIGHBOURS):
+    """
+    Pairs newly queued parties against their neighbours in the live queue
+        - Candidates are claimed first, so batch workers never pair the same parties
+        - Returns the pks of matched parties
+    """
+    candidate_pks = daemon_get_candidates(arrival_pks, neighbours)
+    if len(candidate_pks) < 2:
+        return set()
+
+    claim_token = uuid.uuid4().hex
+    tick = trace_new_tick()
+
+    try:
+        claimed = mm_claim_parties(list(candidate_pks), claim_token)
+        region_pks = defaultdict(list)
+        for party_pk, region in claimed.values_list('pk', 'region'):
+            region_pks[region].append(party_pk)
+
+        with notify_batch(tick):
+            for region, party_pks in region_pks.items():
+                if len(party_pks) < 2:
+                    continue
+                with trace_stage(tick, 'daemon', 'match_arrivals'):
+                    with transaction.atomic():
+                        mm_core_process_queue(claimed.filter(pk__in=party_pks), logger, 'daemon-%s' % region)
+
+        return set(claimed.exclude(current_match=None).values_list('pk', flat=True))
+    finally:
+        mm_release_parties(claim_token)
+
+
+def daemon_sweep_queue(segment_size=Q_SEGMENT_SIZE):
+    """ Runs the whole queue through call_stack, segment by segment, like a batch tick """
+    segments = mm_get_queued_segments(segment_size, offset=random.randrange(segment_size))
+
+    with notify_batch():
+        for segment_pk in segments:
+            claim_token = uuid.uuid4().hex
+            try:
+                call_stack(mm_claim_parties(segment_pk, claim_token))
+            finally:
+                mm_release_parties(claim_token)
+
+    return len(segments)
+
+
+class MatchmakerDaemon(object):
+    """ Long-running asyncio matchmaker, see the module docstring """
+
+    def __init__(self, batch_window=MM_DAEMON_BATCH_WINDOW, poll_interval=MM_DAEMON_POLL_INTERVAL,
+                 sweep_interval=MM_DAEMON_SWEEP_INTERVAL, report_interval=MM_DAEMON_REPORT_INTERVAL, logger=None):
+        self.batch_window = batch_window
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self.report_interval = report_interval
+        self.logger = logger or logging.getLogger('%s.mm_daemon' % APP_NAME)
+
+        self.waiting = {}  # pk -> time the daemon saw the party queue
+        self.match_times = deque(maxlen=MM_DAEMON_STATS_SIZE)  # Recent time-to-match samples, in seconds
+        self.num_matched = 0  # Parties matched since start
+        self._known_pks = set()
+        self._events = None
+        self._loop = None
+        self._tasks = []
+        self._db_executor = ThreadPoolExecutor(max_workers=1)
+
+    def post_event(self, op, party_pk):
+        """ Posts an enqueue / leave / matched event, from any thread """
+        self._loop.call_soon_threadsafe(self._events.put_nowait, (op, party_pk))
+
+    def get_stats(self):
+        """ Returns the daemon's time-to-match stats """
+        return {
+            'matched': self.num_matched,
+            'waiting': len(self.waiting),
+            'median_time_to_match': statistics.median(self.match_times) if self.match_times else None,
+        }
+
+    def call_db(self, func, *args):
+        """ Runs func on the DB thread, returning an awaitable of its result """
+        def job():
+            close_old_connections()  # The daemon outlives CONN_MAX_AGE, drop broken or expired connections
+            return func(*args)
+
+        return self._loop.run_in_executor(self._db_executor, job)
+
+    async def run(self):
+        """ Runs until stop() is called """
+        self._loop = asyncio.get_event_loop()
+        self._events = asyncio.Queue()
+        self._tasks = [asyncio.ensure_future(coroutine) for coroutine in
+                       (self._poll_queue(), self._match_arrivals(), self._sweep(), self._report())]
+
+        try:
+            await asyncio.gather(*self._tasks)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._db_executor.shutdown(wait=True)
+            self.logger.info('MM_DAEMON: Stopped %s' % self.get_stats())
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def _record_matched(self, party_pks, now=None):
+        now = time.time() if now is None else now
+        for pk in party_pks:
+            queued_at = self.waiting.pop(pk, None)
+            if queued_at is not None:
+                self.match_times.append(now - queued_at)
+                self.num_matched += 1
+
+    def _apply_event(self, op, party_pk, arrivals):
+        if op == DAEMON_ENQUEUE:
+            self.waiting.setdefault(party_pk, time.time())
+            arrivals.add(party_pk)
+        elif op == DAEMON_MATCHED:
+            self._record_matched([party_pk])
+            arrivals.discard(party_pk)
+        else:
+            self.waiting.pop(party_pk, None)
+            arrivals.discard(party_pk)
+
+    async def _poll_queue(self):
+        """ Turns queue index changes into events """
+        while True:
+            try:
+                queued, entered, matched, left = await self.call_db(daemon_read_queue_changes, self._known_pks)
+                self._known_pks = queued
+                for op, party_pks in ((DAEMON_ENQUEUE, entered), (DAEMON_MATCHED, matched), (DAEMON_LEAVE, left)):
+                    for pk in party_pks:
+                        self._events.put_nowait((op, pk))
+            except Exception:
+                self.logger.exception('MM_DAEMON: Queue poll failed')
+
+            await asyncio.sleep(self.poll_interval)
+
+    async def _match_arrivals(self):
+        """ Gathers arrivals for batch_window after the first event, then pairs them """
+        while True:
+            arrivals = set()
+            self._apply_event(*(await self._events.get()), arrivals=arrivals)
+            deadline = self._loop.time() + self.batch_window
+
+            while True:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self._events.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                self._apply_event(*event, arrivals=arrivals)
+
+            if arrivals:
+                try:
+                    matched = await self.call_db(daemon_match_arrivals, arrivals, self.logger)
+                    self._record_matched(matched)
+                except Exception:
+                    self.logger.exception('MM_DAEMON: Matching %s arrivals failed' % len(arrivals))
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.call_db(daemon_sweep_queue)
+            except Exception:
+                self.logger.exception('MM_DAEMON: Queue sweep failed')
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            stats = self.get_stats()
+            self.logger.info('MM_DAEMON: %s parties matched, %s waiting, median time-to-match %s' % (
+                stats['matched'], stats['waiting'], '%.2fs' % stats['median_time_to_match']
+                if stats['median_time_to_match'] is not None else 'n/a'))
@@ -0,0 +1,127 @@
+"""
+Queue lanes of the core matchmaker
+
+Every queued party sits in one of MM_LANES, checked in order:
+    * plus : a player of the party is a Plus member
+    * expedited : the party was passed over at least once
+    * normal : everyone else
+
+Lanes share one pairing graph, so parties still match across lanes. A party's lane sets:
+    * How fast its fairness threshold widens with wait, from ELO_DEFAULT_FAIRNESS_THRESHOLD
+      down to MM_LANE_FAIRNESS_FLOOR at target / gain, where its match is forced. A lane's
+      gain is raised each tick its measured p99 wait is over target, and eased off while
+      it's comfortably under, trading tail wait for match quality as load changes
+    * Its max wait: matches are forced by MM_LANE_MAX_WAIT_FACTOR times the target at the latest
+    * Its priority when partners are contested: lane weight * (1 + wait / target), so lanes
+      are served by weight and a long waiter of a light lane still overtakes fresh parties
+      of a heavy one
+
+Gains and wait samples are per process, each worker steers on the waits it sees
+"""
+import threading
+from collections import deque
+
+import numpy as np
+
+from .app_settings import ELO_DEFAULT_FAIRNESS_THRESHOLD, ELO_EXPEDITED_MAX_PASSES, MM_LANES, \
+    MM_LANE_FAIRNESS_FLOOR, MM_LANE_MAX_WAIT_FACTOR, MM_LANE_WAIT_SAMPLES, MM_LANE_MIN_SAMPLES, MM_LANE_GAIN_STEP, \
+    MM_LANE_GAIN_RANGE, MM_LANE_TARGET_SLACK
+from plus_membership.services import plus_get_memberships
+
+
+class LaneScheduler(object):
+    """ Per-lane wait samples and widening gains, turned into the thresholds and priorities of a segment """
+
+    def __init__(self, lanes=MM_LANES, num_samples=MM_LANE_WAIT_SAMPLES):
+        self.names = [name for name, weight, target in lanes]
+        self.weights = np.array([weight for name, weight, target in lanes], dtype=float)
+        self.targets = np.array([target for name, weight, target in lanes], dtype=float)
+        self.gains = np.ones(len(lanes))
+        self._waits = [deque(maxlen=num_samples) for lane in lanes]  # Waits of matched parties, per lane
+        self._lock = threading.Lock()
+
+    def get_lane(self, name):
+        return self.names.index(name)
+
+    def build(self, lanes, waits):
+        """
+        Builds the pairing inputs of a segment
+            - lanes : lane index per party, waits : seconds queued per party
+            - Returns (thresholds, passes, priorities). Passes are ELO_EXPEDITED_MAX_PASSES for
+              parties whose match is forced, else 0
+        """
+        lanes = np.asarray(lanes, dtype=int)
+        waits = np.maximum(np.asarray(waits, dtype=float), 0)
+        targets = self.targets[lanes]
+
+        with self._lock:
+            progress = self.gains[lanes] * waits / targets
+
+        widening = ELO_DEFAULT_FAIRNESS_THRESHOLD - MM_LANE_FAIRNESS_FLOOR
+        thresholds = ELO_DEFAULT_FAIRNESS_THRESHOLD - widening * np.minimum(progress, 1.0)
+        is_forced = (progress >= 1.0) | (waits >= MM_LANE_MAX_WAIT_FACTOR * targets)
+        passes = np.where(is_forced, ELO_EXPEDITED_MAX_PASSES, 0)
+        priorities = self.weights[lanes] * (1.0 + waits / targets)
+
+        return thresholds, passes, priorities
+
+    def observe(self, lanes, waits, is_matched):
+        """
+        Records a tick's outcome and steers each lane's gain towards its p99 target
+            - Matched parties add their wait to the lane's samples
+            - Parties still waiting count with their wait so far, so a growing tail is seen
+              before those parties are matched
+        """
+        lanes = np.asarray(lanes, dtype=int)
+        waits = np.asarray(waits, dtype=float)
+        is_matched = np.asarray(is_matched, dtype=bool)
+        min_gain, max_gain = MM_LANE_GAIN_RANGE
+
+        with self._lock:
+            for lane in np.unique(lanes):
+                in_lane = lanes == lane
+                self._waits[lane].extend(waits[in_lane & is_matched].tolist())
+
+                samples = list(self._waits[lane]) + waits[in_lane & ~is_matched].tolist()
+                if len(samples) < MM_LANE_MIN_SAMPLES:
+                    continue
+
+                p99 = np.percentile(samples, 99)
+                if p99 > self.targets[lane]:
+                    self.gains[lane] = min(self.gains[lane] * MM_LANE_GAIN_STEP, max_gain)
+                elif p99 < self.targets[lane] * MM_LANE_TARGET_SLACK:
+                    self.gains[lane] = max(self.gains[lane] / MM_LANE_GAIN_STEP, min_gain)
+
+    def get_stats(self):
+        """ Returns {lane name: {'weight', 'target', 'gain', 'samples', 'p99'}} """
+        with self._lock:
+            return {name: {'weight': float(self.weights[lane]), 'target': float(self.targets[lane]),
+                           'gain': float(self.gains[lane]), 'samples': len(self._waits[lane]),
+                           'p99': float(np.percentile(self._waits[lane], 99)) if self._waits[lane] else None}
+                    for lane, name in enumerate(self.names)}
+
+
+_lane_scheduler = LaneScheduler()
+
+
+def lane_get_scheduler():
+    """ Returns the process' lane scheduler """
+    return _lane_scheduler
+
+
+def lane_classify(is_plus, passes, scheduler=_lane_scheduler):
+    """ Returns the lane index of each party from its Plus flag and expedite passes """
+    return np.where(np.asarray(is_plus, dtype=bool), scheduler.get_lane('plus'),
+                    np.where(np.asarray(passes) > 0, scheduler.get_lane('expedited'), scheduler.get_lane('normal')))
+
+
+def lane_build_plus_flags(parties):
+    """ Flags parties holding a Plus member, with one batched membership lookup for the whole segment """
+    rosters = [[entry[0] for entry in party.get_rating_vector()] for party in parties]
+    memberships = plus_get_memberships({player_pk for roster in rosters for player_pk in roster})
+    return np.array([any(memberships[player_pk] for player_pk in roster) for roster in rosters], dtype=bool)
+
+
+def lane_build_waits(parties, now):
+    """ Builds the vector of seconds each party has been queued. Parties without queued_at wait since queue_updated """
+    return np.array([(now - (party.queued_at or party.queue_updated)).total_seconds() for party in parties])
@@ -0,0 +1,203 @@
+"""
+Rating histogram backing the leaderboard, skill curve ends and percentiles
+
+Player elo is counted in fine LEADERBOARD_SUB_BUCKET buckets (nested in ELO_RANK_INCREMENT
+rank buckets) held in a Fenwick tree, so min / max, rank, percentile and the top-K cutoff
+are O(log n) with no Player table scan.
+
+    * Rating commits, new and deleted players update the process' histogram incrementally
+    * Each process rebuilds from one GROUP BY query on first use and once its histogram is
+      older than LEADERBOARD_MAX_AGE, which also picks up commits made by other processes
+    * mm_rebuild_leaderboard / task_rebuild_leaderboard reconcile it against the Player table
+"""
+import threading
+import time
+
+from django.db import transaction
+from django.db.models import Count
+
+from .app_settings import ELO_RANK_INCREMENT, LEADERBOARD_MIN_ELO, LEADERBOARD_MAX_ELO, LEADERBOARD_SUB_BUCKET, \
+    LEADERBOARD_MAX_AGE
+from .models.core_models import Player
+
+
+class RatingHistogram(object):
+    """ Player counts per fine elo bucket, in a Fenwick tree """
+
+    def __init__(self, min_elo=LEADERBOARD_MIN_ELO, max_elo=LEADERBOARD_MAX_ELO, sub_bucket=LEADERBOARD_SUB_BUCKET,
+                 rank_increment=ELO_RANK_INCREMENT):
+        self.min_elo = min_elo
+        self.sub_bucket = sub_bucket
+        self.rank_increment = rank_increment
+        self.size = -(-(max_elo - min_elo) // sub_bucket)  # Ceil, elo outside the range lands in an end bucket
+        self.total = 0
+        self.built_at = None
+        self._counts = [0] * self.size
+        self._tree = [0] * (self.size + 1)  # 1-indexed Fenwick tree of _counts
+        self._lock = threading.RLock()
+
+    def get_bucket(self, elo):
+        return min(max(int((elo - self.min_elo) // self.sub_bucket), 0), self.size - 1)
+
+    def get_bucket_elo(self, bucket):
+        """ Lowest elo of a bucket """
+        return self.min_elo + bucket * self.sub_bucket
+
+    def add(self, elo, count=1):
+        with self._lock:
+            bucket = self.get_bucket(elo)
+            self._counts[bucket] += count
+            self.total += count
+            idx = bucket + 1
+            while idx <= self.size:
+                self._tree[idx] += count
+                idx += idx & -idx
+
+    def remove(self, elo, count=1):
+        self.add(elo, -count)
+
+    def move(self, old_elo, new_elo):
+        """ Moves a player whose rating changed """
+        if self.get_bucket(old_elo) != self.get_bucket(new_elo):
+            with self._lock:
+                self.remove(old_elo)
+                self.add(new_elo)
+
+    def rebuild(self, elo_counts):
+        """ Rebuilds from [(elo, count)] in O(n) """
+        counts = [0] * self.size
+        for elo, count in elo_counts:
+            counts[self.get_bucket(elo)] += count
+
+        tree = [0] + counts
+        for idx in range(1, self.size + 1):
+            parent = idx + (idx & -idx)
+            if parent <= self.size:
+                tree[parent] += tree[idx]
+
+        with self._lock:
+            self._counts, self._tree, self.total = counts, tree, sum(counts)
+            self.built_at = time.time()
+
+    def count_through(self, bucket):
+        """ Players in buckets 0..bucket """
+        with self._lock:
+            total = 0
+            idx = bucket + 1
+            while idx > 0:
+                total += self._tree[idx]
+                idx -= idx & -idx
+            return total
+
+    def find_bucket(self, position):
+        """ Bucket holding the position-th lowest player (1-indexed), by binary lifting """
+        with self._lock:
+            bucket = 0
+            step = 1 << self.size.bit_length()
+            while step:
+                if bucket + step <= self.size and self._tree[bucket + step] < position:
+                    bucket += step
+                    position -= self._tree[bucket]
+                step >>= 1
+            return bucket
+
+    def get_min_elo(self):
+        return self.get_bucket_elo(self.find_bucket(1)) if self.total else None
+
+    def get_max_elo(self):
+        return self.get_bucket_elo(self.find_bucket(self.total)) if self.total else None
+
+    def get_rank(self, elo):
+        """ 1 + players in higher buckets, players sharing a bucket tie """
+        return 1 + self.total - self.count_through(self.get_bucket(elo))
+
+    def get_percentile(self, elo):
+        """ Percent of players below elo, counting half of its bucket """
+        if not self.total:
+            return None
+        bucket = self.get_bucket(elo)
+        below = self.count_through(bucket - 1) if bucket else 0
+        return 100.0 * (below + 0.5 * self._counts[bucket]) / self.total
+
+    def get_rank_cutoff(self, rank):
+        """ Lowest bucket elo reached by the top rank players """
+        if not self.total:
+            return None
+        return self.get_bucket_elo(self.find_bucket(max(self.total - rank + 1, 1)))
+
+    def get_rank_counts(self):
+        """ Players per ELO_RANK_INCREMENT bucket, {bucket elo: count} """
+        rank_counts = {}
+        with self._lock:
+            for bucket, count in enumerate(self._counts):
+                if count:
+                    elo = self.get_bucket_elo(bucket)
+                    rank_elo = (elo // self.rank_increment) * self.rank_increment
+                    rank_counts[rank_elo] = rank_counts.get(rank_elo, 0) + count
+        return rank_counts
+
+    def get_counts(self):
+        with self._lock:
+            return list(self._counts)
+
+
+_histogram = RatingHistogram()
+
+
+def leaderboard_rebuild(histogram=_histogram):
+    """
+    Rebuilds a histogram from the Player table
+        - Returns the number of players that sat in the wrong bucket (drift of incremental updates)
+    """
+    previous = histogram.get_counts() if histogram.built_at is not None else None
+    histogram.rebuild(Player.objects.values('elo').annotate(count=Count('pk')).values_list('elo', 'count'))
+
+    if previous is None:
+        return 0
+    return sum(abs(old - new) for old, new in zip(previous, histogram.get_counts())) // 2
+
+
+def leaderboard_get(max_age=LEADERBOARD_MAX_AGE):
+    """ Returns the process' histogram, rebuilt first if never built or older than max_age seconds """
+    if _histogram.built_at is None or time.time() - _histogram.built_at > max_age:
+        leaderboard_rebuild(_histogram)
+    return _histogram
+
+
+def leaderboard_apply_rating_changes(elo_changes):
+    """ Moves players once their rating commit is durable. elo_changes : [(old elo, new elo)] """
+    def apply_changes():
+        if _histogram.built_at is None:
+            return  # Built from the table on first use
+        for old_elo, new_elo in elo_changes:
+            _histogram.move(old_elo, new_elo)
+
+    transaction.on_commit(apply_changes)
+
+
+def leaderboard_add_player(elo):
+    transaction.on_commit(lambda: _histogram.add(elo) if _histogram.built_at is not None else None)
+
+
+def leaderboard_remove_player(elo):
+    transaction.on_commit(lambda: _histogram.remove(elo) if _histogram.built_at is not None else None)
+
+
+def leaderboard_get_rank(elo):
+    return leaderboard_get().get_rank(elo)
+
+
+def leaderboard_get_percentile(elo):
+    return leaderboard_get().get_percentile(elo)
+
+
+def leaderboard_get_top(num_players):
+    """ Top num_players players, best first. The histogram cutoff keeps the query on the elo index """
+    cutoff = leaderboard_get().get_rank_cutoff(num_players)
+    if cutoff is None:
+        return []
+
+    top_players = Player.objects.order_by('-elo', 'pk')
+    if cutoff > LEADERBOARD_MIN_ELO:
+        top_players = top_players.filter(elo__gte=cutoff)
+    return list(top_players[:num_players])
@@ -0,0 +1,30 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...app_settings import MM_ARCHIVE_DIR, MM_ARCHIVE_AFTER_DAYS, MM_ARCHIVE_CHUNK_SIZE
+from ...archive import archive_matches
+
+
+class Command(BaseCommand):
+    help = 'Moves completed matches out of the hot match tables into columnar .npz archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=MM_ARCHIVE_AFTER_DAYS,
+                            help='Archive matches closed more than this many days ago')
+        parser.add_argument('--dir', default=MM_ARCHIVE_DIR, help='Archive directory')
+        parser.add_argument('--chunk-size', type=int, default=MM_ARCHIVE_CHUNK_SIZE, help='Matches per file')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the matches that would move')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        num_archived, paths = archive_matches(before, options['dir'], options['chunk_size'], options['dry_run'])
+
+        if options['dry_run']:
+            self.stdout.write('%s matches closed before %s would be archived' % (num_archived, before))
+            return
+
+        for path in paths:
+            self.stdout.write('  %s' % path)
+        self.stdout.write('Archived %s matches closed before %s into %s files' % (num_archived, before, len(paths)))
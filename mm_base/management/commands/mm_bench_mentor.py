@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from ...app_settings import ELO_RANK_INCREMENT
+from ...benchmark import bench_mentor
+
+
+class Command(BaseCommand):
+    help = 'Times the mm_tutor mentor / student engine on a synthetic queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=10000)
+        parser.add_argument('--mentors', type=int, default=1000)
+        parser.add_argument('--elo-spread', type=float, default=ELO_RANK_INCREMENT)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        result = bench_mentor(options['students'], options['mentors'], options['seed'], options['elo_spread'])
+
+        self.stdout.write('%s students, %s mentors: %s pairs (upper bound %s) in %.2fms' % (
+            result['students'], result['mentors'], result['pairs'], result['upper_bound'],
+            result['seconds'] * 1000))
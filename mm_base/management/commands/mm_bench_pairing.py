@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from ...benchmark import bench_pairing
+from ...app_settings import ELO_RANK_INCREMENT
+from ...pairing import MM_PAIRING_BAND
+
+
+class Command(BaseCommand):
+    help = 'Compares matches per tick and mean quality of the pairing strategies on synthetic segments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--segment-size', type=int, default=750)
+        parser.add_argument('--ticks', type=int, default=10)
+        parser.add_argument('--band', type=int, default=MM_PAIRING_BAND)
+        parser.add_argument('--elo-spread', type=float, default=ELO_RANK_INCREMENT)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        results = bench_pairing(options['segment_size'], options['ticks'], options['seed'], options['band'],
+                                options['elo_spread'])
+
+        self.stdout.write('%-12s %16s %14s %16s' % ('strategy', 'matches/tick', 'mean quality', 'ms/tick'))
+        for name, result in sorted(results.items()):
+            self.stdout.write('%-12s %16.1f %14.3f %16.2f' % (name, result['matches_per_tick'],
+                                                              result['mean_quality'],
+                                                              result['seconds_per_tick'] * 1000))
@@ -0,0 +1,57 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ...app_settings import Q_SEGMENT_SIZE, MM_BULK_BATCH_SIZE
+from ...benchmark import bench_run, bench_compare
+
+
+class Command(BaseCommand):
+    help = ('Seeds a throwaway test database with synthetic players and parties, times the matchmaking '
+            'phases and saves the report as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=10000, help='1k to 1M players')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--segment-size', type=int, default=Q_SEGMENT_SIZE)
+        parser.add_argument('--commit-batch-size', type=int, default=MM_BULK_BATCH_SIZE)
+        parser.add_argument('--output', default='mm_benchmark.json')
+        parser.add_argument('--compare', default=None, help='Earlier report to compare against')
+
+    def handle(self, *args, **options):
+        # Never touch real data: run against a fresh test database
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+        try:
+            report = bench_run(options['players'], options['seed'], options['segment_size'],
+                               options['commit_batch_size'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        with open(options['output'], 'w') as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)
+
+        for phase_name, phase in sorted(report['phases'].items()):
+            self.stdout.write('%-16s %10.3fs %10s queries %8.1f MB peak' % (
+                phase_name, phase['seconds'], phase['db_queries'], phase['peak_memory_bytes'] / 1048576.0))
+            if phase.get('matches_per_sec') is not None:
+                self.stdout.write('%-16s %10.1f matches/sec %8.2f queries/match' % (
+                    '', phase['matches_per_sec'], phase['queries_per_match']))
+
+        quality = report['match_quality']
+        if quality['mean'] is not None:
+            self.stdout.write('match quality    mean %.3f  p10 %.3f  p50 %.3f  p90 %.3f' % (
+                quality['mean'], quality['percentiles']['10'], quality['percentiles']['50'],
+                quality['percentiles']['90']))
+        self.stdout.write('report saved to %s' % options['output'])
+
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                comparison = bench_compare(json.load(baseline_file), report)
+
+            for phase_name, metrics in sorted(comparison.items()):
+                for metric, (old_value, value, ratio) in sorted(metrics.items()):
+                    self.stdout.write('%-16s %-24s %14.4f -> %14.4f  %s' % (
+                        phase_name, metric, old_value, value, 'x%.2f' % ratio if ratio is not None else '-'))
@@ -0,0 +1,33 @@
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+
+from ...app_settings import MM_DAEMON_BATCH_WINDOW, MM_DAEMON_POLL_INTERVAL, MM_DAEMON_SWEEP_INTERVAL, \
+    MM_DAEMON_REPORT_INTERVAL
+from ...daemon import MatchmakerDaemon
+from ...matchmaking import mm_setup_environment
+
+
+class Command(BaseCommand):
+    help = ('Runs the event-driven matchmaker, which pairs parties as they queue instead of waiting for a '
+            'batch tick. Run it instead of the dispatch_queue_segments beat schedule')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-window', type=float, default=MM_DAEMON_BATCH_WINDOW)
+        parser.add_argument('--poll-interval', type=float, default=MM_DAEMON_POLL_INTERVAL)
+        parser.add_argument('--sweep-interval', type=float, default=MM_DAEMON_SWEEP_INTERVAL)
+        parser.add_argument('--report-interval', type=float, default=MM_DAEMON_REPORT_INTERVAL)
+
+    def handle(self, *args, **options):
+        mm_setup_environment()
+        daemon = MatchmakerDaemon(options['batch_window'], options['poll_interval'], options['sweep_interval'],
+                                  options['report_interval'])
+
+        loop = asyncio.get_event_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, daemon.stop)
+
+        self.stdout.write('Matchmaker daemon started')
+        loop.run_until_complete(daemon.run())
+        self.stdout.write('Stopped: %s' % daemon.get_stats())
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from ...leaderboard import RatingHistogram, leaderboard_rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds a rating histogram from the Player table and prints the rank distribution'
+
+    def handle(self, *args, **options):
+        histogram = RatingHistogram()
+        leaderboard_rebuild(histogram)
+
+        self.stdout.write('%s players, elo %s - %s' % (histogram.total, histogram.get_min_elo(),
+                                                       histogram.get_max_elo()))
+        for rank_elo, count in sorted(histogram.get_rank_counts().items()):
+            self.stdout.write('  %6s %8s' % (rank_elo, count))
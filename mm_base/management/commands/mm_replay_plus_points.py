@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models.mm_plus_points.middleware import plus_replay_ledger
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds every Plus Points balance from the ledger'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            num_balances = plus_replay_ledger()
+        self.stdout.write('Rebuilt %s Plus Points balances' % num_balances)
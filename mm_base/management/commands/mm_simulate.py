@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from ...matchmaking import mm_setup_environment
+from ...simulator import sim_run
+
+
+class Command(BaseCommand):
+    help = 'Simulates queue traffic offline and prints wait-time percentiles and the match quality histogram'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=1.0)
+        parser.add_argument('--arrival-rate', type=float, default=2.0, help='New parties per second')
+        parser.add_argument('--tick', type=float, default=10.0, help='Seconds between matchmaking ticks')
+        parser.add_argument('--match-minutes', type=float, default=35.0, help='Mean match duration')
+        parser.add_argument('--requeue', type=float, default=0.7, help='Chance a party queues again after a match')
+        parser.add_argument('--plus', type=float, default=0.1, help='Share of parties in the plus lane')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=None, help='Also save the report as JSON')
+
+    def handle(self, *args, **options):
+        mm_setup_environment()
+        report = sim_run(options['hours'], options['arrival_rate'], options['tick'], options['match_minutes'],
+                         options['requeue'], options['plus'], options['seed'])
+
+        self.stdout.write('%s ticks, %s matches (%s forced), queue length mean %.1f max %s' % (
+            report['ticks'], report['matches'], report['forced_matches'], report['mean_queue_length'],
+            report['max_queue_length']))
+
+        if report['matches']:
+            self.stdout.write('wait  ' + '  '.join('p%s %.1fs' % (pct, report['wait_seconds'][pct])
+                                                   for pct in sorted(report['wait_seconds'], key=int)) +
+                              '  max %.1fs' % report['max_wait_seconds'])
+            self.stdout.write('quality  mean %.3f' % report['mean_quality'])
+
+            for name, lane in sorted(report['lanes'].items(), key=lambda item: -item[1]['weight']):
+                if lane['matched']:
+                    self.stdout.write('  lane %-10s weight %s  matched %6s  p99 %.1fs / target %.0fs  gain %.2f' % (
+                        name, lane['weight'], lane['matched'], lane['wait_p99'], lane['target'], lane['gain']))
+
+            bins = len(report['quality_histogram'])
+            largest = float(max(report['quality_histogram']))
+            for idx, count in enumerate(report['quality_histogram']):
+                self.stdout.write('  %.2f-%.2f %8s %s' % (idx / float(bins), (idx + 1) / float(bins), count,
+                                                          '#' * int(round(40 * count / largest))))
+
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                json.dump(report, report_file, indent=2, sort_keys=True)
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...app_settings import MM_TRACE_FILE
+from ...tracing import trace_read_json_lines
+
+BAR_WIDTH = 40
+
+
+class Command(BaseCommand):
+    help = 'Prints a flame-style breakdown of the last N matchmaking ticks from the JSON-lines trace file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ticks', type=int, default=10)
+        parser.add_argument('--file', default=MM_TRACE_FILE)
+
+    def handle(self, *args, **options):
+        try:
+            ticks = trace_read_json_lines(options['file'], options['ticks'])
+        except IOError:
+            raise CommandError('Trace file %s could not be read' % options['file'])
+
+        totals = {}  # (stack, stage) -> [wall_time, db_queries, db_time, runs]
+
+        for records in ticks:
+            tick_time = sum(record['wall_time'] for record in records)
+            self.stdout.write('tick %s  %.4fs' % (records[0]['tick'], tick_time))
+
+            for record in records:
+                self.stdout.write(self.format_stage(record, tick_time))
+                stage_total = totals.setdefault((record['stack'], record['stage']), [0.0, 0, 0.0, 0])
+                stage_total[0] += record['wall_time']
+                stage_total[1] += record['db_queries']
+                stage_total[2] += record['db_time']
+                stage_total[3] += 1
+
+        overall_time = sum(stage_total[0] for stage_total in totals.values())
+        self.stdout.write('\nlast %s ticks  %.4fs' % (len(ticks), overall_time))
+
+        by_wall_time = sorted(totals.items(), key=lambda item: -item[1][0])
+        for (stack, stage), (wall_time, db_queries, db_time, runs) in by_wall_time:
+            share = wall_time / overall_time if overall_time else 0.0
+            self.stdout.write('  %-28s %9.4fs %6.1f%% %-*s avg queries=%.1f db=%.4fs' % (
+                '%s.%s' % (stack, stage), wall_time, share * 100, BAR_WIDTH, '#' * int(round(share * BAR_WIDTH)),
+                db_queries / float(runs), db_time / runs))
+
+    def format_stage(self, record, tick_time):
+        share = record['wall_time'] / tick_time if tick_time else 0.0
+        parties = '' if record['parties_in'] is None else '  parties %s -> %s' % (record['parties_in'],
+                                                                                 record['parties_out'])
+        return '  %-28s %9.4fs %6.1f%% %-*s queries=%s db=%.4fs%s%s' % (
+            '%s.%s' % (record['stack'], record['stage']), record['wall_time'], share * 100,
+            BAR_WIDTH, '#' * int(round(share * BAR_WIDTH)), record['db_queries'], record['db_time'], parties,
+            '  FAILED' if record['failed'] else '')
@@ -1,10 +1,15 @@
 import trueskill
 import math
 
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 from .models.core_models import Match, Party, Player
-from .app_settings import ELO_DEFAULT_FAIRNESS_THRESHOLD, ELO_AVG_RATING, ELO_RANK_INCREMENT, \
-    ELO_INCREMENT_RANGE, MM_MATCH_MAX_DURATION
+from .app_settings import ELO_AVG_RATING, ELO_RANK_INCREMENT, \
+    ELO_INCREMENT_RANGE, MM_MATCH_MAX_DURATION, Q_SEGMENT_SIZE, Q_SEGMENT_OVERLAP, Q_CLAIM_TIMEOUT, MM_SWEEP_CHUNK_SIZE
+from .leaderboard import leaderboard_get
+from .notify import notify_match_created
+from .queue_index import queue_index_get
 
 
 def mm_setup_environment(mu=ELO_AVG_RATING, sigma=ELO_RANK_INCREMENT, beta=ELO_INCREMENT_RANGE, tau=5, draw_prob=0.10):
@@ -13,19 +18,33 @@ def mm_setup_environment(mu=ELO_AVG_RATING, sigma=ELO_RANK_INCREMENT, beta=ELO_I
 
 
 def mm_create_new_match(parties):
-    """ Creates Match containing Teams """
-    new_match = Match.objects.create()  # Spawn Match
-
-    for party in parties:
-        new_match.teams.add(party.team)  # Add to match
-        # Reset MM Params (De-Expedite)
-        if party.is_expidited:
-            party.is_expedited = False
-            party.expedited_fairness = ELO_DEFAULT_FAIRNESS_THRESHOLD
+    """
+    Creates Match containing Teams
+        - The party rows are locked first. If one was matched meanwhile, or its claim went stale
+          and another worker took it over, no match is created and None is returned
+    """
+    with transaction.atomic():
+        locked_tokens = dict(Party.objects.select_for_update()
+                             .filter(pk__in=[party.pk for party in parties], current_match=None)
+                             .values_list('pk', 'claim_token'))
+        if any(party.pk not in locked_tokens or locked_tokens[party.pk] != party.claim_token for party in parties):
+            return None
+
+        new_match = Match.objects.create()  # Spawn Match
+
+        for party in parties:
+            new_match.teams.add(party.team)  # Add to match
+            # Reset MM Params (De-Expedite)
+            if party.is_expedited:
+                party.is_expedited = False
+                party.expedite_passes = 0
+            # Lock to match, which also drops the party from the queue index
             party.current_match = new_match
             party.save()
 
-    new_match.save()
+        new_match.save()
+
+    notify_match_created(new_match, [party.team for party in parties])
     return new_match
 
 
@@ -34,17 +53,118 @@ def mm_get_all_disputed_matches():
     return Match.objects.filter(is_disputed=True).all()
 
 
+def mm_enqueue_party(party):
+    """ Queues a party. A shared queue backend holds the queue, the Party row only records when the wait began """
+    queue_index = queue_index_get(sync=False)
+    party.queued_at = timezone.now()
+
+    if queue_index.is_shared:
+        party.save(update_fields=['queued_at'])
+        queue_index.add(party.pk, party.region, party.get_avg_elo())
+    else:
+        party.is_queued = True
+        party.save(update_fields=['is_queued', 'queued_at', 'queue_updated'])
+
+
+def mm_dequeue_party(party):
+    """ Takes a party out of the queue """
+    queue_index = queue_index_get(sync=False)
+
+    if queue_index.is_shared:
+        queue_index.discard(party.pk)
+    else:
+        party.is_queued = False
+        party.save(update_fields=['is_queued', 'queue_updated'])
+
+
 def mm_get_all_queued_parties():
     """ Returns all team in queue """
-    return Party.objects.all().filter(is_queued=True, current_match=None)
+    queue_index = queue_index_get()
+    queued_pks = [pk for region in queue_index.get_regions() for pk in queue_index.get_range(region)]
+    queued_parties = Party.objects.filter(pk__in=queued_pks, current_match=None)
+
+    return queued_parties if queue_index.is_shared else queued_parties.filter(is_queued=True)
 
 
-def mm_close_all_expired_matches():
-    """Closes all currently expired matches in game's MM system"""
-    expired_matches = mm_get_all_expired_matches()
+def mm_get_queued_party_range(region, low_elo=None, high_elo=None):
+    """ Returns pks of a region's queued parties inside an elo range, sorted by elo """
+    return queue_index_get().get_range(region, low_elo, high_elo)
 
-    for match in expired_matches:
-        mm_process_expired_match(match)
+
+def mm_get_queued_segments(segment_size=Q_SEGMENT_SIZE, overlap=Q_SEGMENT_OVERLAP, offset=0):
+    """
+    Splits each region's queue, sorted by elo, into lists of party pks
+        - Each segment holds segment_size parties plus overlap parties shared with each neighbour
+        - offset shifts the segment boundaries, so the same parties don't always sit at an edge
+    """
+    queue_index = queue_index_get()
+    shift = offset % segment_size
+    first_start = shift - segment_size if shift else 0
+    segments = []
+
+    for region in queue_index.get_regions():
+        queued_pks = queue_index.get_range(region)
+
+        for start in range(first_start, len(queued_pks), segment_size):
+            segment = queued_pks[max(start - overlap, 0):max(start + segment_size + overlap, 0)]
+            if segment:
+                segments.append(segment)
+
+    return segments
+
+
+def mm_claim_parties(party_pks, claim_token):
+    """
+    Atomically claims queued parties for one worker
+        - Conditional UPDATE, so a party claimed by another worker (and not stale) is skipped
+        - Returns the queryset of parties this worker now holds
+    """
+    queue_index = queue_index_get(sync=False)
+    if queue_index.is_shared:
+        # Claimed by taking the parties out of the shared queue, the Party table is not written
+        return Party.objects.filter(pk__in=queue_index.claim(party_pks, claim_token))
+
+    now = timezone.now()
+    stale_threshold = now - timezone.timedelta(seconds=Q_CLAIM_TIMEOUT)
+
+    Party.objects.filter(pk__in=party_pks, is_queued=True, current_match=None) \
+        .filter(Q(claim_token=None) | Q(claimed_at__lt=stale_threshold)) \
+        .update(claim_token=claim_token, claimed_at=now)
+
+    return Party.objects.filter(claim_token=claim_token)
+
+
+def mm_release_parties(claim_token):
+    """ Releases every party held by a worker's claim """
+    queue_index = queue_index_get(sync=False)
+    if queue_index.is_shared:
+        return queue_index.release(claim_token)
+
+    return Party.objects.filter(claim_token=claim_token).update(claim_token=None, claimed_at=None)
+
+
+def mm_close_all_expired_matches(chunk_size=MM_SWEEP_CHUNK_SIZE):
+    """
+    Closes all currently expired matches in game's MM system
+        - Sweeps in chunks of chunk_size, each chunk one indexed SELECT and one UPDATE
+          in its own short transaction, so the Match table is never locked for long
+        - Returns the closed match ids, for the result stack
+    """
+    closed_ids = []
+
+    while True:
+        with transaction.atomic():
+            # Rows locked by another sweeper are skipped rather than waited on
+            chunk_ids = list(mm_get_all_expired_matches().order_by('start_time')
+                             .select_for_update(skip_locked=True).values_list('pk', flat=True)[:chunk_size])
+            if not chunk_ids:
+                break
+
+            Match.objects.filter(pk__in=chunk_ids).update(end_time=timezone.now())
+
+        closed_ids.extend(chunk_ids)
+
+    return closed_ids
 
 
 def mm_get_all_expired_matches():
@@ -52,20 +172,11 @@ def mm_get_all_expired_matches():
 
     # When the earliest expired match could start
     expired_threshold = timezone.now() - timezone.timedelta(minutes=MM_MATCH_MAX_DURATION)
-    expired_matches = Match.objects.filter(end_time=None).filter(start_time_lt=expired_threshold)
+    expired_matches = Match.objects.filter(end_time=None, start_time__lt=expired_threshold)
 
     return expired_matches
 
 
-def mm_process_expired_match(match):
-    """ Process expired match before Match save() """
-
-    # Test if match is expired via time
-    if timezone.now() >= match.start_time + timezone.timedelta(minutes=MM_MATCH_MAX_DURATION):
-        match.end_time = timezone.now()
-        match.save()
-
-
 def mm_force_end(match):
     """ Forces an end_time to be assigned """
     match.end_time = timezone.now()
@@ -76,8 +187,10 @@ def mm_get_skill_curve_ends():
     """ Returns the highest and lowest ELO bracket, rounded to the ELO_RANK_INCREMENT
         Note: This exists in MM to avoid circular import. Originally in skill.py
     """
-    low_elo = Player.objects.order_by('elo').first().elo
-    high_elo = Player.objects.order_by('-elo').first().elo
+    # Read from the rating histogram, not two ORDER BY scans of the Player table
+    histogram = leaderboard_get()
+    low_elo = histogram.get_min_elo()
+    high_elo = histogram.get_max_elo()
 
     lowest_range = mm_get_closest_increment(low_elo)
     highest_range = mm_get_closest_increment(high_elo)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from array import array
+
+from django.db import migrations, models
+
+
+def fill_rating_aggregates(apps, schema_editor):
+    """ Builds the rating aggregates of existing Teams and Parties. A Party rosters its Team's players """
+    for model_name in ('Team', 'Party'):
+        for roster in apps.get_model('mm_base', model_name).objects.all():
+            players = roster.players.all() if model_name == 'Team' else roster.team.players.all()
+            entries = [(player.pk, player.elo, player.elo_weight) for player in players]
+            roster.roster_size = len(entries)
+            roster.mu_sum = float(sum(mu for pk, mu, sigma in entries))
+            roster.sigma_sq_sum = float(sum(sigma ** 2 for pk, mu, sigma in entries))
+            roster.rating_vector = array('d', [value for entry in entries for value in entry]).tobytes()
+            roster.save(update_fields=['roster_size', 'mu_sum', 'sigma_sq_sum', 'rating_vector'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mm_base', '0003_party_queue_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='party',
+            name='mu_sum',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='party',
+            name='rating_vector',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='party',
+            name='roster_size',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='party',
+            name='sigma_sq_sum',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='mu_sum',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='rating_vector',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='roster_size',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='sigma_sq_sum',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RunPython(fill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mm_base', '0004_roster_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='party',
+            name='claim_token',
+            field=models.CharField(blank=True, db_index=True, default=None, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='party',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
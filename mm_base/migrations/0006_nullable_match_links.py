@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mm_base', '0005_party_claim'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='match',
+            name='winner',
+            field=models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='won_matches', to='mm_base.Team'),
+        ),
+        migrations.AlterField(
+            model_name='party',
+            name='current_match',
+            field=models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='parties', to='mm_base.Match'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mm_base', '0007_match_expiry_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='party',
+            name='expedite_passes',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='party',
+            name='expedited_fairness',
+            field=models.FloatField(default=0.45),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mm_base', '0008_party_expedite_passes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='player',
+            name='elo',
+            field=models.IntegerField(db_index=True, default=2500),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mm_base', '0009_player_elo_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TutorMentor',
+            fields=[
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True,
+                                                related_name='tutor_mentor', serialize=False, to='mm_base.Player')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TutorStudent',
+            fields=[
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True,
+                                                related_name='tutor_student', serialize=False, to='mm_base.Player')),
+            ],
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mm_base', '0010_tutor_roles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlusPlayer',
+            fields=[
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True,
+                                                related_name='plus', serialize=False, to='mm_base.Player')),
+                ('num_points', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlusAwardedMatch',
+            fields=[
+                ('match', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True,
+                                               related_name='plus_award', serialize=False, to='mm_base.Match')),
+                ('awarded_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlusLedgerEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.IntegerField()),
+                ('match', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='plus_ledger',
+                                            to='mm_base.Match')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='plus_ledger',
+                                             to='mm_base.Player')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='plusledgerentry',
+            unique_together=set([('match', 'player')]),
+        ),
+    ]
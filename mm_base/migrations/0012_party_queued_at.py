@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_queued_at(apps, schema_editor):
+    """ Queued parties waited at least since their last queue change """
+    apps.get_model('mm_base', 'Party').objects.filter(queued_at=None).update(queued_at=F('queue_updated'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mm_base', '0011_plus_points_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='party',
+            name='queued_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.RunPython(fill_queued_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mm_base', '0012_party_queued_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='plusledgerentry',
+            name='match',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING,
+                                    related_name='plus_ledger', to='mm_base.Match'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mm_base', '0013_plus_ledger_outlives_match'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='party',
+            name='expedited_fairness',
+        ),
+    ]
@@ -1,3 +1,4 @@
 """ Import plugin's models here to tie in to the Django ORM  """
 from .core_models import *
 from .mm_tutor.models import *
+from .mm_plus_points.models import *
@@ -1,74 +1,174 @@
-from ..app_settings import ELO_EXPEDITED_FAIRNESS_MODIFIER
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ..app_settings import MM_QUEUE_WORKERS
+from ..lanes import lane_get_scheduler, lane_classify, lane_build_plus_flags, lane_build_waits
+from ..matchmaking import mm_create_new_match
+from ..skill import skill_build_segment_arrays, skill_calculate_quality_matrix, skill_build_expedite_passes, \
+    skill_build_pair_values, skill_build_match_mask
+from ..pairing import pairing_get_strategy, pairing_build_elo_window_mask
+from ..queue_index import queue_index_get
 """ -----------------------------------------------------------------------
                                 MIDDLEWARE
     ------------------------------------------------------------------- """
 
 
-def mm_core_process_all_queues(queue_list):
-    """ Calls process on all queues in the current stack """
-    for queue in queue_list:
-        mm_core_process_queue_segment(queue)
+def mm_core_process_all_queues(queue_dict, logger, max_workers=MM_QUEUE_WORKERS):
+    """
+    Calls process on all queues in the current stack, pairing them concurrently
+        - Queues are read and their matches created on the stage's connection, inside
+          its savepoint, so a failing stage rolls every sub-queue back together
+        - Only the pairing, which never touches the DB, runs on worker threads
+        - Returns {queue name: (matches created, seconds taken)}
+    """
+    queue_names = sorted(queue_dict)
+    prepared = {queue_name: mm_core_prepare_queue(queue_dict[queue_name]) for queue_name in queue_names}
+
+    def pair_timed(queue_name):
+        start = time.time()
+        return mm_core_pair_queue(*prepared[queue_name]), time.time() - start
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        paired = dict(zip(queue_names, executor.map(pair_timed, queue_names)))
+
+    results = {}
+    for queue_name in queue_names:
+        paired_queue, seconds = paired[queue_name]
+        start = time.time()
+        num_matches = mm_core_create_matches(*paired_queue, logger=logger, queue_name=queue_name)
+        results[queue_name] = num_matches, seconds + time.time() - start
+        logger.info('MM_CORE: Queue %s processed in %.3fs, %s matches' % (queue_name, results[queue_name][1],
+                                                                          num_matches))
+
+    return results
 
 
 def mm_core_process_queue_segment(queue_dict, queue_queryset, logger):
-    """ Creates matches from a queue of parties sorted by match elo """
+    """ Creates matches from every sub-queue built by earlier middleware, or the whole segment if none """
+    if queue_dict:
+        return sum(num_matches for num_matches, seconds in mm_core_process_all_queues(queue_dict, logger).values())
+
+    return mm_core_process_queue(queue_queryset, logger)
+
+
+def mm_core_pair_segment(roster_sizes, mu_sums, sigma_sq_sums, thresholds, passes, priorities=None):
+    """
+    Pairs a segment from its rating arrays, without touching the DB
+        - priorities : optional scheduling priority per party (see lanes.py), a pair
+          weighs the mean of both parties' priorities
+        - Returns (elo_order, pairs, quality_band): pairs are (idx, idx) of the segment
+          sorted by elo_order, quality_band is the strategy's banded quality matrix
+    """
+    # Sort segment by avg elo so neighbours in the band are the closest candidates
+    avg_elos = mu_sums / np.maximum(roster_sizes, 1)
+    elo_order = np.argsort(avg_elos, kind='mergesort')
+    roster_sizes, mu_sums, sigma_sq_sums = roster_sizes[elo_order], mu_sums[elo_order], sigma_sq_sums[elo_order]
+
+    # Score every pair inside the strategy's band in one pass
+    pairing_strategy, band = pairing_get_strategy()
+    quality_band = skill_calculate_quality_matrix(roster_sizes, mu_sums, sigma_sq_sums, band=band)
+    match_mask = skill_build_match_mask(quality_band, np.asarray(thresholds)[elo_order], np.asarray(passes)[elo_order],
+                                        band=band)
+    match_mask &= pairing_build_elo_window_mask(avg_elos[elo_order], band)
+
+    pair_priorities = None
+    if priorities is not None:
+        pair_priorities = skill_build_pair_values(np.asarray(priorities, dtype=float)[elo_order], np.add, 0.0,
+                                                  band) / 2.0
+
+    return elo_order, pairing_strategy(quality_band, match_mask, pair_priorities), quality_band
+
+
+def mm_core_prepare_queue(queue_queryset):
+    """
+    Reads a queue and the lane inputs of its parties, the only DB reads of pairing
+        - Returns (queue_segment, segment_lanes, segment_waits)
+    """
     queue_segment = list(queue_queryset)  # Extract parties from segment
+    segment_lanes = lane_classify(lane_build_plus_flags(queue_segment), skill_build_expedite_passes(queue_segment))
+    segment_waits = lane_build_waits(queue_segment, timezone.now())
+
+    return queue_segment, segment_lanes, segment_waits
+
+
+def mm_core_pair_queue(queue_segment, segment_lanes, segment_waits):
+    """
+    Pairs a read queue without touching the DB, so it may run on any thread
+        - Lanes widen fairness with measured wait and force matches past a lane's max wait
+        - Returns (queue_segment, pairs, segment_lanes, segment_waits), all sorted by elo
+    """
+    if not queue_segment:
+        return queue_segment, [], segment_lanes, segment_waits
+
+    segment_thresholds, segment_passes, segment_priorities = lane_get_scheduler().build(segment_lanes, segment_waits)
+    roster_sizes, mu_sums, sigma_sq_sums = skill_build_segment_arrays(queue_segment)
+    elo_order, pairs, quality_band = mm_core_pair_segment(roster_sizes, mu_sums, sigma_sq_sums, segment_thresholds,
+                                                          segment_passes, segment_priorities)
+
+    return [queue_segment[idx] for idx in elo_order], pairs, segment_lanes[elo_order], segment_waits[elo_order]
+
+
+def mm_core_create_matches(queue_segment, pairs, segment_lanes, segment_waits, logger, queue_name='segment'):
+    """ Creates the matches of a paired queue on the calling thread's connection, returns how many """
     segment_size = len(queue_segment)
     matches = []  # Holds created match objects
-    unmatched_parties = []  # Teams that matches could not be found for
 
     # Empty Segment
     if segment_size < 1:
-        return
-
-    # Remove all parties from Queue
-        queue_queryset.update(is_queued=False)
-
-    while queue_segment:
-        # Must be a pair of teams to attempt a match
-        if len(queue_segment) < 2:
-            # Add hanging team to unmatched teams
-            unmatched_parties.append(queue_segment.pop(0))
-            break
-        else:
-            # Get potential pair
-            party = queue_segment[0]
-            next_party = queue_segment[1]
-
-            # Match team based on fairness, or force if expedited pass threshold is met
-            if skill_is_match_or_forced(party, next_party):
-                new_match = mm_create_new_match(party, next_party)
-
-                if new_match is not None:
-                    matches.append(new_match)
-                    queue_segment.pop(0)
-                    queue_segment.pop(0)
-                else:
-                    # Pass over this team if not fair
-                    unmatched_parties.append(queue_segment.pop(0))
-            else:
-                # Pass over this team if not fair
-                unmatched_parties.append(queue_segment.pop(0))
-
-    print("\n------------------------------")
-    print("Queue Batching Results")
-    print("------------------------------")
-    print("Total Teams in Batch: %s" % segment_size)
-    print("Total Matches Found: %s" % len(matches))
-    print("Total Unmatched Parties: %s\n" % len(unmatched_parties))
-
-    print("Batch Success Rate: {:.1%}\n".format((len(matches) * 2) / segment_size))
+        return 0
+
+    # Match teams based on fairness, or force once a lane's wait bound is met
+    paired = set()
+    for idx, next_idx in pairs:
+        new_match = mm_create_new_match([queue_segment[idx], queue_segment[next_idx]])
+
+        if new_match is not None:
+            matches.append(new_match)
+            paired.update((idx, next_idx))
+
+    # Pass over teams that could not be paired fairly
+    unmatched_parties = [party for idx, party in enumerate(queue_segment) if idx not in paired]
+    lane_get_scheduler().observe(segment_lanes, segment_waits, [idx in paired for idx in range(segment_size)])
+
+    logger.info('MM_CORE: Queue %s batching results - Teams: %s, Matches: %s, Unmatched: %s, Success Rate: %s'
+                % (queue_name, segment_size, len(matches), len(unmatched_parties),
+                   '{:.1%}'.format((len(matches) * 2) / float(segment_size))))
 
     return len(matches)  # Return number of matches created
 
 
-def mm_core_clean_queue(queue_segment_queryset):
-    """ Expedite teams that were not matched """
-    unmatched_parties = queue_segment_queryset.all()
+def mm_core_process_queue(queue_queryset, logger, queue_name='segment'):
+    """ Creates matches from a queue of parties sorted by match elo """
+    paired_queue = mm_core_pair_queue(*mm_core_prepare_queue(queue_queryset))
+    return mm_core_create_matches(*paired_queue, logger=logger, queue_name=queue_name)
+
+
+def mm_core_clean_queue(queue_dict, queue_queryset, logger):
+    """
+    Expedite teams that were not matched, with a single UPDATE
+        - Passes move a party to the expedited lane, its fairness widens with wait (see lanes.py)
+        - Parties dequeued while claimed stay dequeued
+        - queue_updated is left alone: expediting doesn't move a party in the queue index,
+          so index syncs don't re-read the waiting queue
+    """
+    unmatched = queue_queryset.filter(current_match=None)
+    queue_index = queue_index_get(sync=False)
+    if queue_index.is_shared:
+        # The shared backend holds who is queued, not the Party table
+        unmatched = unmatched.filter(pk__in=queue_index.get_indexed_pks(unmatched.values_list('pk', flat=True)))
+    else:
+        unmatched = unmatched.filter(is_queued=True)
+
+    num_expedited = unmatched.update(
+        is_expedited=True,
+        expedite_passes=F('expedite_passes') + 1,
+        queued_at=Coalesce(F('queued_at'), Value(timezone.now())),  # Wait start of parties queued before 0012
+    )
+    logger.info('MM_CORE: Expedited %s unmatched parties' % num_expedited)
 
-    for party in unmatched_parties:
-        # Expedite team and adjust their fairness range
-        party.is_expedited = True
-        party.expedited_fairness = (party.expidited_fairness - ELO_EXPEDITED_FAIRNESS_MODIFIER)
-        party.is_queued = True
-        party.save()
+    return num_expedited
@@ -1,29 +1,87 @@
+from array import array
+
 from django.db import models, OperationalError
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from ..app_settings import TEAM_SIZE, NUM_TEAMS, ELO_DEFAULT_FAIRNESS_THRESHOLD, REGIONS
+from ..app_settings import TEAM_SIZE, NUM_TEAMS, REGIONS
 
 
 class Player(models.Model):
     """ Django User Extension for MM system """
-    user = models.OneToOneField(User, related_name=("%s_mm_user" % "REPLACE_ME"), primary_key=True)
-    elo = models.IntegerField(default=2500)  # Trueskill MU
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name=("%s_mm_user" % "REPLACE_ME"),
+                                primary_key=True)
+    elo = models.IntegerField(default=2500, db_index=True)  # Trueskill MU
     elo_weight = models.FloatField(default=50)  # Trueskill SIGMA
 
 
-class Team(models.Model):
+class RosterRating(models.Model):
+    """
+    Denormalized rating aggregates of a roster
+        - rating_vector packs (player pk, mu, sigma) float64 triples
+        - Kept consistent by add_player / kick_player and rating commits
+        - ROSTER_LOOKUP : lookup from the model to its roster's players. A Party rosters its
+          Team's players, its players ForeignKey only points at the party leader
+    """
+    RATING_FIELDS = ['roster_size', 'mu_sum', 'sigma_sq_sum', 'rating_vector']
+    ROSTER_LOOKUP = 'players'
+
+    roster_size = models.PositiveSmallIntegerField(default=0)
+    mu_sum = models.FloatField(default=0.0)  # Sum of Trueskill MU
+    sigma_sq_sum = models.FloatField(default=0.0)  # Sum of Trueskill SIGMA^2
+    rating_vector = models.BinaryField(default=b'')
+
+    class Meta:
+        abstract = True
+
+    def get_rating_vector(self):
+        """ Returns the roster's [(player_pk, mu, sigma)] """
+        packed = array('d')
+        packed.frombytes(bytes(self.rating_vector))
+        return [(int(packed[idx]), packed[idx + 1], packed[idx + 2]) for idx in range(0, len(packed), 3)]
+
+    def set_rating_vector(self, entries):
+        """ Sets every aggregate from [(player_pk, mu, sigma)] """
+        self.roster_size = len(entries)
+        self.mu_sum = float(sum(mu for pk, mu, sigma in entries))
+        self.sigma_sq_sum = float(sum(sigma ** 2 for pk, mu, sigma in entries))
+        self.rating_vector = array('d', [value for entry in entries for value in entry]).tobytes()
+
+    def get_roster_players(self):
+        """ Returns the roster's Players """
+        return self.players.all()
+
+    def refresh_rating_aggregates(self, save=True):
+        """ Rebuilds the aggregates from the roster """
+        self.set_rating_vector([(player.pk, player.elo, player.elo_weight) for player in self.get_roster_players()])
+        if save:
+            self.save(update_fields=self.RATING_FIELDS)
+
+    def apply_player_ratings(self, player_ratings):
+        """
+        Updates members' ratings from {player_pk: (mu, sigma)}
+            - Returns True if any member changed
+        """
+        entries = self.get_rating_vector()
+        updated = [(pk,) + tuple(player_ratings[pk]) if pk in player_ratings else (pk, mu, sigma)
+                   for pk, mu, sigma in entries]
+
+        if updated == entries:
+            return False
+
+        self.set_rating_vector(updated)
+        return True
+
+    def get_avg_elo(self):
+        """ Returns the roster's average elo for rating """
+        return self.mu_sum / self.roster_size
+
+
+class Team(RosterRating):
     """ Matchmaker Team """
     name = models.SlugField(max_length=20)
     players = models.ManyToManyField(Player, related_name="teams")
-    captain = models.ForeignKey(Player, related_name="captain")
-
-    def get_avg_elo(self):
-        """ Returns the team's average elo for rating """
-        elo_sum = 0.0
-        for player in self.players.all():
-            elo_sum = elo_sum + player.elo
-        return elo_sum / len(self.players.all())
+    captain = models.ForeignKey(Player, on_delete=models.CASCADE, related_name="captain")
 
 
 class Match(models.Model):
@@ -33,13 +91,19 @@ class Match(models.Model):
     players = models.ManyToManyField(Player, related_name="matches", through='MatchRosterSlot')
     # Results
     declared_results = models.CharField(max_length=2) # ordered string of 1's (W) and 0's (L) of team's declared results
-    winner = models.ForeignKey(Team, related_name="won_matches")
+    winner = models.ForeignKey(Team, on_delete=models.CASCADE, related_name="won_matches", default=None, blank=True,
+                               null=True)
     # Status
     is_disputed = models.BooleanField(default=False)
     # Data
     start_time = models.DateTimeField(default=None, null=True, blank=True)
     end_time = models.DateTimeField(default=None, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['end_time', 'start_time'], name='mm_match_expiry_idx'),  # Expired match sweeper
+        ]
+
     # UPDATE
     def add_party(self, party):
         # If party is queued and not in a match
@@ -130,29 +194,40 @@ class Match(models.Model):
 
 class MatchRosterSlot(models.Model):
     """ Instance of Player's registration to a Match """
-    player = models.ForeignKey(Player)
-    match = models.ForeignKey(Match)
-    team = models.ForeignKey(Team)
+    player = models.ForeignKey(Player, on_delete=models.CASCADE)
+    match = models.ForeignKey(Match, on_delete=models.CASCADE)
+    team = models.ForeignKey(Team, on_delete=models.CASCADE)
     elo_modifier = models.DecimalField(default=0.0, decimal_places=2, max_digits=8)
 
 
 class MatchTeamSlot(models.Model):
     """ Instance of a Team's registration and decision to a Match """
-    match = models.ForeignKey(Match)  # Match this slot belongs to
-    team = models.ForeignKey(Team)  # Team that is registered to that match
+    match = models.ForeignKey(Match, on_delete=models.CASCADE)  # Match this slot belongs to
+    team = models.ForeignKey(Team, on_delete=models.CASCADE)  # Team that is registered to that match
     result = models.BooleanField(default=False)  # Did the team declare W / L (1 / 0)
     invalid = models.BooleanField(default=False)  # Was the result disputed and not upheld?
 
 
-class Party(models.Model):
+class Party(RosterRating):
     """ Used to mutex lock players in the Queue """
-    team = models.OneToOneField(Team, related_name="current_party")
-    players = models.ForeignKey(Player, related_name="current_party")
-    current_match = models.ForeignKey(Match, related_name="parties")
+    team = models.OneToOneField(Team, on_delete=models.CASCADE, related_name="current_party")
+    players = models.ForeignKey(Player, on_delete=models.CASCADE, related_name="current_party")
+    current_match = models.ForeignKey(Match, on_delete=models.CASCADE, related_name="parties", default=None,
+                                      blank=True, null=True)
     is_queued = models.BooleanField(default=False)
     is_expedited = models.BooleanField(default=False)
-    expedited_fairness = models.IntegerField(default=ELO_DEFAULT_FAIRNESS_THRESHOLD)
+    expedite_passes = models.PositiveSmallIntegerField(default=0)  # Passed over at least once: expedited lane
+    queued_at = models.DateTimeField(default=None, blank=True, null=True)  # Start of the wait, read by lanes.py
     region = models.CharField(choices=REGIONS, blank=True, default=None, max_length=4)
+    queue_updated = models.DateTimeField(auto_now=True, db_index=True)  # Last change, read by the queue index sync
+    claim_token = models.CharField(max_length=32, blank=True, default=None, null=True, db_index=True)  # Worker lock
+    claimed_at = models.DateTimeField(default=None, blank=True, null=True)
+
+    ROSTER_LOOKUP = 'team__players'
+
+    def get_roster_players(self):
+        """ A party rosters its team's players """
+        return self.team.players.all()
 
     def validate_queue(self):
         if self.players.count() == TEAM_SIZE and self.is_queued:
@@ -171,6 +246,8 @@ class Party(models.Model):
 
         if player.current_party is None:
             self.players.add(player)
+            self.set_rating_vector(self.get_rating_vector() + [(player.pk, player.elo, player.elo_weight)])
+            self.save(update_fields=self.RATING_FIELDS)
         else:
             raise ValidationError(
                 _('Player %(username) is already in a party'),
@@ -181,6 +258,8 @@ class Party(models.Model):
     def kick_player(self, player):
         if self.players.filter(username__exact=player.username).exists():
             self.players.remove(player)
+            self.set_rating_vector([entry for entry in self.get_rating_vector() if entry[0] != player.pk])
+            self.save(update_fields=self.RATING_FIELDS)
         else:
             raise OperationalError(
                 _('Player %(username) is not in this party!'),
@@ -216,9 +295,20 @@ class Party(models.Model):
                 code='party_mutex_unneeded',
             )
 
-    def get_avg_elo(self):
-        """ Returns the party's average elo for rating """
-        elo_sum = 0.0
-        for player in self.players.all():
-            elo_sum = elo_sum + player.elo
-        return elo_sum / len(self.players.all())
+
+def roster_apply_player_ratings(player_ratings):
+    """
+    Pushes committed ratings into every Team and Party rostering those players
+        - player_ratings : {player_pk: (mu, sigma)}
+        - Returns the pks of the parties that changed
+    """
+    player_pks = list(player_ratings)
+    updated = {}
+
+    for model in (Team, Party):
+        rostering = model.objects.filter(**{'%s__in' % model.ROSTER_LOOKUP: player_pks}).distinct()
+        rosters = [roster for roster in rostering if roster.apply_player_ratings(player_ratings)]
+        model.objects.bulk_update(rosters, RosterRating.RATING_FIELDS)
+        updated[model] = [roster.pk for roster in rosters]
+
+    return updated[Party]
@@ -1,7 +1,95 @@
+from collections import Counter, defaultdict
 
-def plus_award_points(q_dict, q_queryset, logger):
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from ...app_settings import MM_BULK_BATCH_SIZE
+from ..core_models import MatchRosterSlot
+from .models import PlusPlayer, PlusAwardedMatch, PlusLedgerEntry
+from .plugin_settings import PLUS_POINTS_PLAYED, PLUS_POINTS_WIN
+
+
+def plus_get_awardable(matches):
+    """ Keeps the matches that earn points: over and not disputed """
+    return [match for match in matches if match.end_time is not None and not match.is_disputed]
+
+
+def plus_get_awarded_match_pks(match_pks):
+    """ Returns the pks among match_pks that already hold a PlusAwardedMatch key """
+    return set(PlusAwardedMatch.objects.filter(match__in=match_pks).values_list('match_id', flat=True))
+
+
+def plus_build_awards(matches):
+    """
+    Builds the ledger entries of a batch of awardable matches, without writing
+        - Returns [PlusLedgerEntry]
+    """
+    winners = {match.pk: match.winner_id for match in matches}
+    entries = []
+
+    for match_pk, player_pk, team_pk in MatchRosterSlot.objects.filter(match__in=list(winners)) \
+            .values_list('match_id', 'player_id', 'team_id'):
+        points = PLUS_POINTS_PLAYED + (PLUS_POINTS_WIN if team_pk == winners[match_pk] else 0)
+        entries.append(PlusLedgerEntry(match_id=match_pk, player_id=player_pk, points=points))
+
+    return entries
+
+
+def plus_credit_players(player_points):
+    """
+    Adds {player_pk: points} to balances
+        - Missing PlusPlayer rows are bulk inserted, then one F-expression UPDATE per distinct amount
+    """
+    PlusPlayer.objects.bulk_create([PlusPlayer(player_id=player_pk) for player_pk in player_points],
+                                   batch_size=MM_BULK_BATCH_SIZE, ignore_conflicts=True)
+
+    players_by_points = defaultdict(list)
+    for player_pk, points in player_points.items():
+        players_by_points[points].append(player_pk)
+
+    for points, player_pks in players_by_points.items():
+        for first in range(0, len(player_pks), MM_BULK_BATCH_SIZE):
+            PlusPlayer.objects.filter(player__in=player_pks[first:first + MM_BULK_BATCH_SIZE]) \
+                .update(num_points=F('num_points') + points)
+
+
+def plus_award_points(matches, logger):
     """
         Reads match result.
         Awards player's Plus Points accordingly
+            * Idempotent: a match already holding a PlusAwardedMatch key is skipped, and a
+              concurrent run inserting the same key fails the stage's savepoint as a whole
+            * Only matches actually awarded get a key: a disputed or unfinished match can still
+              be awarded once it is resolved
+            * Awards of the whole batch are summed per player before any balance is written
     """
-    pass
+    matches = plus_get_awardable(matches)
+    awarded_pks = plus_get_awarded_match_pks([match.pk for match in matches])
+    matches = [match for match in matches if match.pk not in awarded_pks]
+    if not matches:
+        return
+
+    entries = plus_build_awards(matches)
+    PlusAwardedMatch.objects.bulk_create([PlusAwardedMatch(match_id=match.pk) for match in matches],
+                                         batch_size=MM_BULK_BATCH_SIZE)
+    PlusLedgerEntry.objects.bulk_create(entries, batch_size=MM_BULK_BATCH_SIZE)
+
+    player_points = Counter()
+    for entry in entries:
+        player_points[entry.player_id] += entry.points
+    plus_credit_players(player_points)
+
+    logger.info('MM_PLUS: Awarded %s points to %s players from %s matches (%s already awarded)' % (
+        sum(player_points.values()), len(player_points), len(matches), len(awarded_pks)))
+
+
+def plus_replay_ledger():
+    """ Rebuilds every balance from the ledger in one UPDATE, returns the number of balances """
+    PlusPlayer.objects.bulk_create(
+        [PlusPlayer(player_id=player_pk) for player_pk in
+         PlusLedgerEntry.objects.values_list('player_id', flat=True).distinct()],
+        batch_size=MM_BULK_BATCH_SIZE, ignore_conflicts=True)
+
+    ledger_totals = PlusLedgerEntry.objects.filter(player=OuterRef('player')).values('player') \
+        .annotate(total=Sum('points')).values('total')
+    return PlusPlayer.objects.update(num_points=Coalesce(Subquery(ledger_totals, output_field=IntegerField()), 0))
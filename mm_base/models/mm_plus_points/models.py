@@ -1,9 +1,25 @@
-"""
 from django.db import models
-from ..core_models import Player
+from ..core_models import Player, Match
 
 
 class PlusPlayer(models.Model):
+    """ A Player's Plus Points balance, the sum of their ledger entries """
     player = models.OneToOneField(Player, on_delete=models.CASCADE, primary_key=True, related_name='plus')
     num_points = models.IntegerField(default=0)
-"""
+
+
+class PlusAwardedMatch(models.Model):
+    """ Idempotency key: a match's points were awarded. Inserted in the same transaction as its ledger entries """
+    match = models.OneToOneField(Match, on_delete=models.CASCADE, primary_key=True, related_name='plus_award')
+    awarded_at = models.DateTimeField(auto_now_add=True)
+
+
+class PlusLedgerEntry(models.Model):
+    """ Points awarded to a Player for a Match. Replaying the ledger rebuilds every balance """
+    # Entries outlive their match once it's archived (see archive.py)
+    match = models.ForeignKey(Match, on_delete=models.DO_NOTHING, db_constraint=False, related_name='plus_ledger')
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='plus_ledger')
+    points = models.IntegerField()
+
+    class Meta:
+        unique_together = (('match', 'player'),)
@@ -0,0 +1,2 @@
+PLUS_POINTS_PLAYED = 1  # Points for every player of a finished, undisputed match
+PLUS_POINTS_WIN = 4     # Extra points for each player of the winning team
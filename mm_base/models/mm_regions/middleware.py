@@ -1,6 +1,22 @@
+from collections import defaultdict
+
+from ...app_settings import SUPPORTS_REGIONS
+from .plugin_settings import REGION_QUEUE_PREFIX, REGION_UNASSIGNED
+
 
 def regions_sort_queues(q_dict, q_queryset, logger):
     """ Sorts queue by regions
-            * returns list of queues
+            * adds one sub-queue per region to q_dict
     """
-    pass
+    if not SUPPORTS_REGIONS:
+        return
+
+    # One query for every party's region, then one lazy sub-queue per region
+    region_pks = defaultdict(list)
+    for party_pk, region in q_queryset.values_list('pk', 'region'):
+        region_pks[region or REGION_UNASSIGNED].append(party_pk)
+
+    for region, party_pks in region_pks.items():
+        q_dict[REGION_QUEUE_PREFIX + region] = q_queryset.filter(pk__in=party_pks)
+        logger.info('MM_REGIONS: Sub-queue %s%s was built with %s parties' % (REGION_QUEUE_PREFIX, region,
+                                                                            len(party_pks)))
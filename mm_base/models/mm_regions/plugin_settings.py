@@ -0,0 +1,2 @@
+REGION_QUEUE_PREFIX = 'region-'  # q_dict key prefix of each region's sub-queue
+REGION_UNASSIGNED = 'none'       # Sub-queue name of parties without a region
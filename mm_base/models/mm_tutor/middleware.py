@@ -1,4 +1,80 @@
+import numpy as np
+
+from ...matchmaking import mm_create_new_match
+from .plugin_settings import RANGE_EXTENSION
+
+
+def mentor_assign_students(mentor_elos, student_elos, range_extension=RANGE_EXTENSION):
+    """
+    Maximum matching of students to mentors at most range_extension elo apart
+        - Each student accepts an interval of the mentors sorted by elo
+        - Students taken by the right end of their interval each take the lowest free
+          mentor of it, which is optimal for interval graphs. A union-find pointer to the
+          next free mentor keeps the pass near-linear: O((m + s) log(m + s)) with the sorts
+        - Returns [(mentor idx, student idx)]
+    """
+    mentor_elos = np.asarray(mentor_elos, dtype=float)
+    student_elos = np.asarray(student_elos, dtype=float)
+    mentor_order = np.argsort(mentor_elos, kind='mergesort')
+    student_order = np.argsort(student_elos, kind='mergesort')  # Same order as the interval right ends
+    sorted_mentor_elos = mentor_elos[mentor_order]
+
+    sorted_student_elos = student_elos[student_order]
+    lows = np.searchsorted(sorted_mentor_elos, sorted_student_elos - range_extension, side='left')
+    highs = np.searchsorted(sorted_mentor_elos, sorted_student_elos + range_extension, side='right')
+
+    next_free = list(range(len(mentor_elos) + 1))  # Last entry is the "no mentor left" sentinel
+    pairs = []
+
+    for student_idx, low, high in zip(student_order.tolist(), lows.tolist(), highs.tolist()):
+        # Find the lowest free mentor from low, halving the path as we go
+        mentor = low
+        while next_free[mentor] != mentor:
+            next_free[mentor] = next_free[next_free[mentor]]
+            mentor = next_free[mentor]
+
+        if mentor < high:
+            pairs.append((int(mentor_order[mentor]), student_idx))
+            next_free[mentor] = mentor + 1
+
+    return pairs
+
+
+def mentor_process_sub_queue(queue_queryset, logger, queue_name):
+    """ Matches a queue's student parties to its mentor parties, returns the matched party pks """
+    mentors = list(queue_queryset.filter(players__tutor_mentor__isnull=False))
+    students = list(queue_queryset.filter(players__tutor_student__isnull=False, players__tutor_mentor__isnull=True))
+
+    if not mentors or not students:
+        return []
+
+    pairs = mentor_assign_students([party.get_avg_elo() for party in mentors],
+                                   [party.get_avg_elo() for party in students])
+    matched_pks = []
+
+    for mentor_idx, student_idx in pairs:
+        if mm_create_new_match([mentors[mentor_idx], students[student_idx]]) is not None:
+            matched_pks.extend((mentors[mentor_idx].pk, students[student_idx].pk))
+
+    logger.info('MM_TUTOR: Queue %s - Mentors: %s, Students: %s, Matches: %s' % (queue_name, len(mentors),
+                                                                               len(students), len(matched_pks) // 2))
+    return matched_pks
+
 
 def mentor_process_queue(q_dict, q_queryset, logger):
-    """ Builds player-mentor matches from current Queue """
-    pass
+    """ Builds player-mentor matches from current Queue
+            * Mentors and students are matched inside each sub-queue (e.g. region)
+            * Parties left over stay in the main queue for the next stages
+    """
+    if q_dict:
+        matched_pks = []
+        for queue_name, queue in sorted(q_dict.items()):
+            queue_matched_pks = mentor_process_sub_queue(queue, logger, queue_name)
+            if queue_matched_pks:
+                q_dict[queue_name] = queue.exclude(pk__in=queue_matched_pks)
+            matched_pks.extend(queue_matched_pks)
+    else:
+        matched_pks = mentor_process_sub_queue(q_queryset, logger, 'segment')
+
+    if matched_pks:
+        return q_queryset.exclude(pk__in=matched_pks)
@@ -1 +1,3 @@
-RANGE_EXTENSION = ....app_settings.ELO_RANK_INCREMENT/2  # How far from party's elo a student and mentor can match
+from ...app_settings import ELO_RANK_INCREMENT
+
+RANGE_EXTENSION = ELO_RANK_INCREMENT / 2  # How far from party's elo a student and mentor can match
@@ -0,0 +1,104 @@
+"""
+Batched new-match notifications over the channel layer
+
+Matches created while a batch is open (a stack run, a daemon pass) are collected and
+sent together once it closes: one group message per team channel (CHAN_TEAM_Q_STATUS
++ team name), so every player of both teams hears of the match without polling.
+
+    * Matches are only collected once their transaction commits, so a rolled back
+      stage never notifies
+    * Messages carry the time their batch closed (closed_at), and each flush is traced
+      on the 'notify' stack, to measure notification latency against tick completion
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from channels import Group
+from django.db import transaction
+
+from .app_settings import CHAN_TEAM_Q_STATUS, OP_NEW_MATCH, MM_NOTIFY_MATCHES
+from .tracing import trace_stage
+
+
+class NotifyBatch(threading.local):
+    """
+    Per-thread collector of pending messages
+        - Each thread (a Celery worker, the daemon) only collects into the batch it opened.
+          Matches are created on the stack's own thread, sub-queue threads only pair
+        - Batches nest, messages are handed back when the outermost one closes
+    """
+
+    def __init__(self):
+        self._depth = 0
+        self._pending = []
+
+    def open(self):
+        self._depth += 1
+
+    def close(self):
+        """ Closes a batch, returning the pending messages if it was the outermost one """
+        self._depth -= 1
+        if self._depth:
+            return []
+        pending, self._pending = self._pending, []
+        return pending
+
+    def add(self, messages):
+        """ Adds messages to the open batch, returns False if there is none """
+        if not self._depth:
+            return False
+        self._pending.extend(messages)
+        return True
+
+
+_notify_batch = NotifyBatch()
+
+
+def notify_build_match_messages(match, teams):
+    """ Returns the [(group name, message)] announcing a match to each of its teams """
+    message = {
+        'op': OP_NEW_MATCH,
+        'match': match.pk,
+        'teams': [team.name for team in teams],
+    }
+    return [(CHAN_TEAM_Q_STATUS + team.name, message) for team in teams]
+
+
+def notify_send(messages, tick=None, closed_at=None):
+    """ Sends messages to their team groups through the channel layer """
+    closed_at = time.time() if closed_at is None else closed_at
+
+    with trace_stage(tick, 'notify', OP_NEW_MATCH) as record:
+        for group_name, message in messages:
+            Group(group_name).send({'text': json.dumps(dict(message, closed_at=closed_at))})
+
+        record['messages'] = len(messages)
+        record['latency'] = time.time() - closed_at  # Tick completion to last message handed to the layer
+
+
+def notify_match_created(match, teams):
+    """ Queues the match's notifications for when its transaction commits """
+    if not MM_NOTIFY_MATCHES:
+        return
+
+    messages = notify_build_match_messages(match, teams)
+
+    def collect():
+        if not _notify_batch.add(messages):
+            notify_send(messages)  # Created outside of any batch
+
+    transaction.on_commit(collect)
+
+
+@contextmanager
+def notify_batch(tick=None):
+    """ Collects the notifications of matches created inside the block, sending them on exit """
+    _notify_batch.open()
+    try:
+        yield
+    finally:
+        messages = _notify_batch.close()
+        if messages:
+            notify_send(messages, tick)
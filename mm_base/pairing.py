@@ -0,0 +1,113 @@
+"""
+Pairing strategies for Matchmaking
+
+A strategy takes the banded quality / match mask of a segment sorted by elo
+(see skill_calculate_quality_matrix) and returns the (idx, idx) pairs to match
+"""
+import numpy as np
+
+from .app_settings import MM_PAIRING_STRATEGY, MM_PAIRING_BAND, MM_PAIRING_ELO_WINDOW, MM_PAIRING_MATCH_BONUS
+
+
+def pairing_build_elo_window_mask(avg_elos, band, elo_window=MM_PAIRING_ELO_WINDOW):
+    """
+    Builds the sparse edge mask of a segment
+        - Adjacent parties are always an edge, so no strategy sees fewer edges than greedy
+        - Further parties are an edge only inside the elo window
+    """
+    avg_elos = np.asarray(avg_elos, dtype=float)
+    segment_size = len(avg_elos)
+    window_mask = np.zeros((segment_size, band), dtype=bool)
+
+    for offset in range(1, min(band, segment_size - 1) + 1):
+        if offset == 1:
+            window_mask[:-offset, 0] = True
+        else:
+            window_mask[:-offset, offset - 1] = np.abs(avg_elos[offset:] - avg_elos[:-offset]) <= elo_window
+
+    return window_mask
+
+
+def pairing_greedy(quality_band, match_mask, pair_priorities=None):
+    """ Pairs adjacent parties front to back, passing over a party when its neighbour is not a match """
+    segment_size = len(match_mask)
+    pairs = []
+    idx = 0
+
+    while idx + 1 < segment_size:
+        if match_mask[idx, 0]:
+            pairs.append((idx, idx + 1))
+            idx += 2
+        else:
+            idx += 1
+
+    return pairs
+
+
+def pairing_max_weight(quality_band, match_mask, pair_priorities=None, match_bonus=MM_PAIRING_MATCH_BONUS):
+    """
+    Pairs parties with a maximum-weight matching over the segment's quality graph
+        - Edges only exist inside the band, so the matching is solved exactly by
+          dynamic programming over which of the next band parties are taken
+        - Runs in O(n * 2^band * band)
+        - Each match weighs (match_bonus + quality) * its pair priority, 1 if not given
+    """
+    segment_size, band = match_mask.shape
+    if pair_priorities is None:
+        pair_priorities = np.ones(match_mask.shape)
+
+    edges = [[(offset, (match_bonus + float(quality_band[idx, offset - 1])) * float(pair_priorities[idx, offset - 1]))
+              for offset in range(1, band + 1) if match_mask[idx, offset - 1]]
+             for idx in range(segment_size)]
+
+    states = {0: 0.0}  # bitmask of taken parties (bit 0 = current party) -> best weight
+    history = []  # per party: new state -> (previous state, offset of partner or None)
+
+    for idx in range(segment_size):
+        next_states = {}
+        choices = {}
+
+        for taken, weight in states.items():
+            # Pass over the party (or it was already taken by an earlier one)
+            candidates = [(taken >> 1, weight, None)]
+
+            if not taken & 1:
+                for offset, edge_weight in edges[idx]:
+                    if not taken & (1 << offset):
+                        candidates.append(((taken | (1 << offset)) >> 1, weight + edge_weight, offset))
+
+            for next_taken, next_weight, offset in candidates:
+                if next_taken not in next_states or next_weight > next_states[next_taken]:
+                    next_states[next_taken] = next_weight
+                    choices[next_taken] = (taken, offset)
+
+        history.append(choices)
+        states = next_states
+
+    # Walk the choices back from the empty final state
+    pairs = []
+    taken = 0
+    for idx in reversed(range(segment_size)):
+        taken, offset = history[idx][taken]
+        if offset is not None:
+            pairs.append((idx, idx + offset))
+
+    pairs.reverse()
+    return pairs
+
+
+""" Dictionary of available pairing strategies
+        - FUNCTION SIGNATURE:
+            * pairing_name(quality_band, match_mask, pair_priorities=None)
+            * pair_priorities is shaped like the match mask (see lanes.py)
+"""
+MM_PAIRING_STRATEGIES = {
+    'greedy':                   pairing_greedy,
+    'max_weight':               pairing_max_weight,
+}
+
+
+def pairing_get_strategy(name=MM_PAIRING_STRATEGY):
+    """ Returns the pairing strategy and the band it needs """
+    band = 1 if name == 'greedy' else MM_PAIRING_BAND
+    return MM_PAIRING_STRATEGIES[name], band
@@ -0,0 +1,356 @@
+"""
+Shared queue backends for the queue index
+
+The default 'sql' backend is the per-process QueueIndex of queue_index.py, synced from
+the Party table. The backends here keep queue state in Redis instead, shared by every
+process, so queueing, dequeueing and claiming never write SQL; the Party row is only
+written once a match is created (and by the expedite pass).
+
+    * Each region is a sorted set of party pks scored by avg elo, read with ZRANGEBYSCORE
+    * A claim moves parties out of their region's sorted set, so no two workers hold one
+    * FakeRedis implements the commands used here in-process, for tests without a server
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+
+from .app_settings import Q_CLAIM_TIMEOUT, MM_QUEUE_REDIS_URL, MM_QUEUE_REDIS_PREFIX
+
+
+class RedisQueueIndex(object):
+    """
+    Queued parties in Redis, with the QueueIndex interface plus claims
+        - {prefix}parties : hash pk -> 'region|elo' of every queued (or claimed) party
+        - {prefix}region:{region} : sorted set of unclaimed pks, scored by elo
+        - {prefix}regions : set of regions that were ever queued
+        - {prefix}claim:{token} : set of pks a worker claimed
+        - {prefix}claims : sorted set of claim tokens, scored by claim time
+    """
+    is_shared = True  # State is shared by every process, there is nothing to sync
+
+    def __init__(self, client, prefix=MM_QUEUE_REDIS_PREFIX, claim_timeout=Q_CLAIM_TIMEOUT):
+        self.client = client
+        self.prefix = prefix
+        self.claim_timeout = claim_timeout
+        self.last_sync = None
+
+    def _key(self, *parts):
+        return self.prefix + ':'.join(parts)
+
+    def _region_key(self, region):
+        return self._key('region', region or '')
+
+    @staticmethod
+    def _decode(value):
+        return value.decode() if isinstance(value, bytes) else value
+
+    def _parse_location(self, value):
+        region, elo = self._decode(value).rsplit('|', 1)
+        return region or None, float(elo)
+
+    def __len__(self):
+        return self.client.hlen(self._key('parties'))
+
+    def __contains__(self, pk):
+        return bool(self.client.hexists(self._key('parties'), pk))
+
+    def add(self, pk, region, elo):
+        """ Adds a party to the index. A party already indexed is only moved, so a claim on it holds """
+        if pk in self:
+            self.move(pk, region, elo)
+            return
+
+        pipe = self.client.pipeline()
+        pipe.hset(self._key('parties'), pk, '%s|%r' % (region or '', float(elo)))
+        pipe.zadd(self._region_key(region), {pk: float(elo)})
+        pipe.sadd(self._key('regions'), region or '')
+        pipe.execute()
+
+    def move(self, pk, region, elo):
+        """
+        Moves an indexed party's region / elo
+            - Only parties still in their region's sorted set are re-scored. ZADD XX and ZREM
+              are atomic, so a party claimed meanwhile is never put back where others can claim it
+            - A claimed party only has its hash entry updated, release() queues it at the new elo
+        """
+        location = self.client.hget(self._key('parties'), pk)
+        if location is None:
+            return
+
+        old_region = self._parse_location(location)[0]
+        pipe = self.client.pipeline()
+        pipe.hset(self._key('parties'), pk, '%s|%r' % (region or '', float(elo)))
+        if old_region == region:
+            pipe.zadd(self._region_key(region), {pk: float(elo)}, xx=True)
+            pipe.execute()
+            return
+
+        pipe.zrem(self._region_key(old_region), pk)
+        if pipe.execute()[-1]:
+            # Taken out of the old region like a claim, so only this call may queue it again
+            pipe = self.client.pipeline()
+            pipe.zadd(self._region_key(region), {pk: float(elo)})
+            pipe.sadd(self._key('regions'), region or '')
+            pipe.execute()
+
+    def discard(self, pk):
+        """ Removes a party from the index (and from its claim, if any) if present """
+        location = self.client.hget(self._key('parties'), pk)
+        if location is None:
+            return
+
+        region, elo = self._parse_location(location)
+        pipe = self.client.pipeline()
+        pipe.zrem(self._region_key(region), pk)
+        pipe.hdel(self._key('parties'), pk)
+        pipe.execute()
+
+    def clear(self):
+        regions = self.client.smembers(self._key('regions'))
+        claims = self.client.zrangebyscore(self._key('claims'), '-inf', '+inf')
+        self.client.delete(self._key('parties'), self._key('regions'), self._key('claims'),
+                           *([self._region_key(self._decode(region)) for region in regions] +
+                             [self._key('claim', self._decode(token)) for token in claims]))
+
+    def get_location(self, pk):
+        """ Returns (region, elo) of an indexed party, or None """
+        location = self.client.hget(self._key('parties'), pk)
+        return None if location is None else self._parse_location(location)
+
+    def get_indexed_pks(self, party_pks):
+        """ Returns the pks among party_pks still indexed (not dequeued), claimed or not, in one HMGET """
+        party_pks = list(party_pks)
+        locations = self.client.hmget(self._key('parties'), party_pks) if party_pks else []
+        return [pk for pk, location in zip(party_pks, locations) if location is not None]
+
+    def get_pks(self):
+        """ Returns the set of every indexed party pk, claimed or not """
+        return set(int(pk) for pk in self.client.hkeys(self._key('parties')))
+
+    def get_regions(self):
+        """ Returns the regions that have unclaimed queued parties """
+        regions = sorted(self._decode(region) for region in self.client.smembers(self._key('regions')))
+        pipe = self.client.pipeline()
+        for region in regions:
+            pipe.zcard(self._region_key(region))
+        return [region or None for region, size in zip(regions, pipe.execute()) if size]
+
+    def get_range(self, region, low_elo=None, high_elo=None):
+        """ Returns the pks of a region's unclaimed parties with low_elo <= elo <= high_elo, sorted by elo """
+        return [int(pk) for pk in self.client.zrangebyscore(self._region_key(region),
+                                                            '-inf' if low_elo is None else low_elo,
+                                                            '+inf' if high_elo is None else high_elo)]
+
+    def claim(self, party_pks, claim_token):
+        """
+        Claims queued parties for one worker
+            - ZREM is atomic, so only the worker that removes a party from its region holds it
+            - Stale claims (crashed workers) are released first
+            - Returns the claimed pks
+        """
+        self.release_stale()
+        party_pks = list(party_pks)
+        locations = self.client.hmget(self._key('parties'), party_pks) if party_pks else []
+
+        pipe = self.client.pipeline()
+        queued_pks = []
+        for pk, location in zip(party_pks, locations):
+            if location is not None:
+                pipe.zrem(self._region_key(self._parse_location(location)[0]), pk)
+                queued_pks.append(pk)
+        claimed = [pk for pk, removed in zip(queued_pks, pipe.execute()) if removed]
+
+        if claimed:
+            pipe = self.client.pipeline()
+            pipe.sadd(self._key('claim', claim_token), *claimed)
+            pipe.zadd(self._key('claims'), {claim_token: time.time()})
+            pipe.execute()
+
+        return claimed
+
+    def release(self, claim_token):
+        """ Puts a worker's claimed parties that are still queued (unmatched) back in their region """
+        claimed = list(self.client.smembers(self._key('claim', claim_token)))
+        locations = self.client.hmget(self._key('parties'), claimed) if claimed else []
+
+        pipe = self.client.pipeline()
+        num_released = 0
+        for pk, location in zip(claimed, locations):
+            if location is not None:
+                region, elo = self._parse_location(location)
+                pipe.zadd(self._region_key(region), {int(pk): elo})
+                num_released += 1
+        pipe.delete(self._key('claim', claim_token))
+        pipe.zrem(self._key('claims'), claim_token)
+        pipe.execute()
+
+        return num_released
+
+    def release_stale(self):
+        """ Releases the claims older than claim_timeout """
+        stale_tokens = self.client.zrangebyscore(self._key('claims'), '-inf', time.time() - self.claim_timeout)
+        for token in stale_tokens:
+            self.release(self._decode(token))
+
+
+class FakeRedis(object):
+    """ In-process stand-in for the redis.StrictRedis commands used by RedisQueueIndex """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+
+    def pipeline(self, transaction=True):
+        return FakeRedisPipeline(self)
+
+    @staticmethod
+    def _member(value):
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def _get(self, key, kind):
+        value = self._data.get(key)
+        if value is None:
+            value = self._data[key] = kind()
+        return value
+
+    def _zset(self, key):
+        return self._get(key, lambda: ({}, []))  # member -> score, sorted list of (score, member)
+
+    def _cleanup(self, key):
+        value = self._data.get(key)
+        if value is not None and not (value[0] if isinstance(value, tuple) else value):
+            del self._data[key]
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    # Hashes
+    def hset(self, key, field, value):
+        with self._lock:
+            fields = self._get(key, dict)
+            is_new = self._member(field) not in fields
+            fields[self._member(field)] = self._member(value)
+            return int(is_new)
+
+    def hget(self, key, field):
+        with self._lock:
+            return self._data.get(key, {}).get(self._member(field))
+
+    def hmget(self, key, fields):
+        with self._lock:
+            return [self._data.get(key, {}).get(self._member(field)) for field in fields]
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            values = self._data.get(key, {})
+            removed = sum(values.pop(self._member(field), None) is not None for field in fields)
+            self._cleanup(key)
+            return removed
+
+    def hexists(self, key, field):
+        with self._lock:
+            return self._member(field) in self._data.get(key, {})
+
+    def hkeys(self, key):
+        with self._lock:
+            return list(self._data.get(key, {}))
+
+    def hlen(self, key):
+        with self._lock:
+            return len(self._data.get(key, {}))
+
+    # Sets
+    def sadd(self, key, *members):
+        with self._lock:
+            values = self._get(key, set)
+            added = set(self._member(member) for member in members) - values
+            values.update(added)
+            return len(added)
+
+    def smembers(self, key):
+        with self._lock:
+            return set(self._data.get(key, set()))
+
+    # Sorted sets
+    def zadd(self, key, mapping, xx=False):
+        with self._lock:
+            scores, entries = self._zset(key)
+            added = 0
+            for member, score in mapping.items():
+                member, score = self._member(member), float(score)
+                if xx and member not in scores:
+                    continue
+                if member in scores:
+                    del entries[bisect_left(entries, (scores[member], member))]
+                else:
+                    added += 1
+                scores[member] = score
+                insort(entries, (score, member))
+            return added
+
+    def zrem(self, key, *members):
+        with self._lock:
+            if key not in self._data:
+                return 0
+            scores, entries = self._data[key]
+            removed = 0
+            for member in map(self._member, members):
+                if member in scores:
+                    del entries[bisect_left(entries, (scores.pop(member), member))]
+                    removed += 1
+            self._cleanup(key)
+            return removed
+
+    def zcard(self, key):
+        with self._lock:
+            return len(self._data[key][0]) if key in self._data else 0
+
+    def zrangebyscore(self, key, low, high):
+        with self._lock:
+            if key not in self._data:
+                return []
+            entries = self._data[key][1]
+            start = bisect_left(entries, (float(low),))
+            end = bisect_right(entries, (float(high), b'\xff' * 32))
+            return [member for score, member in entries[start:end]]
+
+
+class FakeRedisPipeline(object):
+    """ Buffers commands and runs them together on execute(), like a MULTI / EXEC pipeline """
+
+    def __init__(self, client):
+        self.client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+
+        def buffer(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return buffer
+
+    def execute(self):
+        with self.client._lock:
+            results = [command(*args, **kwargs) for command, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+
+def queue_backend_redis():
+    """ Redis backend on MM_QUEUE_REDIS_URL """
+    import redis  # Optional dependency, installed with celery[redis]
+    return RedisQueueIndex(redis.StrictRedis.from_url(MM_QUEUE_REDIS_URL))
+
+
+def queue_backend_fake_redis():
+    """ Redis backend on an in-process FakeRedis, for tests and single-process runs """
+    return RedisQueueIndex(FakeRedis())
+
+
+""" Shared queue backends that can be named in MM_QUEUE_BACKEND ('sql' is the default QueueIndex) """
+MM_QUEUE_BACKEND_TYPES = {
+    'redis':                    queue_backend_redis,
+    'fake_redis':               queue_backend_fake_redis,
+}
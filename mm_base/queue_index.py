@@ -0,0 +1,189 @@
+"""
+In-memory skill index of queued parties
+
+Parties are kept per region in ELO_RANK_INCREMENT buckets of (elo, pk) sorted lists,
+so the matchmaker can read a candidate range without scanning the Party table.
+
+    * Saves in this process update the index through signals (see signals/handlers.py),
+      once their transaction commits
+    * Saves in other processes are picked up by queue_index_sync(), which only
+      reads parties whose queue_updated changed since MM_QUEUE_SYNC_MARGIN before
+      the last sync. queue_updated is stamped before commit, the margin catches
+      transactions that commit late
+    * MM_QUEUE_BACKEND may swap this index for a shared one (see queue_backends.py)
+"""
+import datetime
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+from django.utils import timezone
+
+from .app_settings import ELO_RANK_INCREMENT, MM_QUEUE_BACKEND, MM_QUEUE_SYNC_MARGIN
+from .models.core_models import Party
+from .queue_backends import MM_QUEUE_BACKEND_TYPES
+
+
+class QueueIndex(object):
+    """ Queued parties keyed by region and elo bucket """
+    is_shared = False  # Per-process, synced from the Party table
+
+    def __init__(self, rank_increment=ELO_RANK_INCREMENT):
+        self.rank_increment = rank_increment
+        self._buckets = {}  # (region, bucket) -> sorted list of (elo, pk)
+        self._region_buckets = {}  # region -> sorted list of non-empty buckets
+        self._locations = {}  # pk -> (region, bucket, elo)
+        self._lock = threading.RLock()
+        self.last_sync = None
+
+    def __len__(self):
+        return len(self._locations)
+
+    def __contains__(self, pk):
+        return pk in self._locations
+
+    def get_bucket(self, elo):
+        """ Returns the elo bucket (floor of rank increment) of elo """
+        return int(elo // self.rank_increment)
+
+    def add(self, pk, region, elo):
+        """ Adds or moves a party in the index """
+        with self._lock:
+            self.discard(pk)
+            bucket = self.get_bucket(elo)
+            key = (region, bucket)
+
+            if key not in self._buckets:
+                self._buckets[key] = []
+                insort(self._region_buckets.setdefault(region, []), bucket)
+
+            insort(self._buckets[key], (elo, pk))
+            self._locations[pk] = (region, bucket, elo)
+
+    def discard(self, pk):
+        """ Removes a party from the index if present """
+        with self._lock:
+            location = self._locations.pop(pk, None)
+            if location is None:
+                return
+
+            region, bucket, elo = location
+            entries = self._buckets[(region, bucket)]
+            del entries[bisect_left(entries, (elo, pk))]
+
+            # Drop empty buckets so range reads only visit populated ones
+            if not entries:
+                del self._buckets[(region, bucket)]
+                region_buckets = self._region_buckets[region]
+                del region_buckets[bisect_left(region_buckets, bucket)]
+                if not region_buckets:
+                    del self._region_buckets[region]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self._region_buckets.clear()
+            self._locations.clear()
+
+    def get_location(self, pk):
+        """ Returns (region, elo) of an indexed party, or None """
+        with self._lock:
+            location = self._locations.get(pk)
+            return None if location is None else (location[0], location[2])
+
+    def get_pks(self):
+        """ Returns the set of every indexed party pk """
+        with self._lock:
+            return set(self._locations)
+
+    def get_regions(self):
+        """ Returns the regions that have queued parties """
+        with self._lock:
+            return list(self._region_buckets)
+
+    def get_range(self, region, low_elo=None, high_elo=None):
+        """ Returns the pks of a region's parties with low_elo <= elo <= high_elo, sorted by elo """
+        with self._lock:
+            region_buckets = self._region_buckets.get(region, [])
+            first = 0 if low_elo is None else bisect_left(region_buckets, self.get_bucket(low_elo))
+            last = len(region_buckets) if high_elo is None else bisect_right(region_buckets,
+                                                                              self.get_bucket(high_elo))
+            pks = []
+
+            for bucket in region_buckets[first:last]:
+                entries = self._buckets[(region, bucket)]
+                start = 0 if low_elo is None else bisect_left(entries, (low_elo,))
+                end = len(entries) if high_elo is None else bisect_right(entries, (high_elo, float('inf')))
+                pks.extend(pk for elo, pk in entries[start:end])
+
+            return pks
+
+
+def queue_index_build(name=MM_QUEUE_BACKEND):
+    """ Builds the queue index of a MM_QUEUE_BACKEND name """
+    if name == 'sql':
+        return QueueIndex()
+    return MM_QUEUE_BACKEND_TYPES[name]()
+
+
+_queue_index = queue_index_build()
+
+
+def queue_index_is_party_queued(party):
+    """ Is the party waiting in queue (queued and not locked to a match)? """
+    return party.is_queued and party.current_match_id is None
+
+
+def queue_index_update_party(party, index=_queue_index):
+    """ Adds a queued party to the index, or removes it once dequeued / locked to a match """
+    if index.is_shared:
+        # Queueing is written to the shared backend directly, saves only lock parties or move their elo.
+        # move() never re-queues a claimed party. Unindexed or empty parties have no elo to move
+        if party.current_match_id is not None:
+            index.discard(party.pk)
+        elif party.roster_size and party.pk in index:
+            index.move(party.pk, party.region, party.get_avg_elo())
+    elif queue_index_is_party_queued(party) and party.roster_size:
+        index.add(party.pk, party.region, party.get_avg_elo())
+    else:
+        index.discard(party.pk)
+
+
+def queue_index_remove_party(party, index=_queue_index):
+    """ Removes a party from the index """
+    index.discard(party.pk)
+
+
+def queue_index_rebuild(index=_queue_index):
+    """ Rebuilds a per-process index from every queued party """
+    sync_time = timezone.now()
+    queued_parties = Party.objects.filter(is_queued=True, current_match=None)
+
+    with index._lock:
+        index.clear()
+        for party in queued_parties:
+            index.add(party.pk, party.region, party.get_avg_elo())
+        index.last_sync = sync_time
+
+
+def queue_index_sync(index=_queue_index):
+    """ Applies parties changed since the last sync, rebuilding the index on first use """
+    if index.is_shared:
+        return
+
+    if index.last_sync is None:
+        queue_index_rebuild(index)
+        return
+
+    sync_time = timezone.now()
+    # Re-applying a party is idempotent, so overlapping windows only cost the re-read
+    for party in Party.objects.filter(
+            queue_updated__gte=index.last_sync - datetime.timedelta(seconds=MM_QUEUE_SYNC_MARGIN)):
+        queue_index_update_party(party, index)
+    index.last_sync = sync_time
+
+
+def queue_index_get(sync=True):
+    """ Returns the process' queue index, synced with the Party table """
+    if sync:
+        queue_index_sync(_queue_index)
+    return _queue_index
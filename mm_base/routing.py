@@ -0,0 +1,20 @@
+from channels.routing import route
+
+from .consumers import ws_team_status_connect, ws_team_status_disconnect, ws_team_chat_connect, \
+    ws_team_chat_receive, ws_team_chat_disconnect, ws_match_chat_connect, ws_match_chat_receive, \
+    ws_match_chat_disconnect
+
+TEAM_STATUS_PATH = r'^/team/(?P<team_name>[-\w]+)/status/$'
+TEAM_CHAT_PATH = r'^/team/(?P<team_name>[-\w]+)/chat/$'
+MATCH_CHAT_PATH = r'^/match/(?P<match_pk>\d+)/chat/$'
+
+mm_routes = [
+    route('websocket.connect', ws_team_status_connect, path=TEAM_STATUS_PATH),
+    route('websocket.disconnect', ws_team_status_disconnect, path=TEAM_STATUS_PATH),
+    route('websocket.connect', ws_team_chat_connect, path=TEAM_CHAT_PATH),
+    route('websocket.receive', ws_team_chat_receive, path=TEAM_CHAT_PATH),
+    route('websocket.disconnect', ws_team_chat_disconnect, path=TEAM_CHAT_PATH),
+    route('websocket.connect', ws_match_chat_connect, path=MATCH_CHAT_PATH),
+    route('websocket.receive', ws_match_chat_receive, path=MATCH_CHAT_PATH),
+    route('websocket.disconnect', ws_match_chat_disconnect, path=MATCH_CHAT_PATH),
+]
@@ -0,0 +1,38 @@
+import copy
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from ..leaderboard import leaderboard_add_player, leaderboard_remove_player
+from ..models.core_models import Party, Player
+from ..queue_index import queue_index_update_party, queue_index_remove_party
+
+
+@receiver(post_save, sender=Party)
+def party_update_queue_index(sender, instance, **kwargs):
+    """
+    Enqueue / dequeue / lock events keep the queue index current
+        - Applied once the transaction commits, so a rolled back lock never drops a party
+        - The party is copied as saved, later changes in the transaction queue their own update
+    """
+    party = copy.copy(instance)
+    transaction.on_commit(lambda: queue_index_update_party(party))
+
+
+@receiver(post_delete, sender=Party)
+def party_remove_from_queue_index(sender, instance, **kwargs):
+    party = copy.copy(instance)
+    transaction.on_commit(lambda: queue_index_remove_party(party))
+
+
+@receiver(post_save, sender=Player)
+def player_add_to_leaderboard(sender, instance, created, **kwargs):
+    """ Rating changes reach the leaderboard from rating commits, only new players are added here """
+    if created:
+        leaderboard_add_player(instance.elo)
+
+
+@receiver(post_delete, sender=Player)
+def player_remove_from_leaderboard(sender, instance, **kwargs):
+    leaderboard_remove_player(instance.elo)
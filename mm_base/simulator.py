@@ -0,0 +1,174 @@
+"""
+Discrete-event simulator of the queue / expedite loop
+
+Runs the real pairing (mm_core_pair_segment) and queue lanes (lanes.py)
+against an in-memory queue, to plan capacity offline:
+
+    * Parties arrive as a Poisson process with ratings drawn like the benchmark's,
+      a plus_fraction of them holding a Plus member
+    * Every tick pairs each region's queue in Q_SEGMENT_SIZE segments
+    * Unmatched parties are expedited, matched parties play for a random duration
+      (capped at MM_MATCH_MAX_DURATION) and may queue again afterwards
+"""
+import heapq
+
+import numpy as np
+
+from .app_settings import TEAM_SIZE, REGIONS, ELO_AVG_RATING, ELO_RANK_INCREMENT, ELO_INCREMENT_RANGE, \
+    ELO_EXPEDITED_MAX_PASSES, Q_SEGMENT_SIZE, MM_MATCH_MAX_DURATION
+from .lanes import LaneScheduler, lane_classify
+from .models.core_middleware import mm_core_pair_segment
+
+SIM_QUALITY_BINS = 20  # Histogram bins of match quality over [0, 1]
+SIM_WAIT_PERCENTILES = (50, 90, 95, 99)
+
+
+class SimParty(object):
+    """ In-memory stand-in for a queued Party """
+    __slots__ = ('region', 'roster_size', 'mu_sum', 'sigma_sq_sum', 'is_plus', 'passes', 'queued_at')
+
+    def __init__(self, region, roster_size, mu_sum, sigma_sq_sum, is_plus=False):
+        self.region = region
+        self.roster_size = roster_size
+        self.mu_sum = mu_sum
+        self.sigma_sq_sum = sigma_sq_sum
+        self.is_plus = is_plus
+        self.passes = 0
+        self.queued_at = 0.0
+
+
+def sim_generate_parties(num_parties, rng, plus_fraction=0.0):
+    """ Generates parties whose players cluster around a party skill, spread across REGIONS """
+    regions = [code for code, name in REGIONS if code is not None]
+    party_mu = rng.normal(ELO_AVG_RATING, ELO_RANK_INCREMENT, (num_parties, 1))
+    player_mu = np.maximum(party_mu + rng.normal(0, ELO_INCREMENT_RANGE / 2.0, (num_parties, TEAM_SIZE)), 0)
+    player_sigma = rng.uniform(50, ELO_INCREMENT_RANGE, (num_parties, TEAM_SIZE))
+
+    is_plus = rng.uniform(size=num_parties) < plus_fraction
+
+    return [SimParty(regions[rng.randint(len(regions))], TEAM_SIZE, float(player_mu[idx].sum()),
+                     float((player_sigma[idx] ** 2).sum()), bool(is_plus[idx]))
+            for idx in range(num_parties)]
+
+
+def sim_pair_queue(queue, scheduler, now, segment_size=Q_SEGMENT_SIZE):
+    """
+    Runs one tick of pairing over a region's queue, steering the scheduler's lanes like mm_core_process_queue
+        - Returns ([(party, party, quality, is forced)], [unmatched party])
+    """
+    queue = sorted(queue, key=lambda party: party.mu_sum / party.roster_size)
+    matched = []
+    unmatched = []
+
+    for first in range(0, len(queue), segment_size):
+        segment = queue[first:first + segment_size]
+        roster_sizes = np.array([party.roster_size for party in segment], dtype=float)
+        mu_sums = np.array([party.mu_sum for party in segment])
+        sigma_sq_sums = np.array([party.sigma_sq_sum for party in segment])
+        lanes = lane_classify([party.is_plus for party in segment], [party.passes for party in segment], scheduler)
+        waits = np.array([now - party.queued_at for party in segment])
+        thresholds, passes, priorities = scheduler.build(lanes, waits)
+
+        elo_order, pairs, quality_band = mm_core_pair_segment(roster_sizes, mu_sums, sigma_sq_sums, thresholds,
+                                                              passes, priorities)
+        segment = [segment[idx] for idx in elo_order]
+        is_forced = passes[elo_order] >= ELO_EXPEDITED_MAX_PASSES
+        paired = set()
+
+        for idx, next_idx in pairs:
+            matched.append((segment[idx], segment[next_idx], float(quality_band[idx, next_idx - idx - 1]),
+                            bool(is_forced[idx] or is_forced[next_idx])))
+            paired.update((idx, next_idx))
+
+        unmatched.extend(party for idx, party in enumerate(segment) if idx not in paired)
+        scheduler.observe(lanes[elo_order], waits[elo_order], [idx in paired for idx in range(len(segment))])
+
+    return matched, unmatched
+
+
+def sim_run(hours=1.0, arrival_rate=2.0, tick_interval=10.0, match_minutes=35.0, requeue_probability=0.7,
+            plus_fraction=0.1, seed=0, segment_size=Q_SEGMENT_SIZE):
+    """
+    Simulates hours of queue traffic
+        - arrival_rate : new parties per second
+        - tick_interval : seconds between matchmaking ticks
+        - match_minutes : mean match duration, capped at MM_MATCH_MAX_DURATION
+        - requeue_probability : chance a party queues again once its match ends
+        - plus_fraction : share of parties in the plus lane
+        - Returns a JSON-serializable report of wait times (overall and per lane), quality and queue length
+    """
+    rng = np.random.RandomState(seed)
+    scheduler = LaneScheduler()
+    end_time = hours * 3600.0
+    queues = {}  # region -> [SimParty]
+    match_ends = []  # heap of (end time, sequence, parties)
+    waits = []
+    lane_waits = {name: [] for name in scheduler.names}  # Lane each party waited in when matched
+    qualities = []
+    queue_lengths = []
+    num_forced = 0
+    sequence = 0
+    now = 0.0
+
+    while now < end_time:
+        # Arrivals since the last tick, uniformly spread over the interval
+        arrivals = sim_generate_parties(rng.poisson(arrival_rate * tick_interval), rng, plus_fraction)
+        for party, offset in zip(arrivals, rng.uniform(0, tick_interval, len(arrivals))):
+            party.queued_at = now - offset
+            queues.setdefault(party.region, []).append(party)
+
+        # Parties whose match ended queue again
+        while match_ends and match_ends[0][0] <= now:
+            ended_at, _, parties = heapq.heappop(match_ends)
+            for party in parties:
+                if rng.uniform() < requeue_probability:
+                    party.passes = 0
+                    party.queued_at = ended_at
+                    queues.setdefault(party.region, []).append(party)
+
+        for region in list(queues):
+            matched, unmatched = sim_pair_queue(queues[region], scheduler, now, segment_size)
+
+            for party_1, party_2, quality, is_forced in matched:
+                for party in (party_1, party_2):
+                    waits.append(now - party.queued_at)
+                    lane = 'plus' if party.is_plus else 'expedited' if party.passes else 'normal'
+                    lane_waits[lane].append(now - party.queued_at)
+                qualities.append(quality)
+                num_forced += is_forced
+
+                duration = min(rng.exponential(match_minutes), MM_MATCH_MAX_DURATION) * 60.0
+                heapq.heappush(match_ends, (now + duration, sequence, (party_1, party_2)))
+                sequence += 1
+
+            # Expedite every party that was passed over
+            for party in unmatched:
+                party.passes += 1
+            queues[region] = unmatched
+
+        queue_lengths.append(sum(len(queue) for queue in queues.values()))
+        now += tick_interval
+
+    waits = np.array(waits)
+    qualities = np.array(qualities)
+    histogram, edges = np.histogram(qualities, bins=SIM_QUALITY_BINS, range=(0.0, 1.0))
+
+    return {
+        'params': {'hours': hours, 'arrival_rate': arrival_rate, 'tick_interval': tick_interval,
+                   'match_minutes': match_minutes, 'requeue_probability': requeue_probability,
+                   'plus_fraction': plus_fraction, 'seed': seed},
+        'ticks': len(queue_lengths),
+        'matches': len(qualities),
+        'forced_matches': int(num_forced),
+        'wait_seconds': {str(pct): float(np.percentile(waits, pct)) if len(waits) else None
+                         for pct in SIM_WAIT_PERCENTILES},
+        'max_wait_seconds': float(waits.max()) if len(waits) else None,
+        'lanes': {name: dict(stats, matched=len(lane_waits[name]),
+                             wait_p99=float(np.percentile(lane_waits[name], 99)) if lane_waits[name] else None)
+                  for name, stats in scheduler.get_stats().items()},
+        'mean_quality': float(qualities.mean()) if len(qualities) else None,
+        'quality_histogram': [int(count) for count in histogram],
+        'mean_queue_length': float(np.mean(queue_lengths)) if queue_lengths else 0.0,
+        'max_queue_length': int(max(queue_lengths)) if queue_lengths else 0,
+        'still_queued': queue_lengths[-1] if queue_lengths else 0,
+    }
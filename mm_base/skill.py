@@ -1,8 +1,21 @@
 """
 Skill ranking implementation for Matchmaking
 """
-from trueskill import Rating, quality, rate
-from .app_settings import ELO_DEFAULT_FAIRNESS_THRESHOLD, ELO_EXPEDITED_FAIRNESS_MODIFIER, ELO_EXPEDITED_MAX_PASSES
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+from trueskill import Rating, global_env
+from .models.core_models import Player, MatchRosterSlot, MatchTeamSlot, roster_apply_player_ratings
+from .app_settings import ELO_DEFAULT_FAIRNESS_THRESHOLD, ELO_EXPEDITED_FAIRNESS_MODIFIER, ELO_EXPEDITED_MAX_PASSES, \
+    NUM_TEAMS, MM_BULK_BATCH_SIZE, SKILL_BACKEND
+from .leaderboard import leaderboard_apply_rating_changes
+from .skill_backends import SKILL_BACKENDS, skill_numpy_sum_quality
+
+
+def skill_get_backend(name=SKILL_BACKEND):
+    """ Returns the {'quality', 'rate'} functions of a skill backend (see skill_backends.py) """
+    return SKILL_BACKENDS[name]
 
 
 def skill_build_party_rating(party):
@@ -10,8 +23,8 @@ def skill_build_party_rating(party):
     party_arr = []
 
     if party is not None:
-        for player in party.players.all():
-            party_arr.append(Rating(mu=player.elo, sigma=player.elo_weight))
+        for player_pk, mu, sigma in party.get_rating_vector():
+            party_arr.append(Rating(mu=mu, sigma=sigma))
     return party_arr
 
 
@@ -20,18 +33,19 @@ def skill_calculate_match_quality(party_1_roster, party_2_roster):
     Calculates quality of match between 2 rosters
         - Takes 2 arrays of Rating objects
     """
-    return quality([tuple(party_1_roster), tuple(party_2_roster)])
+    return float(skill_get_backend()['quality'](
+        [[rating.mu for rating in party_1_roster]], [[rating.sigma for rating in party_1_roster]],
+        [[rating.mu for rating in party_2_roster]], [[rating.sigma for rating in party_2_roster]])[0])
 
 
 def skill_is_match(party_1, party_2, match_threshold=None):
     """ Test if match meets the available threshold """
 
     # Get the minimum fairness acceptable to match teams
-    threshold = match_threshold if match_threshold is not None else skill_get_fairness_threshold()
+    threshold = match_threshold if match_threshold is not None else ELO_DEFAULT_FAIRNESS_THRESHOLD
     party_rating_1 = skill_build_party_rating(party_1)
     party_rating_2 = skill_build_party_rating(party_2)
     result = skill_calculate_match_quality(party_rating_1, party_rating_2)
-    print('{:.1%} chance to draw'.format(result))
 
     if result >= threshold:
         return True
@@ -39,37 +53,184 @@ def skill_is_match(party_1, party_2, match_threshold=None):
     return False
 
 
-def skill_is_match_or_forced(party_1, party_2):
-    """ Tests if match or should be forced """
+def skill_get_expedited_fairness(passes):
+    """ Returns a party's fairness threshold after being passed over passes times """
+    return ELO_DEFAULT_FAIRNESS_THRESHOLD - (ELO_EXPEDITED_FAIRNESS_MODIFIER * passes)
 
-    # Get the fairness threshold where match is forced
-    exp_fairness_threshold = (ELO_DEFAULT_FAIRNESS_THRESHOLD - (ELO_EXPEDITED_FAIRNESS_MODIFIER *
-                                                                ELO_EXPEDITED_MAX_PASSES))
-    threshold = skill_get_fairness_threshold(party_1, party_2)
 
-    # If forced or matched
-    if threshold <= exp_fairness_threshold or skill_is_match(party_1, party_2, threshold):
-        return True
+def skill_build_segment_arrays(parties):
+    """
+    Builds the rating arrays of a queue segment
+        - Returns (roster_sizes, mu_sums, sigma_sq_sums), one entry per party
+    """
+    segment_size = len(parties)
+    roster_sizes = np.zeros(segment_size)
+    mu_sums = np.zeros(segment_size)
+    sigma_sq_sums = np.zeros(segment_size)
 
-    return False
+    for idx, party in enumerate(parties):
+        roster_sizes[idx] = party.roster_size
+        mu_sums[idx] = party.mu_sum
+        sigma_sq_sums[idx] = party.sigma_sq_sum
+
+    return roster_sizes, mu_sums, sigma_sq_sums
 
 
-def skill_get_fairness_threshold(party_1, party_2=None):
+def skill_calculate_quality_matrix(roster_sizes, mu_sums, sigma_sq_sums, band=None, beta=None):
     """
-    Returns lowest fairness threshold available
+    Calculates the match quality of every pair of parties in a segment in one call
+        - Closed form of trueskill.quality() for 2 teams, always numpy (see skill_backends.py)
+        - band=None returns the full (n, n) matrix, NaN on the diagonal
+        - band=k returns an (n, k) matrix where [i, d - 1] is party i against party i + d,
+          NaN past the end of the segment
+        - Not memoized: a dict lookup per pair costs more than this pass computes
+    """
+    beta = beta if beta is not None else global_env().beta
+    roster_sizes = np.asarray(roster_sizes, dtype=float)
+    mu_sums = np.asarray(mu_sums, dtype=float)
+    sigma_sq_sums = np.asarray(sigma_sq_sums, dtype=float)
+
+    def pair_quality(size_1, mu_1, sigma_sq_1, size_2, mu_2, sigma_sq_2):
+        return skill_numpy_sum_quality(size_1, mu_1, sigma_sq_1, size_2, mu_2, sigma_sq_2, beta)
+
+    if band is None:
+        matrix = pair_quality(roster_sizes[:, None], mu_sums[:, None], sigma_sq_sums[:, None],
+                              roster_sizes[None, :], mu_sums[None, :], sigma_sq_sums[None, :])
+        np.fill_diagonal(matrix, np.nan)
+        return matrix
+
+    segment_size = len(mu_sums)
+    matrix = np.full((segment_size, band), np.nan)
+
+    for offset in range(1, min(band, segment_size - 1) + 1):
+        matrix[:-offset, offset - 1] = pair_quality(roster_sizes[:-offset], mu_sums[:-offset],
+                                                    sigma_sq_sums[:-offset], roster_sizes[offset:],
+                                                    mu_sums[offset:], sigma_sq_sums[offset:])
+    return matrix
+
+
+def skill_build_expedite_passes(parties):
+    """ Builds the vector of how many times each party was passed over """
+    return np.array([party.expedite_passes for party in parties], dtype=int)
+
 
-        - Defaults to ELO_DEFAULT_FAIRNESS_THRESHOLD
-        - Can take a match up or singular team
+def skill_build_pair_values(values, combine, fill, band=None):
     """
+    Combines a per-party vector into per-pair values, shaped like a quality matrix
+        - combine : numpy ufunc such as np.minimum, applied to both parties of a pair
+        - fill : value of pairs past the end of the segment (banded only)
+    """
+    values = np.asarray(values)
+
+    if band is None:
+        return combine(values[:, None], values[None, :])
+
+    segment_size = len(values)
+    pair_values = np.full((segment_size, band), fill, dtype=values.dtype)
+    for offset in range(1, min(band, segment_size - 1) + 1):
+        pair_values[:-offset, offset - 1] = combine(values[:-offset], values[offset:])
+    return pair_values
+
 
-    def lowest_fairness(party, curr_fairness):
-        if (party is not None and party.is_expidited
-        and party.expidited_fairness < curr_fairness):
-            return party.expidited_fairness
-        else:
-            return curr_fairness
+def skill_build_match_mask(quality_matrix, thresholds, passes, band=None):
+    """
+    Applies the parties' fairness thresholds to a quality matrix
+        - A pair is a match if its quality meets the lower of both thresholds,
+          or is forced once either party was passed over ELO_EXPEDITED_MAX_PASSES times
+        - band must match the band used to build the quality matrix
+    """
+    pair_thresholds = skill_build_pair_values(np.asarray(thresholds, dtype=float), np.minimum, np.inf, band)
+    pair_passes = skill_build_pair_values(np.asarray(passes, dtype=int), np.maximum, 0, band)
 
-    return lowest_fairness(party_2, lowest_fairness(party_1, ELO_DEFAULT_FAIRNESS_THRESHOLD))
+    is_valid = ~np.isnan(quality_matrix)
+    is_forced = pair_passes >= ELO_EXPEDITED_MAX_PASSES
+    with np.errstate(invalid='ignore'):
+        is_fair = quality_matrix >= pair_thresholds
+
+    return is_valid & (is_fair | is_forced)
+
+
+def skill_rate_rosters(rosters, players, team_1_won):
+    """
+    Rates a 2 team match and applies the new ratings to the Player objects in memory
+        - rosters : 2 lists of player pks
+        - players : {player_pk: Player}
+
+    Returns ([[elo_delta per player] per team], delta in ELO per team)
+    """
+    return skill_rate_roster_batch([rosters], players, [team_1_won])[0]
+
+
+def skill_rate_roster_batch(match_rosters, players, team_1_wins):
+    """
+    Rates many 2 team matches with the SKILL_BACKEND, applying the new ratings to the Player objects in memory
+        - Matches sharing a player are rated in order: a match goes in the wave after the last
+          wave holding one of its players, and each wave is rated in one backend call per roster shape
+        - match_rosters : [2 lists of player pks] per match
+
+    Returns [([[elo_delta per player] per team], delta in ELO per team)] per match
+    """
+    rate_matches = skill_get_backend()['rate']
+    player_waves = {}  # player_pk -> wave of their last match
+    waves = defaultdict(list)  # (wave, roster shape) -> [match idx]
+
+    for match_idx, rosters in enumerate(match_rosters):
+        wave = 1 + max([player_waves.get(player_pk, -1) for roster in rosters for player_pk in roster] or [-1])
+        for roster in rosters:
+            for player_pk in roster:
+                player_waves[player_pk] = wave
+        waves[(wave, len(rosters[0]), len(rosters[1]))].append(match_idx)
+
+    results = [None] * len(match_rosters)
+
+    for wave_key in sorted(waves):
+        match_idxs = waves[wave_key]
+        teams = [[match_rosters[match_idx][t_idx] for match_idx in match_idxs] for t_idx in range(NUM_TEAMS)]
+        ratings = []  # mu_1, sigma_1, mu_2, sigma_2 arrays of the wave
+        for team in teams:
+            ratings.append(np.array([[players[pk].elo for pk in roster] for roster in team], dtype=float))
+            ratings.append(np.array([[players[pk].elo_weight for pk in roster] for roster in team], dtype=float))
+        new_ratings = rate_matches(*(ratings + [[team_1_wins[match_idx] for match_idx in match_idxs]]))
+
+        for row, match_idx in enumerate(match_idxs):
+            player_deltas = []
+            elo_deltas = []
+
+            for t_idx, roster in enumerate(match_rosters[match_idx]):
+                old_mu = ratings[2 * t_idx][row]
+                new_mu, new_sigma = new_ratings[2 * t_idx][row], new_ratings[2 * t_idx + 1][row]
+                elo_deltas.append(float(abs(new_mu[0] - old_mu[0])) if len(roster) else 0.0)
+                team_deltas = []
+
+                for p_idx, player_pk in enumerate(roster):
+                    player = players[player_pk]
+                    new_elo = int(new_mu[p_idx])
+                    team_deltas.append(new_elo - player.elo)
+                    player.elo = new_elo
+                    player.elo_weight = float(new_sigma[p_idx])
+                player_deltas.append(team_deltas)
+
+            results[match_idx] = (player_deltas, elo_deltas)
+
+    return results
+
+
+def skill_save_player_ratings(players, roster_slots=(), old_elos=None):
+    """
+    Writes rated players, and the roster slots holding their elo modifiers, in one transaction
+        - One bulk UPDATE per MM_BULK_BATCH_SIZE rows instead of one per player
+        - old_elos : {player_pk: elo before rating}, moves the players in the leaderboard
+    """
+    with transaction.atomic():
+        Player.objects.bulk_update(players, ['elo', 'elo_weight'], batch_size=MM_BULK_BATCH_SIZE)
+        if roster_slots:
+            MatchRosterSlot.objects.bulk_update(roster_slots, ['elo_modifier'], batch_size=MM_BULK_BATCH_SIZE)
+
+        # Keep every roster's rating aggregates in step with its players
+        roster_apply_player_ratings({player.pk: (player.elo, player.elo_weight) for player in players})
+
+    if old_elos is not None:
+        leaderboard_apply_rating_changes([(old_elos[player.pk], player.elo) for player in players])
 
 
 def skill_commit_match_result(party_1, party_2, match_1_result):
@@ -79,24 +240,64 @@ def skill_commit_match_result(party_1, party_2, match_1_result):
 
     Returns delta in ELO
     """
-    party_1_skill = skill_build_party_rating(party_1)
-    party_2_skill = skill_build_party_rating(party_2)
-    party_rosters = [party_1.players.all(), party_2.players.all()]
-    result_arr = [0, 1] if match_1_result else [1, 0]
-    result = rate([party_1_skill, party_2_skill], ranks=result_arr)
-    p_idx = 0
-    t_idx = 0
-    elo_deltas = [abs(result[0][0].mu - party_rosters[0][0].elo), abs(result[1][0].mu - party_rosters[1][0].elo)]
-
-    for roster in party_rosters:
-        for player in roster:
-            print("%s -> %s" % (int(player.elo), int(result[t_idx][p_idx].mu),))
-            player.elo = int(result[t_idx][p_idx].mu)
-            player.elo_weight = float(result[t_idx][p_idx].sigma)
-            player.save()
-            p_idx += 1
-
-        t_idx += 1  # Increase team index
-        p_idx = 0  # Reset player index
+    rosters = [[player_pk for player_pk, mu, sigma in party.get_rating_vector()] for party in (party_1, party_2)]
+    players = Player.objects.in_bulk(rosters[0] + rosters[1])
+    old_elos = {player_pk: player.elo for player_pk, player in players.items()}
+    player_deltas, elo_deltas = skill_rate_rosters(rosters, players, match_1_result)
+    skill_save_player_ratings(list(players.values()), old_elos=old_elos)
 
     return elo_deltas
+
+
+def skill_commit_match_results(matches):
+    """
+    Adjust elo of every team in a batch of finished matches
+    - Matches are rated in order, so a player in several matches carries the
+      rating from their earlier match into the next (see skill_rate_roster_batch)
+    - Saves Player elo / elo_weight and MatchRosterSlot elo_modifier with bulk updates
+    - Matches without NUM_TEAMS teams or a winner are skipped
+
+    Returns {match_pk: delta in ELO}
+    """
+    match_pks = [match.pk for match in matches]
+    team_slots = defaultdict(list)  # match_pk -> [team_pk]
+    roster_slots = defaultdict(list)  # (match_pk, team_pk) -> [MatchRosterSlot]
+
+    for match_pk, team_pk in MatchTeamSlot.objects.filter(match__in=match_pks).order_by('pk') \
+            .values_list('match_id', 'team_id'):
+        team_slots[match_pk].append(team_pk)
+    for slot in MatchRosterSlot.objects.filter(match__in=match_pks).order_by('pk'):
+        roster_slots[(slot.match_id, slot.team_id)].append(slot)
+
+    players = Player.objects.in_bulk({slot.player_id for slots in roster_slots.values() for slot in slots})
+    old_elos = {player_pk: player.elo for player_pk, player in players.items()}
+    rated_slots = []
+    match_deltas = {}
+
+    rated_matches = []  # (match_pk, [[MatchRosterSlot] per team], team_1_won)
+
+    for match in matches:
+        teams = team_slots[match.pk]
+        if len(teams) != NUM_TEAMS or match.winner_id not in teams:
+            continue
+        rated_matches.append((match.pk, [roster_slots[(match.pk, team_pk)] for team_pk in teams],
+                              match.winner_id == teams[0]))
+
+    # Every match is rated by the backend in as few vectorised calls as player overlaps allow
+    results = skill_rate_roster_batch([[[slot.player_id for slot in team_roster] for team_roster in slots]
+                                       for match_pk, slots, team_1_won in rated_matches],
+                                      players, [team_1_won for match_pk, slots, team_1_won in rated_matches])
+
+    for (match_pk, slots, team_1_won), (player_deltas, elo_deltas) in zip(rated_matches, results):
+        match_deltas[match_pk] = elo_deltas
+
+        for team_roster, team_deltas in zip(slots, player_deltas):
+            for slot, elo_delta in zip(team_roster, team_deltas):
+                slot.elo_modifier = elo_delta
+                rated_slots.append(slot)
+
+    if rated_slots:
+        rated_players = {slot.player_id: players[slot.player_id] for slot in rated_slots}
+        skill_save_player_ratings(list(rated_players.values()), rated_slots, old_elos)
+
+    return match_deltas
@@ -0,0 +1,127 @@
+"""
+Skill backends: 2 team TrueSkill quality and rate over arrays of matches
+
+Every backend takes, for M matches, the player ratings of each team as (M, N1) / (M, N2)
+arrays and returns arrays of the same shape:
+
+    * quality(mu_1, sigma_1, mu_2, sigma_2, env) -> (M,) match qualities
+    * rate(mu_1, sigma_1, mu_2, sigma_2, team_1_won, env) -> new (mu_1, sigma_1, mu_2, sigma_2)
+
+'trueskill' runs the trueskill package's factor graph once per match. 'numpy' uses the
+closed forms of the 2 team case, which the factor graph solves in a single pass, for all
+matches at once. It uses trueskill's own erfc approximation, so both agree to float precision
+
+Queue pairing is numpy-only: skill_calculate_quality_matrix scores a segment from roster
+aggregates through skill_numpy_sum_quality, the same closed form as the numpy backend's
+quality. SKILL_BACKEND picks the implementation of rating commits and single match qualities
+"""
+import math
+
+import numpy as np
+from trueskill import Rating, calc_draw_margin, global_env
+
+SQRT_2 = math.sqrt(2.0)
+SQRT_2_PI = math.sqrt(2.0 * math.pi)
+
+
+def skill_numpy_erfc(x):
+    """ Complementary error function, the approximation trueskill's default backend uses """
+    z = np.abs(x)
+    t = 1.0 / (1.0 + z / 2.0)
+    r = t * np.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (
+        -0.18628806 + t * (0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (
+            -0.82215223 + t * 0.17087277)))))))))
+    return np.where(x < 0, 2.0 - r, r)
+
+
+def skill_numpy_cdf(x):
+    return 0.5 * skill_numpy_erfc(-x / SQRT_2)
+
+
+def skill_numpy_pdf(x):
+    return np.exp(-(x ** 2) / 2.0) / SQRT_2_PI
+
+
+def skill_numpy_sum_quality(size_1, mu_sum_1, sigma_sq_sum_1, size_2, mu_sum_2, sigma_sq_sum_2, beta):
+    """ Closed form of trueskill.quality() for 2 teams, from each team's roster size, mu sum and sigma^2 sum """
+    perf_var = (size_1 + size_2) * beta ** 2
+    denom = perf_var + sigma_sq_sum_1 + sigma_sq_sum_2
+    return np.sqrt(perf_var / denom) * np.exp(-((mu_sum_1 - mu_sum_2) ** 2) / (2.0 * denom))
+
+
+def skill_numpy_quality(mu_1, sigma_1, mu_2, sigma_2, env=None):
+    """ Closed form of trueskill.quality() for 2 teams, for every match at once """
+    env = env or global_env()
+    mu_1, sigma_1, mu_2, sigma_2 = [np.asarray(values, dtype=float) for values in (mu_1, sigma_1, mu_2, sigma_2)]
+
+    return skill_numpy_sum_quality(mu_1.shape[1], mu_1.sum(axis=1), (sigma_1 ** 2).sum(axis=1),
+                                   mu_2.shape[1], mu_2.sum(axis=1), (sigma_2 ** 2).sum(axis=1), env.beta)
+
+
+def skill_numpy_rate(mu_1, sigma_1, mu_2, sigma_2, team_1_won, env=None):
+    """
+    Closed form of trueskill.rate() for 2 teams and a winner, for every match at once
+        - sigma^2 gains tau^2 of dynamics, then winners move up and losers down by
+          sigma^2 / c * v(t, e), where c^2 is the total performance variance, t the
+          winner's mu lead over c and e the draw margin over c
+    """
+    env = env or global_env()
+    mu_1, sigma_1, mu_2, sigma_2 = [np.asarray(values, dtype=float) for values in (mu_1, sigma_1, mu_2, sigma_2)]
+    team_1_won = np.asarray(team_1_won, dtype=bool)
+
+    num_players = mu_1.shape[1] + mu_2.shape[1]
+    sigma_sq_1 = sigma_1 ** 2 + env.tau ** 2
+    sigma_sq_2 = sigma_2 ** 2 + env.tau ** 2
+    c = np.sqrt(sigma_sq_1.sum(axis=1) + sigma_sq_2.sum(axis=1) + num_players * env.beta ** 2)
+
+    # 1 for team 1 winning, -1 for team 2
+    direction = np.where(team_1_won, 1.0, -1.0)
+    lead = direction * (mu_1.sum(axis=1) - mu_2.sum(axis=1)) / c
+    draw_margin = calc_draw_margin(env.draw_probability, num_players, env) / c
+
+    x = lead - draw_margin
+    cdf = skill_numpy_cdf(x)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        v = np.where(cdf > 0, skill_numpy_pdf(x) / cdf, -x)
+    w = np.clip(v * (v + x), 0.0, 1.0)  # trueskill raises past these bounds (extreme upsets)
+
+    def update(mu, sigma_sq, sign):
+        step = (sigma_sq / c[:, None]) * (sign * direction * v)[:, None]
+        return mu + step, np.sqrt(sigma_sq * (1.0 - sigma_sq / (c ** 2)[:, None] * w[:, None]))
+
+    new_mu_1, new_sigma_1 = update(mu_1, sigma_sq_1, 1.0)
+    new_mu_2, new_sigma_2 = update(mu_2, sigma_sq_2, -1.0)
+    return new_mu_1, new_sigma_1, new_mu_2, new_sigma_2
+
+
+def skill_trueskill_build_teams(mu_1, sigma_1, mu_2, sigma_2, match_idx):
+    return [tuple(Rating(mu, sigma) for mu, sigma in zip(mu_1[match_idx], sigma_1[match_idx])),
+            tuple(Rating(mu, sigma) for mu, sigma in zip(mu_2[match_idx], sigma_2[match_idx]))]
+
+
+def skill_trueskill_quality(mu_1, sigma_1, mu_2, sigma_2, env=None):
+    """ trueskill.quality(), once per match """
+    env = env or global_env()
+    return np.array([env.quality(skill_trueskill_build_teams(mu_1, sigma_1, mu_2, sigma_2, match_idx))
+                     for match_idx in range(len(mu_1))])
+
+
+def skill_trueskill_rate(mu_1, sigma_1, mu_2, sigma_2, team_1_won, env=None):
+    """ trueskill.rate(), once per match """
+    env = env or global_env()
+    results = [[], [], [], []]
+
+    for match_idx in range(len(mu_1)):
+        teams = skill_trueskill_build_teams(mu_1, sigma_1, mu_2, sigma_2, match_idx)
+        team_1, team_2 = env.rate(teams, ranks=[0, 1] if team_1_won[match_idx] else [1, 0])
+        for values, team, attr in zip(results, (team_1, team_1, team_2, team_2), ('mu', 'sigma', 'mu', 'sigma')):
+            values.append([getattr(rating, attr) for rating in team])
+
+    return tuple(np.array(values, dtype=float).reshape(len(mu_1), -1) for values in results)
+
+
+""" Skill backends that can be named in SKILL_BACKEND """
+SKILL_BACKENDS = {
+    'trueskill':                {'quality': skill_trueskill_quality, 'rate': skill_trueskill_rate},
+    'numpy':                    {'quality': skill_numpy_quality, 'rate': skill_numpy_rate},
+}
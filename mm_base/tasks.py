@@ -1,24 +1,49 @@
 from __future__ import absolute_import, unicode_literals
-from datetime import timedelta
-from celery import shared_task
+import random
+import uuid
+from celery import group, shared_task
 
-from django.utils import timezone
-from .app_settings import MM_MATCH_MAX_DURATION
+from .app_settings import Q_SEGMENT_SIZE
 
-from .matchmaking import mm_process_queue_segment
-from .models import Team, Match
+from .call_stack import call_stack, call_result_stack_batched
+from .leaderboard import leaderboard_rebuild
+from .matchmaking import mm_get_queued_segments, mm_claim_parties, mm_release_parties, mm_close_all_expired_matches
+
+
+@shared_task(name='dispatch_queue_segments')
+def task_dispatch_match_queue():
+    """ Partitions the queue by region and overlapping elo bands, processing every segment in parallel """
+    # Shift segment boundaries every tick so edge parties don't keep landing on an edge
+    segments = mm_get_queued_segments(offset=random.randrange(Q_SEGMENT_SIZE))
+
+    if segments:
+        group(task_process_match_queue_segment.s(segment_pk) for segment_pk in segments).apply_async()
+
+    return len(segments)
 
 
 @shared_task(name='process_queue_segment')
 def task_process_match_queue_segment(segment_pk):
     """ segment_pk : List of Party pks """
-    queue_segment = Team.objects.all().filter(pk__in=segment_pk)
-    mm_process_queue_segment(queue_segment)
+    # Only parties this worker claims are processed, so overlapping segments never double-match
+    claim_token = uuid.uuid4().hex
+    queue_segment = mm_claim_parties(segment_pk, claim_token)
+
+    try:
+        call_stack(queue_segment)
+    finally:
+        mm_release_parties(claim_token)
 
 
 @shared_task(name='process_expired_matches')
 def task_process_expired_matches():
-    """ Automatically kill expired matches """
-    time_threshold = timezone.now() - timedelta(hours=(MM_MATCH_MAX_DURATION/60))
-    expired = Match.objects.all().filter(end_time=None, start_time__lt=time_threshold)
-    expired.update(end_time=timezone.now())
+    """ Automatically kill expired matches, then process their results in batches """
+    closed_ids = mm_close_all_expired_matches()
+    call_result_stack_batched(closed_ids)
+    return len(closed_ids)
+
+
+@shared_task(name='rebuild_leaderboard')
+def task_rebuild_leaderboard():
+    """ Reconciles the worker's rating histogram with the Player table, returns the drifted players """
+    return leaderboard_rebuild()
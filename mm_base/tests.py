@@ -1,3 +1,809 @@
-from django.test import TestCase
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import threading
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models.query import QuerySet
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from trueskill import Rating, TrueSkill
+
+from .app_settings import ELO_AVG_RATING, ELO_RANK_INCREMENT, ELO_INCREMENT_RANGE, TEAM_SIZE, \
+    ELO_DEFAULT_FAIRNESS_THRESHOLD, ELO_EXPEDITED_MAX_PASSES, MM_LANE_FAIRNESS_FLOOR, MM_LANE_MIN_SAMPLES, \
+    MM_MATCH_MAX_DURATION, Q_CLAIM_TIMEOUT
+from .archive import archive_build_columns, archive_write_file, archive_write_chunk, archive_load_file, \
+    archive_read, archive_get_rating_deltas, archive_from_timestamp, archive_matches
+from .matchmaking import mm_close_all_expired_matches, mm_claim_parties, mm_create_new_match
+from .models.core_middleware import mm_core_clean_queue
+from .models.core_models import Player, Team, Party, Match, MatchTeamSlot, MatchRosterSlot
+from .models.mm_tutor.middleware import mentor_assign_students
+from .models.mm_plus_points.middleware import plus_award_points, plus_replay_ledger
+from .models.mm_plus_points.models import PlusPlayer, PlusAwardedMatch, PlusLedgerEntry
+from .models.mm_plus_points.plugin_settings import PLUS_POINTS_PLAYED, PLUS_POINTS_WIN
+from .call_stack import stack_atomic_call_middleware
+from .chat import ChatRelay
+from .lanes import LaneScheduler, lane_classify
+from .leaderboard import RatingHistogram
+from .notify import NotifyBatch
+from .pairing import pairing_max_weight
+from .queue_backends import RedisQueueIndex, FakeRedis
+from .queue_index import QueueIndex, queue_index_update_party
+from .skill import skill_calculate_quality_matrix, skill_commit_match_results
+from .skill_backends import SKILL_BACKENDS
+from .tracing import TraceJsonLinesSink, trace_read_json_lines
+
+
+class RedisQueueIndexTests(SimpleTestCase):
+    """ The Redis queue backend, on the in-process FakeRedis """
+
+    def setUp(self):
+        self.index = RedisQueueIndex(FakeRedis(), claim_timeout=60)
+
+    def test_matches_sql_index(self):
+        rng = random.Random(0)
+        reference = QueueIndex()
+
+        for step in range(2000):
+            pk = rng.randrange(200)
+            if rng.random() < 0.7:
+                region, elo = rng.choice(['USW', 'EUW', None]), rng.uniform(0, 5000)
+                self.index.add(pk, region, elo)
+                reference.add(pk, region, elo)
+            else:
+                self.index.discard(pk)
+                reference.discard(pk)
+
+            if step % 100 == 0:
+                low = rng.uniform(0, 5000)
+                for region in ['USW', 'EUW', None]:
+                    self.assertEqual(self.index.get_range(region, low, low + 750),
+                                     reference.get_range(region, low, low + 750))
+
+        self.assertEqual(sorted(self.index.get_regions(), key=str), sorted(reference.get_regions(), key=str))
+        self.assertEqual(self.index.get_pks(), reference.get_pks())
+        self.assertEqual(len(self.index), len(reference))
+        for pk in reference.get_pks():
+            self.assertEqual(self.index.get_location(pk), reference.get_location(pk))
+
+    def test_claim_is_exclusive(self):
+        for pk in range(10):
+            self.index.add(pk, 'USW', 2000 + pk)
+
+        self.assertEqual(sorted(self.index.claim(range(6), 'worker-1')), list(range(6)))
+        self.assertEqual(sorted(self.index.claim(range(3, 10), 'worker-2')), list(range(6, 10)))
+        self.assertEqual(self.index.get_range('USW'), [])
+        self.assertIn(0, self.index)  # Claimed parties are still queued
+
+    def test_release_requeues_unmatched(self):
+        for pk in range(4):
+            self.index.add(pk, 'EUW', 2500)
+        self.index.claim(range(4), 'worker')
+
+        # Parties 0 and 1 were matched
+        self.index.discard(0)
+        self.index.discard(1)
+
+        self.assertEqual(self.index.release('worker'), 2)
+        self.assertEqual(self.index.get_range('EUW'), [2, 3])
+        self.assertEqual(self.index.claim([2, 3], 'next-worker'), [2, 3])
+
+    def test_move_keeps_claims(self):
+        for pk in range(3):
+            self.index.add(pk, 'USW', 2000)
+        self.index.claim([0, 1], 'worker')
+
+        # Saves of claimed parties move their elo without queueing them again
+        self.index.move(0, 'USW', 2100)
+        self.index.move(1, 'EUW', 2200)
+        self.index.add(0, 'USW', 2150)
+        self.index.move(2, 'EUW', 2300)
+        self.assertEqual(self.index.get_range('USW'), [])
+        self.assertEqual(self.index.get_range('EUW'), [2])
+        self.assertEqual(self.index.claim([0, 1], 'other-worker'), [])
+
+        self.assertEqual(self.index.release('worker'), 2)
+        self.assertEqual(self.index.get_range('USW'), [0])
+        self.assertEqual(self.index.get_range('EUW', 2200, 2200), [1])
+        self.assertEqual(self.index.get_location(0), ('USW', 2150))
+
+    def test_saves_of_unindexed_or_empty_parties(self):
+        def save(pk, roster_size):
+            party = mock.Mock(pk=pk, region='USW', roster_size=roster_size, mu_sum=2000.0 * roster_size,
+                              current_match_id=None)
+            party.get_avg_elo = lambda: party.mu_sum / party.roster_size  # As RosterRating.get_avg_elo
+            queue_index_update_party(party, self.index)
+
+        save(1, 0)  # A new party, no elo yet
+        save(2, 1)
+        self.assertEqual(len(self.index), 0)
+
+        self.index.add(3, 'USW', 1500)
+        save(3, 0)  # Emptied, keeps its last elo
+        self.assertEqual(self.index.get_location(3), ('USW', 1500))
+        save(3, 2)
+        self.assertEqual(self.index.get_location(3), ('USW', 2000))
+
+    def test_stale_claims_are_released(self):
+        self.index.claim_timeout = -1
+        self.index.add(1, 'USE', 2500)
+        self.index.claim([1], 'crashed-worker')
+
+        self.assertEqual(self.index.claim([1], 'worker'), [1])
+
+    def test_clear(self):
+        self.index.add(1, 'USE', 2500)
+        self.index.add(2, 'USW', 2500)
+        self.index.claim([2], 'worker')
+        self.index.clear()
+
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.index.get_regions(), [])
+        self.assertEqual(self.index.client._data, {})
+
+
+class QualityMatrixTests(SimpleTestCase):
+    """ skill_calculate_quality_matrix against trueskill's quality(), on random uneven rosters """
+
+    def test_matches_trueskill(self):
+        env = TrueSkill(mu=ELO_AVG_RATING, sigma=ELO_RANK_INCREMENT, beta=ELO_INCREMENT_RANGE)
+        rng = np.random.RandomState(0)
+        rosters = [[Rating(rng.normal(ELO_AVG_RATING, ELO_RANK_INCREMENT), rng.uniform(25, ELO_RANK_INCREMENT))
+                    for _ in range(rng.randint(1, 6))] for _ in range(30)]
+        roster_sizes = [len(roster) for roster in rosters]
+        mu_sums = [sum(rating.mu for rating in roster) for roster in rosters]
+        sigma_sq_sums = [sum(rating.sigma ** 2 for rating in roster) for roster in rosters]
+
+        expected = np.full((len(rosters), len(rosters)), np.nan)
+        for idx, roster in enumerate(rosters):
+            for other_idx, other_roster in enumerate(rosters):
+                if idx != other_idx:
+                    expected[idx, other_idx] = env.quality([tuple(roster), tuple(other_roster)])
+
+        matrix = skill_calculate_quality_matrix(roster_sizes, mu_sums, sigma_sq_sums, beta=env.beta)
+        np.testing.assert_allclose(matrix, expected, rtol=1e-9, atol=1e-12)
+
+        band = skill_calculate_quality_matrix(roster_sizes, mu_sums, sigma_sq_sums, band=4, beta=env.beta)
+        for offset in range(1, 5):
+            np.testing.assert_allclose(band[:-offset, offset - 1], np.diagonal(expected, offset), rtol=1e-9,
+                                       atol=1e-12)
+            self.assertTrue(np.isnan(band[-offset:, offset - 1]).all())
+
+
+class SkillBackendParityTests(SimpleTestCase):
+    """ The numpy skill backend against the trueskill package, over randomized ratings """
+    ROSTER_SHAPES = ((TEAM_SIZE, TEAM_SIZE), (1, 1), (2, TEAM_SIZE), (TEAM_SIZE, 3))
+    NUM_MATCHES = 200
+
+    def setUp(self):
+        self.env = TrueSkill(mu=ELO_AVG_RATING, sigma=ELO_RANK_INCREMENT, beta=ELO_INCREMENT_RANGE, tau=5,
+                             draw_probability=0.10)
+        self.rng = np.random.RandomState(0)
+
+    def build_ratings(self, size_1, size_2, spread=ELO_RANK_INCREMENT):
+        return [self.rng.normal(ELO_AVG_RATING, spread, (self.NUM_MATCHES, size_1)),
+                self.rng.uniform(25, ELO_RANK_INCREMENT, (self.NUM_MATCHES, size_1)),
+                self.rng.normal(ELO_AVG_RATING, spread, (self.NUM_MATCHES, size_2)),
+                self.rng.uniform(25, ELO_RANK_INCREMENT, (self.NUM_MATCHES, size_2))]
+
+    def test_quality(self):
+        for size_1, size_2 in self.ROSTER_SHAPES:
+            ratings = self.build_ratings(size_1, size_2)
+            np.testing.assert_allclose(SKILL_BACKENDS['numpy']['quality'](*ratings, env=self.env),
+                                       SKILL_BACKENDS['trueskill']['quality'](*ratings, env=self.env),
+                                       rtol=1e-9, atol=1e-12)
+
+    def test_rate(self):
+        for size_1, size_2 in self.ROSTER_SHAPES:
+            ratings = self.build_ratings(size_1, size_2)
+            team_1_won = self.rng.rand(self.NUM_MATCHES) < 0.5
+
+            for fast, reference in zip(SKILL_BACKENDS['numpy']['rate'](*ratings + [team_1_won], env=self.env),
+                                       SKILL_BACKENDS['trueskill']['rate'](*ratings + [team_1_won], env=self.env)):
+                np.testing.assert_allclose(fast, reference, rtol=1e-9)
+
+    def test_rate_upsets(self):
+        """ Wide rating gaps, where the weaker team winning stresses v / w """
+        ratings = self.build_ratings(TEAM_SIZE, TEAM_SIZE, spread=3 * ELO_RANK_INCREMENT)
+        team_1_won = ratings[0].sum(axis=1) < ratings[2].sum(axis=1)
+
+        for fast, reference in zip(SKILL_BACKENDS['numpy']['rate'](*ratings + [team_1_won], env=self.env),
+                                   SKILL_BACKENDS['trueskill']['rate'](*ratings + [team_1_won], env=self.env)):
+            np.testing.assert_allclose(fast, reference, rtol=1e-6)
+
+
+class LaneSchedulerTests(SimpleTestCase):
+    """ Lane thresholds, forcing, priorities and gain steering """
+    LANES = (('plus', 3, 60), ('expedited', 2, 120), ('normal', 1, 180))
+
+    def setUp(self):
+        self.scheduler = LaneScheduler(self.LANES)
+
+    def test_classify(self):
+        lanes = lane_classify([True, True, False, False], [0, 2, 1, 0], self.scheduler)
+        self.assertEqual([self.scheduler.names[lane] for lane in lanes], ['plus', 'plus', 'expedited', 'normal'])
+
+    def test_widens_with_wait(self):
+        thresholds, passes, priorities = self.scheduler.build([0, 0, 0, 2], [0, 30, 60, 60])
+
+        np.testing.assert_allclose(thresholds[:3], [ELO_DEFAULT_FAIRNESS_THRESHOLD,
+                                                    (ELO_DEFAULT_FAIRNESS_THRESHOLD + MM_LANE_FAIRNESS_FLOOR) / 2,
+                                                    MM_LANE_FAIRNESS_FLOOR])
+        self.assertEqual(list(passes), [0, 0, ELO_EXPEDITED_MAX_PASSES, 0])  # Forced once fully widened
+        np.testing.assert_allclose(priorities, [3, 4.5, 6, 1 + 60 / 180.0])
+
+    def test_gain_follows_p99(self):
+        plus = self.scheduler.get_lane('plus')
+        normal = self.scheduler.get_lane('normal')
+
+        # Plus waits past target raise its gain, normal waits well under target ease it off
+        self.scheduler.observe([plus] * MM_LANE_MIN_SAMPLES, [90] * MM_LANE_MIN_SAMPLES, [True] * MM_LANE_MIN_SAMPLES)
+        self.scheduler.observe([normal] * MM_LANE_MIN_SAMPLES, [5] * MM_LANE_MIN_SAMPLES, [True] * MM_LANE_MIN_SAMPLES)
+        self.assertGreater(self.scheduler.gains[plus], 1.0)
+        self.assertLess(self.scheduler.gains[normal], 1.0)
+
+        # A waiting tail counts before it's matched
+        scheduler = LaneScheduler(self.LANES)
+        scheduler.observe([plus] * MM_LANE_MIN_SAMPLES, [10] * (MM_LANE_MIN_SAMPLES - 1) + [600],
+                          [True] * (MM_LANE_MIN_SAMPLES - 1) + [False])
+        self.assertGreater(scheduler.gains[plus], 1.0)
+
+
+class ArchiveFileTests(SimpleTestCase):
+    """ Columnar archive files, read without the hot tables """
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.now = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def tearDown(self):
+        shutil.rmtree(self.archive_dir)
+
+    def write_matches(self, match_pks, elo_modifier=10.0, players=(1, 2), manifest=True):
+        """ Archives 1v1 matches of two players, the first winning, closed a minute apart """
+        tables = {
+            'matches': archive_build_columns('matches', [
+                (pk, None, self.now + datetime.timedelta(minutes=pk), 101, False, '10') for pk in match_pks]),
+            'teams': archive_build_columns('teams', [
+                row for pk in match_pks for row in ((pk, 101, True, False), (pk, 102, False, False))]),
+            'rosters': archive_build_columns('rosters', [
+                row for pk in match_pks for row in ((pk, players[0], 101, elo_modifier),
+                                                    (pk, players[1], 102, -elo_modifier))]),
+        }
+        path = os.path.join(self.archive_dir, 'matches-%s-%s.npz' % (match_pks[0], match_pks[-1]))
+        (archive_write_chunk if manifest else archive_write_file)(path, tables)
+
+    def test_round_trip(self):
+        self.write_matches([1, 2])
+        tables = archive_load_file(os.path.join(self.archive_dir, 'matches-1-2.npz'))
+
+        self.assertEqual(tables['matches']['match_id'].tolist(), [1, 2])
+        self.assertEqual(archive_from_timestamp(tables['matches']['end_time'][1]),
+                         self.now + datetime.timedelta(minutes=2))
+        self.assertIsNone(archive_from_timestamp(tables['matches']['start_time'][0]))
+        self.assertEqual(tables['rosters']['elo_modifier'].tolist(), [10.0, -10.0, 10.0, -10.0])
+
+    def test_read_once_and_in_range(self):
+        self.write_matches([1, 2, 3])
+        self.write_matches([3, 4], elo_modifier=20.0)  # Rewritten chunk, the newest file wins
+
+        tables = archive_read(start=self.now + datetime.timedelta(minutes=2), include_hot=False,
+                              archive_dir=self.archive_dir)
+        self.assertEqual(sorted(tables['matches']['match_id'].tolist()), [2, 3, 4])
+        self.assertEqual(len(tables['teams']['match_id']), 6)
+
+        deltas = archive_get_rating_deltas([1], include_hot=False, archive_dir=self.archive_dir)
+        self.assertEqual(deltas['match_id'].tolist(), [1, 2, 3, 4])
+        self.assertEqual(deltas['elo_modifier'].tolist(), [10.0, 10.0, 20.0, 20.0])
+        self.assertTrue(deltas['won'].all())
+
+    def test_manifest_skips_files(self):
+        self.write_matches([1, 2])
+        self.write_matches([3, 4], players=(3, 4))
+        self.write_matches([5, 6], manifest=False)  # Older archive, read whole
+
+        with mock.patch('mm_base.archive.archive_load_file', wraps=archive_load_file) as load_file:
+            deltas = archive_get_rating_deltas([3], include_hot=False, archive_dir=self.archive_dir)
+            self.assertEqual(deltas['match_id'].tolist(), [3, 4])
+            self.assertEqual(sorted(os.path.basename(call[0][0]) for call in load_file.call_args_list),
+                             ['matches-3-4.npz', 'matches-5-6.npz'])
+
+            load_file.reset_mock()
+            tables = archive_read(end=self.now + datetime.timedelta(minutes=3), include_hot=False,
+                                  archive_dir=self.archive_dir)
+            self.assertEqual(sorted(tables['matches']['match_id'].tolist()), [1, 2])
+            self.assertEqual(sorted(os.path.basename(call[0][0]) for call in load_file.call_args_list),
+                             ['matches-1-2.npz', 'matches-5-6.npz'])
+
+
+class ChatRelayTests(SimpleTestCase):
+    """ The chat relay, sending to a list """
+
+    def setUp(self):
+        self.sent = []
+        self.relay = ChatRelay(send=lambda group_name, messages: self.sent.append((group_name, messages)))
+
+    def test_drops_bad_frames(self):
+        for text in (None, 42, ['text'], {'text': 'hi'}, ''):
+            self.assertTrue(self.relay.post('team', 'player', text))
+        self.assertTrue(self.relay.post('team', 'player', 'hi'))
+
+        self.assertEqual(self.relay.flush(), 1)
+        self.assertEqual([message['text'] for message in self.sent[0][1]], ['hi'])
+
+    def test_closed_channels_are_dropped(self):
+        self.relay.join('team')
+        self.relay.join('team')
+        self.relay.join('match')
+        self.relay.post('team', 'player', 'hi')
+        self.relay.post('match', 'player', 'gg')
+        self.relay.report()
+
+        self.relay.leave('team')
+        self.assertEqual(sorted(self.relay.get_stats()), ['match', 'team'])
+        self.relay.leave('team')
+        self.relay.flush()  # Messages posted before the last socket left are still sent
+        self.assertEqual(sorted(self.relay.get_stats()), ['match'])
+        self.assertEqual(len(self.sent), 2)
+
+        self.relay.join('match')
+        self.relay.leave('match', is_closed=True)  # Match over
+        self.assertEqual(self.relay.get_stats(), {})
+        self.assertEqual(self.relay._report_stats, {})
+
+
+class RatingHistogramTests(SimpleTestCase):
+    """ RatingHistogram against sorting the players' buckets, through random updates """
+
+    def test_matches_brute_force(self):
+        rng = random.Random(0)
+        histogram = RatingHistogram(min_elo=0, max_elo=1000, sub_bucket=30, rank_increment=200)
+        elos = []
+
+        def bucket_elo(elo):
+            return min(max(elo, 0) // 30, 33) * 30  # 34 buckets, out of range elo lands in an end bucket
+
+        for step in range(1500):
+            action = rng.random()
+            if action < 0.5 or not elos:
+                elo = rng.randrange(-100, 1100)
+                elos.append(elo)
+                histogram.add(elo)
+            elif action < 0.7:
+                histogram.remove(elos.pop(rng.randrange(len(elos))))
+            elif action < 0.98:
+                idx = rng.randrange(len(elos))
+                new_elo = elos[idx] + rng.randrange(-60, 61)
+                histogram.move(elos[idx], new_elo)
+                elos[idx] = new_elo
+            else:
+                histogram.rebuild([(elo, 1) for elo in elos])
+
+            buckets = sorted(bucket_elo(elo) for elo in elos)
+            elo = rng.randrange(-100, 1100)
+            rank = rng.randrange(1, len(buckets) + 3)
+            self.assertEqual(histogram.total, len(buckets))
+            self.assertEqual(histogram.get_min_elo(), buckets[0] if buckets else None)
+            self.assertEqual(histogram.get_max_elo(), buckets[-1] if buckets else None)
+            self.assertEqual(histogram.get_rank(elo), 1 + sum(bucket > bucket_elo(elo) for bucket in buckets))
+            self.assertEqual(histogram.get_rank_cutoff(rank), buckets[max(len(buckets) - rank, 0)] if buckets else None)
+            if buckets:
+                self.assertAlmostEqual(histogram.get_percentile(elo), 100.0 * (
+                    sum(bucket < bucket_elo(elo) for bucket in buckets) +
+                    0.5 * buckets.count(bucket_elo(elo))) / len(buckets))
+
+            rank_counts = {}
+            for bucket in buckets:
+                rank_counts[bucket // 200 * 200] = rank_counts.get(bucket // 200 * 200, 0) + 1
+            self.assertEqual(histogram.get_rank_counts(), rank_counts)
+
+
+class PairingMaxWeightTests(SimpleTestCase):
+    """ pairing_max_weight against every matching of small random segments """
+
+    def best_weight(self, weights, idx=0, taken=frozenset()):
+        """ Brute force: the best matching of parties idx.. not taken, over {(idx, partner): weight} """
+        if idx >= len(weights):
+            return 0.0
+        if idx in taken:
+            return self.best_weight(weights, idx + 1, taken)
+
+        best = self.best_weight(weights, idx + 1, taken)  # Pass over idx
+        for partner, weight in weights[idx].items():
+            if partner not in taken:
+                best = max(best, weight + self.best_weight(weights, idx + 1, taken | {partner}))
+        return best
+
+    def test_optimal(self):
+        rng = np.random.RandomState(0)
+
+        for trial in range(200):
+            segment_size, band = rng.randint(1, 10), rng.randint(1, 4)
+            quality_band = rng.uniform(0, 1, (segment_size, band))
+            match_mask = rng.uniform(0, 1, (segment_size, band)) < 0.6
+            pair_priorities = rng.choice([1.0, 2.0, 3.0], (segment_size, band))
+            for offset in range(1, band + 1):
+                match_mask[max(segment_size - offset, 0):, offset - 1] = False  # Past the end of the segment
+
+            weights = [{idx + offset: (1.0 + quality_band[idx, offset - 1]) * pair_priorities[idx, offset - 1]
+                        for offset in range(1, band + 1) if match_mask[idx, offset - 1]}
+                       for idx in range(segment_size)]
+            pairs = pairing_max_weight(quality_band, match_mask, pair_priorities, match_bonus=1.0)
+
+            taken = [idx for pair in pairs for idx in pair]
+            self.assertEqual(len(taken), len(set(taken)))
+            self.assertTrue(all(next_idx in weights[idx] for idx, next_idx in pairs))
+            self.assertAlmostEqual(sum(weights[idx][next_idx] for idx, next_idx in pairs), self.best_weight(weights))
+
+
+class MentorAssignTests(SimpleTestCase):
+    """ mentor_assign_students against Kuhn's augmenting paths on random instances """
+
+    def kuhn_matching_size(self, mentor_elos, student_elos, range_extension):
+        mentor_of = {}  # mentor idx -> student idx
+
+        def augment(student_idx, visited):
+            for mentor_idx, mentor_elo in enumerate(mentor_elos):
+                if abs(mentor_elo - student_elos[student_idx]) <= range_extension and mentor_idx not in visited:
+                    visited.add(mentor_idx)
+                    if mentor_idx not in mentor_of or augment(mentor_of[mentor_idx], visited):
+                        mentor_of[mentor_idx] = student_idx
+                        return True
+            return False
+
+        return sum(augment(student_idx, set()) for student_idx in range(len(student_elos)))
+
+    def test_maximum_matching(self):
+        rng = random.Random(0)
+
+        for trial in range(300):
+            range_extension = rng.choice([0, 50, 250])
+            # Coarse elos, so ties and shared interval ends are common
+            mentor_elos = [rng.randrange(20) * 50 for _ in range(rng.randrange(9))]
+            student_elos = [rng.randrange(20) * 50 for _ in range(rng.randrange(9))]
+            pairs = mentor_assign_students(mentor_elos, student_elos, range_extension)
+
+            self.assertEqual(len(set(mentor for mentor, student in pairs)), len(pairs))
+            self.assertEqual(len(set(student for mentor, student in pairs)), len(pairs))
+            for mentor_idx, student_idx in pairs:
+                self.assertLessEqual(abs(mentor_elos[mentor_idx] - student_elos[student_idx]), range_extension)
+            self.assertEqual(len(pairs), self.kuhn_matching_size(mentor_elos, student_elos, range_extension))
+
+
+class NotifyBatchTests(SimpleTestCase):
+    """ Notify batches are per thread """
+
+    def test_threads_do_not_share_batches(self):
+        batch = NotifyBatch()
+        batch.open()
+        batch.open()
+        self.assertTrue(batch.add(['first']))
+
+        other_thread_added = []
+        thread = threading.Thread(target=lambda: other_thread_added.append(batch.add(['other'])))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(other_thread_added, [False])
+        self.assertEqual(batch.close(), [])
+        self.assertEqual(batch.close(), ['first'])
+        self.assertFalse(batch.add(['late']))
+
+
+class TraceJsonLinesTests(SimpleTestCase):
+    """ The JSON-lines trace file and its rotation """
+
+    def setUp(self):
+        self.trace_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.trace_dir, 'trace.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.trace_dir)
+
+    def test_rotates_and_reads_back(self):
+        sink = TraceJsonLinesSink(self.path, max_bytes=200, backups=2)
+        for tick in range(20):
+            sink.emit({'tick': tick, 'time': tick, 'stage': 'stage'})
+
+        self.assertEqual(sorted(os.listdir(self.trace_dir)), ['trace.jsonl', 'trace.jsonl.1', 'trace.jsonl.2'])
+        self.assertTrue(all(os.path.getsize(os.path.join(self.trace_dir, name)) < 250
+                            for name in os.listdir(self.trace_dir)))
+
+        ticks = trace_read_json_lines(self.path, backups=2)
+        tick_ids = [records[0]['tick'] for records in ticks]
+        self.assertEqual(tick_ids, list(range(tick_ids[0], 20)))
+        self.assertEqual([records[0]['tick'] for records in trace_read_json_lines(self.path, 3, 2)], [17, 18, 19])
+
+
+def create_party(name, elo=2500, **kwargs):
+    """ Creates a one player Team and its Party """
+    player = Player.objects.create(user=User.objects.create(username=name), elo=elo)
+    team = Team.objects.create(name=name, captain=player)
+    team.players.add(player)
+    party = Party(team=team, players=player, **dict({'region': 'USW'}, **kwargs))
+    party.set_rating_vector([(player.pk, elo, player.elo_weight)])
+    party.save()
+    return party
+
+
+class CleanQueueTests(TestCase):
+    """ mm_core_clean_queue against the DB """
+
+    def test_expedites_waiting_parties_only(self):
+        queued_at = timezone.now() - datetime.timedelta(minutes=5)
+        waiting = create_party('waiting', is_queued=True, expedite_passes=1)  # Queued before queued_at existed
+        started = create_party('started', is_queued=True, queued_at=queued_at)
+        dequeued = create_party('dequeued')  # Dequeued while its claim was held
+        matched = create_party('matched', is_queued=True, current_match=Match.objects.create())
+        queue_updated = dict(Party.objects.values_list('pk', 'queue_updated'))
+
+        self.assertEqual(mm_core_clean_queue({}, Party.objects.all(), mock.Mock()), 2)
+
+        parties = {party.pk: party for party in Party.objects.all()}
+        self.assertEqual(parties[waiting.pk].expedite_passes, 2)
+        self.assertTrue(parties[waiting.pk].is_expedited)
+        self.assertIsNotNone(parties[waiting.pk].queued_at)
+        self.assertEqual(parties[started.pk].expedite_passes, 1)
+        self.assertEqual(parties[started.pk].queued_at, queued_at)
+        for party_pk in (dequeued.pk, matched.pk):
+            self.assertEqual(parties[party_pk].expedite_passes, 0)
+            self.assertFalse(parties[party_pk].is_expedited)
+        self.assertFalse(parties[dequeued.pk].is_queued)
+        self.assertIsNone(parties[dequeued.pk].queued_at)
+        self.assertEqual(dict(Party.objects.values_list('pk', 'queue_updated')), queue_updated)
+
+
+class SkillCommitBatchTests(TestCase):
+    """ skill_commit_match_results against the DB """
+
+    def setUp(self):
+        self.players = [Player.objects.create(user=User.objects.create(username='player%s' % idx),
+                                              elo=2400 + 50 * idx, elo_weight=30 + 5 * idx) for idx in range(6)]
+        self.teams = []
+        for idx, roster in enumerate([(0, 1), (2, 3), (0, 4), (5, 2)]):
+            team = Team.objects.create(name='team%s' % idx, captain=self.players[roster[0]])
+            team.players.add(*[self.players[p_idx] for p_idx in roster])
+            self.teams.append(team)
+
+        # Players 0 and 2 play in every match
+        self.matches = [self.create_match(0, 1, 0), self.create_match(2, 3, 3), self.create_match(0, 3, 0)]
+
+    def create_match(self, t_idx_1, t_idx_2, winner_idx):
+        match = Match.objects.create(winner=self.teams[winner_idx], end_time=timezone.now())
+        for t_idx in (t_idx_1, t_idx_2):
+            team = self.teams[t_idx]
+            MatchTeamSlot.objects.create(match=match, team=team, result=t_idx == winner_idx)
+            for player in team.players.order_by('pk'):
+                MatchRosterSlot.objects.create(match=match, team=team, player=player)
+        return match
+
+    def get_ratings(self):
+        return (dict((pk, (elo, weight)) for pk, elo, weight in Player.objects.values_list('pk', 'elo', 'elo_weight')),
+                dict(MatchRosterSlot.objects.values_list('pk', 'elo_modifier')))
+
+    def test_batch_matches_sequential_commits(self):
+        skill_commit_match_results(self.matches)
+        batch_players, batch_slots = self.get_ratings()
+
+        Player.objects.bulk_update(self.players, ['elo', 'elo_weight'])
+        MatchRosterSlot.objects.update(elo_modifier=0)
+        for match in self.matches:
+            skill_commit_match_results([match])
+        players, slots = self.get_ratings()
+
+        self.assertEqual(batch_slots, slots)
+        self.assertEqual(set(batch_players), set(players))
+        for player_pk, (elo, elo_weight) in players.items():
+            self.assertEqual(batch_players[player_pk][0], elo)
+            self.assertAlmostEqual(batch_players[player_pk][1], elo_weight, places=9)
+        self.assertNotEqual(players[self.players[0].pk][0], self.players[0].elo)
+
+
+class PartyClaimTests(TestCase):
+    """ mm_claim_parties and mm_create_new_match against the DB """
+
+    def setUp(self):
+        self.parties = [create_party('party%s' % idx, is_queued=True) for idx in range(3)]
+        self.party_pks = [party.pk for party in self.parties]
+
+    def get_tokens(self):
+        return dict(Party.objects.filter(pk__in=self.party_pks).values_list('pk', 'claim_token'))
+
+    def test_skips_parties_held_by_another_worker(self):
+        self.assertEqual(set(mm_claim_parties(self.party_pks[:2], 'worker1').values_list('pk', flat=True)),
+                         set(self.party_pks[:2]))
+
+        claimed = mm_claim_parties(self.party_pks, 'worker2')
+
+        self.assertEqual(list(claimed.values_list('pk', flat=True)), [self.party_pks[2]])
+        self.assertEqual(self.get_tokens(), {self.party_pks[0]: 'worker1', self.party_pks[1]: 'worker1',
+                                             self.party_pks[2]: 'worker2'})
+
+    def test_takes_over_stale_claims(self):
+        mm_claim_parties(self.party_pks[:2], 'worker1')
+        stale_at = timezone.now() - datetime.timedelta(seconds=Q_CLAIM_TIMEOUT + 1)
+        Party.objects.filter(pk=self.party_pks[0]).update(claimed_at=stale_at)
+
+        claimed = mm_claim_parties(self.party_pks[:2], 'worker2')
+
+        self.assertEqual(list(claimed.values_list('pk', flat=True)), [self.party_pks[0]])
+        self.assertEqual(self.get_tokens()[self.party_pks[1]], 'worker1')
+
+    def test_lost_claim_creates_no_match(self):
+        parties = list(mm_claim_parties(self.party_pks[:2], 'worker1').order_by('pk'))
+
+        # The claim went stale and another worker took it over
+        Party.objects.filter(pk=self.party_pks[1]).update(claim_token='worker2')
+
+        self.assertIsNone(mm_create_new_match(parties))
+        self.assertFalse(Match.objects.exists())
+        self.assertFalse(Party.objects.exclude(current_match=None).exists())
+
+
+class StackMiddlewareTests(TestCase):
+    """ stack_atomic_call_middleware against the DB """
+
+    def setUp(self):
+        self.logger = mock.Mock()
+        self.parties = [create_party('party%s' % idx, is_queued=True, region=region)
+                        for idx, region in enumerate(['USW', 'USW', 'EUW'])]
+        self.q_dict = {'expedited': Party.objects.filter(pk=self.parties[0].pk)}
+
+    def test_raising_middleware_rolls_back(self):
+        def middleware(q_dict, q_queryset, logger):
+            q_queryset.update(is_expedited=True)
+            q_dict['expedited'] = q_queryset
+            q_dict['new'] = q_queryset.none()
+            raise ValueError()
+
+        q_dict, q_queryset = stack_atomic_call_middleware(self.q_dict, Party.objects.all(), self.logger,
+                                                          'failing', middleware)
+
+        self.assertTrue(self.logger.exception.called)
+        self.assertFalse(Party.objects.filter(is_expedited=True).exists())
+        self.assertEqual(list(self.q_dict), ['expedited'])
+        self.assertEqual(list(q_dict), ['expedited'])
+        self.assertEqual(list(q_dict['expedited']), [self.parties[0]])
+        self.assertEqual(set(q_queryset), set(self.parties))
+
+    def test_returned_queryset_replaces_queue(self):
+        def middleware(q_dict, q_queryset, logger):
+            q_dict['regional'] = q_queryset.filter(region='EUW')
+            return q_queryset.exclude(region='EUW')
+
+        q_dict, q_queryset = stack_atomic_call_middleware(self.q_dict, Party.objects.all(), self.logger,
+                                                          'splitting', middleware)
+
+        self.assertFalse(self.logger.exception.called)
+        self.assertEqual(set(q_queryset), set(self.parties[:2]))
+        self.assertEqual(list(q_dict['regional']), [self.parties[2]])
+        self.assertEqual(list(q_dict['expedited']), [self.parties[0]])
+        self.assertEqual(list(self.q_dict), ['expedited'])
+
+
+class ArchiveMatchesTests(TestCase):
+    """ archive_matches against the DB """
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.before = timezone.now()
+        self.matches = [Match.objects.create(end_time=self.before - datetime.timedelta(days=1)) for idx in range(3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.archive_dir)
+
+    def test_archives_and_deletes(self):
+        num_archived, paths = archive_matches(self.before, self.archive_dir, chunk_size=2)
+
+        self.assertEqual(num_archived, 3)
+        self.assertEqual(len(paths), 2)
+        self.assertFalse(Match.objects.exists())
+        self.assertEqual(len(os.listdir(self.archive_dir)), 4)  # Each file and its manifest
+
+    def test_failed_delete_removes_files(self):
+        with mock.patch.object(QuerySet, 'delete', side_effect=DatabaseError()):
+            with self.assertRaises(DatabaseError):
+                archive_matches(self.before, self.archive_dir, chunk_size=2)
+
+        self.assertEqual(os.listdir(self.archive_dir), [])
+        self.assertEqual(Match.objects.count(), 3)
+
+
+class PlusPointsTests(TestCase):
+    """ Plus Points awards against the DB """
+
+    def setUp(self):
+        self.logger = mock.Mock()
+        self.players = [Player.objects.create(user=User.objects.create(username='player%s' % idx))
+                        for idx in range(4)]
+        self.teams = [Team.objects.create(name='team%s' % idx, captain=self.players[2 * idx]) for idx in range(2)]
+        self.match = self.create_match()
+
+    def create_match(self, **kwargs):
+        match = Match.objects.create(winner=self.teams[0], end_time=timezone.now(), **kwargs)
+        for idx, team in enumerate(self.teams):
+            MatchTeamSlot.objects.create(match=match, team=team, result=idx == 0)
+            for player in self.players[2 * idx:2 * idx + 2]:
+                MatchRosterSlot.objects.create(match=match, team=team, player=player)
+        return match
+
+    def get_balances(self):
+        return dict(PlusPlayer.objects.values_list('player_id', 'num_points'))
+
+    def test_awards_once(self):
+        plus_award_points([self.match], self.logger)
+        plus_award_points([self.match], self.logger)
+
+        winner_points = PLUS_POINTS_PLAYED + PLUS_POINTS_WIN
+        self.assertEqual(self.get_balances(), {self.players[0].pk: winner_points, self.players[1].pk: winner_points,
+                                               self.players[2].pk: PLUS_POINTS_PLAYED,
+                                               self.players[3].pk: PLUS_POINTS_PLAYED})
+        self.assertEqual(PlusLedgerEntry.objects.count(), 4)
+        self.assertEqual(PlusAwardedMatch.objects.count(), 1)
+
+    def test_skipped_matches_are_not_keyed(self):
+        disputed = self.create_match(is_disputed=True)
+        unfinished = Match.objects.create()
+        plus_award_points([disputed, unfinished], self.logger)
+        self.assertFalse(PlusAwardedMatch.objects.exists())
+
+        # Resolved later, the match is still awarded
+        disputed.is_disputed = False
+        plus_award_points([disputed], self.logger)
+        self.assertEqual(list(PlusAwardedMatch.objects.values_list('match_id', flat=True)), [disputed.pk])
+
+    def test_concurrent_duplicate_rolls_back(self):
+        plus_award_points([self.match], self.logger)
+        balances = self.get_balances()
+
+        # A concurrent run that read the keys before this one committed
+        with mock.patch('mm_base.models.mm_plus_points.middleware.plus_get_awarded_match_pks', return_value=set()):
+            with self.assertRaises(IntegrityError):
+                with transaction.atomic():
+                    plus_award_points([self.match], self.logger)
+
+        self.assertEqual(self.get_balances(), balances)
+        self.assertEqual(PlusLedgerEntry.objects.count(), 4)
+
+    def test_replay_rebuilds_balances(self):
+        plus_award_points([self.match, self.create_match()], self.logger)
+        balances = self.get_balances()
+        PlusPlayer.objects.update(num_points=0)
+        PlusPlayer.objects.filter(player=self.players[3]).delete()
+        idle_player = Player.objects.create(user=User.objects.create(username='idle'))
+        PlusPlayer.objects.create(player=idle_player, num_points=99)
+
+        self.assertEqual(plus_replay_ledger(), 5)
+        balances[idle_player.pk] = 0
+        self.assertEqual(self.get_balances(), balances)
+
+
+class ExpiredMatchSweepTests(TestCase):
+    """ mm_close_all_expired_matches against the DB """
+
+    def test_closes_expired_in_chunks(self):
+        now = timezone.now()
+        expired_at = now - datetime.timedelta(minutes=MM_MATCH_MAX_DURATION)
+        ended_at = now - datetime.timedelta(hours=1)
+
+        expired = [Match.objects.create(start_time=expired_at - datetime.timedelta(minutes=minutes))
+                   for minutes in (5, 1, 9, 3, 7, 2, 8)]
+        running = Match.objects.create(start_time=now)
+        not_started = Match.objects.create()
+        ended = Match.objects.create(start_time=expired_at - datetime.timedelta(minutes=30), end_time=ended_at)
+
+        closed_ids = mm_close_all_expired_matches(chunk_size=3)
+
+        # Oldest first, each expired match once
+        self.assertEqual(closed_ids, [match.pk for match in sorted(expired, key=lambda match: match.start_time)])
+        self.assertFalse(Match.objects.filter(pk__in=closed_ids, end_time=None).exists())
+        self.assertEqual(list(Match.objects.filter(end_time=None).order_by('pk').values_list('pk', flat=True)),
+                         [running.pk, not_started.pk])
+        ended.refresh_from_db()
+        self.assertEqual(ended.end_time, ended_at)
+        self.assertEqual(mm_close_all_expired_matches(chunk_size=3), [])
@@ -0,0 +1,182 @@
+"""
+Per-stage tracing for the Matchmaking stacks
+
+Every stage run by call_stack / call_result_stack emits one record:
+    {'tick', 'time', 'stack', 'stage', 'wall_time', 'db_queries', 'db_time',
+     'parties_in', 'parties_out', 'failed'}
+
+Records go to pluggable sinks, anything with an emit(record) method
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from django.db import connection
+
+from .app_settings import APP_NAME, MM_TRACE_ENABLED, MM_TRACE_SINKS, MM_TRACE_COUNT_PARTIES, MM_TRACE_RING_SIZE, \
+    MM_TRACE_FILE, MM_TRACE_FILE_MAX_BYTES, MM_TRACE_FILE_BACKUPS
+
+
+class TraceLoggerSink(object):
+    """ Logs one line per stage record """
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger('%s.mm_trace' % APP_NAME)
+
+    def emit(self, record):
+        self.logger.info('MM_TRACE: %(stack)s.%(stage)s tick=%(tick)s wall=%(wall_time).4fs '
+                         'queries=%(db_queries)s db=%(db_time).4fs parties=%(parties_in)s->%(parties_out)s' % record)
+
+
+class TraceRingBufferSink(object):
+    """ Keeps the last size stage records in memory """
+
+    def __init__(self, size=MM_TRACE_RING_SIZE):
+        self.records = deque(maxlen=size)
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TraceJsonLinesSink(object):
+    """
+    Appends stage records to a JSON-lines file
+        - Once the file reaches max_bytes it is rotated to path.1, path.1 to path.2 and so on,
+          keeping backups files
+    """
+
+    def __init__(self, path=MM_TRACE_FILE, max_bytes=MM_TRACE_FILE_MAX_BYTES, backups=MM_TRACE_FILE_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+
+    def rotate(self):
+        for idx in range(self.backups - 1, 0, -1):
+            if os.path.exists('%s.%s' % (self.path, idx)):
+                os.replace('%s.%s' % (self.path, idx), '%s.%s' % (self.path, idx + 1))
+        if self.backups:
+            os.replace(self.path, '%s.1' % self.path)
+        else:
+            os.remove(self.path)
+
+    def emit(self, record):
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self._lock:
+            if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                self.rotate()
+            with open(self.path, 'a') as trace_file:
+                trace_file.write(line)
+
+
+""" Sinks that can be named in MM_TRACE_SINKS """
+MM_TRACE_SINK_TYPES = {
+    'logger':                   TraceLoggerSink,
+    'ring_buffer':              TraceRingBufferSink,
+    'json_lines':               TraceJsonLinesSink,
+}
+
+_trace_sinks = None
+
+
+def trace_get_sinks():
+    """ Returns the active sinks, built from MM_TRACE_SINKS on first use """
+    global _trace_sinks
+    if _trace_sinks is None:
+        _trace_sinks = [MM_TRACE_SINK_TYPES[name]() for name in MM_TRACE_SINKS]
+    return _trace_sinks
+
+
+def trace_add_sink(sink):
+    """ Plugs another sink in """
+    trace_get_sinks().append(sink)
+
+
+def trace_new_tick():
+    """ Returns an id grouping the stage records of one stack run """
+    return uuid.uuid4().hex[:12]
+
+
+class TraceQueryCounter(object):
+    """ connection.execute_wrapper counting and timing queries of the calling thread """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.time()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.time() - start
+
+
+@contextmanager
+def trace_stage(tick, stack, stage, count_parties=None):
+    """
+    Traces the stage run inside the block
+        - count_parties : optional callable returning the number of waiting parties,
+          called before and after the stage, outside of the query count, if MM_TRACE_COUNT_PARTIES
+        - Yields the record, which is emitted on exit
+    """
+    if not MM_TRACE_ENABLED:
+        yield {}
+        return
+
+    if not MM_TRACE_COUNT_PARTIES:
+        count_parties = None
+
+    record = {
+        'tick': tick,
+        'time': time.time(),
+        'stack': stack,
+        'stage': stage,
+        'parties_in': count_parties() if count_parties else None,
+        'failed': True,
+    }
+    counter = TraceQueryCounter()
+    start = time.time()
+
+    try:
+        with connection.execute_wrapper(counter):
+            yield record
+        record['failed'] = False
+    finally:
+        record['wall_time'] = time.time() - start
+        record['db_queries'] = counter.count
+        record['db_time'] = counter.seconds
+        record['parties_out'] = count_parties() if count_parties else None
+
+        for sink in trace_get_sinks():
+            sink.emit(record)
+
+
+def trace_list_json_lines_files(path=MM_TRACE_FILE, backups=MM_TRACE_FILE_BACKUPS):
+    """ Returns a JSON-lines file and its rotated backups that exist, oldest first """
+    paths = ['%s.%s' % (path, idx) for idx in range(backups, 0, -1)] + [path]
+    return [file_path for file_path in paths if os.path.exists(file_path)]
+
+
+def trace_read_json_lines(path=MM_TRACE_FILE, num_ticks=None, backups=MM_TRACE_FILE_BACKUPS):
+    """ Reads stage records of the last num_ticks ticks back from a JSON-lines file and its backups, grouped by tick """
+    paths = trace_list_json_lines_files(path, backups)
+    if not paths:
+        raise IOError('No trace file at %s' % path)
+
+    ticks = {}
+    for file_path in paths:
+        with open(file_path) as trace_file:
+            for line in trace_file:
+                if line.strip():
+                    record = json.loads(line)
+                    ticks.setdefault(record['tick'], []).append(record)
+
+    ordered = sorted(ticks.values(), key=lambda records: records[0]['time'])
+    return ordered[-num_ticks:] if num_ticks else ordered
@@ -0,0 +1,10 @@
+"""
+App specific settings for Plus Membership app
+"""
+
+'''------------------------------------------
+            Membership Cache Settings
+   ---------------------------------------'''
+PLUS_CACHE_SIZE = 100000                # Max users whose membership is cached per process (LRU)
+PLUS_CACHE_TTL = 300                    # Seconds a cached membership is trusted before it's read again
+PLUS_EXPIRE_CHUNK_SIZE = 1000           # Lapsed memberships expired per UPDATE by the nightly job
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PlusMembershipConfig(AppConfig):
     name = 'plus_membership'
+
+    def ready(self):
+        import plus_membership.signals
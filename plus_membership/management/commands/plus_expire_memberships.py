@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ...services import plus_expire_memberships
+
+
+class Command(BaseCommand):
+    help = 'Deactivates Plus memberships whose renewal date has passed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None, help='Memberships expired per UPDATE')
+
+    def handle(self, *args, **options):
+        kwargs = {'chunk_size': options['chunk_size']} if options['chunk_size'] else {}
+        self.stdout.write('Expired %s Plus memberships' % plus_expire_memberships(**kwargs))
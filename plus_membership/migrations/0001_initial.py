@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlusRenewal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(default='', max_length=64)),
+                ('duration', models.PositiveSmallIntegerField(default=1)),
+                ('price', models.DecimalField(decimal_places=2, default=0.0, max_digits=5)),
+                ('is_active', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlusUser',
+            fields=[
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True,
+                                                related_name='plus_membership', serialize=False,
+                                                to=settings.AUTH_USER_MODEL)),
+                ('is_active', models.BooleanField(default=False)),
+                ('signup_date', models.DateField(blank=True, default=None, null=True)),
+                ('renewal_date', models.DateField(blank=True, default=None, null=True)),
+                ('renewal_type', models.ForeignKey(blank=True, default=None, null=True,
+                                                   on_delete=django.db.models.deletion.SET_NULL,
+                                                   to='plus_membership.PlusRenewal')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='plususer',
+            index=models.Index(fields=['is_active', 'renewal_date'], name='plus_user_expiry_idx'),
+        ),
+    ]
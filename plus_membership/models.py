@@ -2,18 +2,27 @@ from django.db import models
 from django.contrib.auth.models import User
 
 
-class PlusUser(models.Class):
+class PlusRenewal(models.Model):
+    """ Plus Renewal Program """
+    name = models.CharField(max_length=64, default="")
+    duration = models.PositiveSmallIntegerField(default=1)  # Months
+    price = models.DecimalField(default=0.00, max_digits=5, decimal_places=2)
+    is_active = models.BooleanField(default=False)  # Can you signup for this currently?
+
+
+class PlusUser(models.Model):
     """ Represents a User's Plus Membership Status """
-    player = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    player = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='plus_membership')
     is_active = models.BooleanField(default=False)
     signup_date = models.DateField(default=None, blank=True, null=True)  # If renewal / signup is None, isActive = False
-    renewal_date = models.DateField(default=None, blank=True, null=True)
-    renewal_type = models.ForeignKey(default=0, max_digits=2, )  # Month-To-Month, 6-Month, 12-Month, Special Promo, etc
+    renewal_date = models.DateField(default=None, blank=True, null=True)  # Membership lapses after this day
+    # Month-To-Month, 6-Month, 12-Month, Special Promo, etc
+    renewal_type = models.ForeignKey(PlusRenewal, on_delete=models.SET_NULL, default=None, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_active', 'renewal_date'], name='plus_user_expiry_idx'),  # Nightly expiry job
+        ]
 
-class PlusRenewal(models.Class):
-    """ Plus Renewal Program """
-    name = models.CharField(default="")
-    duration = models.IntegerField(default=1, max_digits=2)
-    price = models.DecimalField(default=0.00, max_digits=5, decimal_places=2)
-    is_active = models.BooleanField(default=False)  # Can you signup for this currently?
+    def is_member(self, today):
+        return self.is_active and self.renewal_date is not None and self.renewal_date >= today
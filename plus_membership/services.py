@@ -0,0 +1,156 @@
+"""
+Plus Membership lookups for hot paths (queue priority, rewards)
+
+    * Memberships are cached per process in a bounded, TTL'd LRU keyed on user pk
+    * Cache misses of a batch are read in one query
+    * Saves / deletes of a PlusUser invalidate its entry (see signals.py)
+    * The cache holds the renewal date of active members, so a membership lapsing at
+      midnight is seen straight away, before the nightly job expires its row
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.db import transaction
+from django.utils import timezone
+
+from .app_settings import PLUS_CACHE_SIZE, PLUS_CACHE_TTL, PLUS_EXPIRE_CHUNK_SIZE
+from .models import PlusUser
+
+
+class MembershipCache(object):
+    """
+    Bounded LRU of memberships: user pk -> renewal date of an active member, or None
+        - Entries are trusted for ttl seconds, covering saves made by other processes
+    """
+
+    def __init__(self, maxsize=PLUS_CACHE_SIZE, ttl=PLUS_CACHE_TTL, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # user pk -> (renewal date or None, expiry time), least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, user_pks):
+        """ Returns ({user pk: renewal date or None} of fresh entries, [missed user pks]) """
+        now = self.clock()
+        found = {}
+        missed = []
+
+        with self._lock:
+            for user_pk in user_pks:
+                entry = self._entries.get(user_pk)
+                if entry is None or entry[1] <= now:
+                    missed.append(user_pk)
+                else:
+                    self._entries.move_to_end(user_pk)
+                    found[user_pk] = entry[0]
+
+            self.hits += len(found)
+            self.misses += len(missed)
+
+        return found, missed
+
+    def put_many(self, renewal_dates):
+        """ renewal_dates : {user pk: renewal date of an active member, or None} """
+        expires_at = self.clock() + self.ttl
+
+        with self._lock:
+            for user_pk, renewal_date in renewal_dates.items():
+                self._entries.pop(user_pk, None)
+                self._entries[user_pk] = (renewal_date, expires_at)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_pk):
+        with self._lock:
+            self._entries.pop(user_pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / float(lookups) if lookups else None}
+
+
+_membership_cache = MembershipCache()
+
+
+def plus_get_membership_cache():
+    """ Returns the process' membership cache """
+    return _membership_cache
+
+
+def plus_invalidate_membership(user_pk):
+    """ Drops a user's cached membership """
+    _membership_cache.invalidate(user_pk)
+
+
+def plus_read_renewal_dates(user_pks):
+    """ Reads {user pk: renewal date of an active member, or None} of many users in one query """
+    renewal_dates = dict.fromkeys(user_pks)
+    renewal_dates.update(PlusUser.objects.filter(player__in=list(renewal_dates), is_active=True)
+                         .exclude(renewal_date=None).values_list('player_id', 'renewal_date'))
+    return renewal_dates
+
+
+def plus_get_memberships(user_pks, today=None, cache=_membership_cache):
+    """
+    Looks up the membership of many users at once
+        - Only users missing from the cache are read, in a single query
+        - Returns {user pk: is member}
+    """
+    today = today or timezone.localdate()
+    renewal_dates, missed = cache.get_many(set(user_pks))
+
+    if missed:
+        read_dates = plus_read_renewal_dates(missed)
+        cache.put_many(read_dates)
+        renewal_dates.update(read_dates)
+
+    return {user_pk: renewal_date is not None and renewal_date >= today
+            for user_pk, renewal_date in renewal_dates.items()}
+
+
+def plus_is_member(user_pk, today=None, cache=_membership_cache):
+    """ Is the user an active Plus member? """
+    return plus_get_memberships((user_pk,), today, cache)[user_pk]
+
+
+def plus_expire_memberships(today=None, chunk_size=PLUS_EXPIRE_CHUNK_SIZE):
+    """
+    Deactivates every membership whose renewal date has passed
+        - Walks the (is_active, renewal_date) index in pk order, one UPDATE per chunk
+          of chunk_size rows, each in its own short transaction
+        - Returns the number of expired memberships
+    """
+    today = today or timezone.localdate()
+    lapsed = PlusUser.objects.filter(is_active=True, renewal_date__lt=today).order_by('pk')
+    num_expired = 0
+    last_pk = None
+
+    while True:
+        chunk = lapsed if last_pk is None else lapsed.filter(pk__gt=last_pk)
+        user_pks = list(chunk.values_list('pk', flat=True)[:chunk_size])
+        if not user_pks:
+            return num_expired
+
+        with transaction.atomic():
+            num_expired += PlusUser.objects.filter(pk__in=user_pks, is_active=True, renewal_date__lt=today) \
+                .update(is_active=False)
+
+        # UPDATE skips signals. Cached entries already read as lapsed, drop them to free the space
+        for user_pk in user_pks:
+            plus_invalidate_membership(user_pk)
+        last_pk = user_pks[-1]
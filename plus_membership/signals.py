@@ -0,0 +1,22 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import PlusUser
+from .services import plus_invalidate_membership
+
+
+@receiver(post_save, sender=PlusUser)
+def plus_user_invalidate_membership(sender, instance, **kwargs):
+    """
+    Signups, renewals and cancellations drop the user's cached membership
+        - Dropped once the transaction commits, so a concurrent read can't cache the old row again
+    """
+    user_pk = instance.pk
+    transaction.on_commit(lambda: plus_invalidate_membership(user_pk))
+
+
+@receiver(post_delete, sender=PlusUser)
+def plus_user_remove_membership(sender, instance, **kwargs):
+    user_pk = instance.pk
+    transaction.on_commit(lambda: plus_invalidate_membership(user_pk))
@@ -0,0 +1,10 @@
+from __future__ import absolute_import, unicode_literals
+from celery import shared_task
+
+from .services import plus_expire_memberships
+
+
+@shared_task(name='expire_plus_memberships')
+def task_expire_memberships():
+    """ Nightly: deactivates lapsed memberships in chunks, returns how many expired """
+    return plus_expire_memberships()
@@ -1,3 +1,42 @@
-from django.test import TestCase
+import datetime
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from .services import MembershipCache
+
+
+class MembershipCacheTests(SimpleTestCase):
+    """ The per-process membership cache, on a fake clock """
+
+    def setUp(self):
+        self.now = 0.0
+        self.cache = MembershipCache(maxsize=3, ttl=10, clock=lambda: self.now)
+        self.renewal_date = datetime.date(2020, 1, 1)
+
+    def test_hits_and_misses(self):
+        self.cache.put_many({1: self.renewal_date, 2: None})
+
+        found, missed = self.cache.get_many([1, 2, 3])
+        self.assertEqual(found, {1: self.renewal_date, 2: None})
+        self.assertEqual(missed, [3])
+        self.assertEqual(self.cache.get_stats()['hits'], 2)
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.put_many({1: self.renewal_date})
+        self.now = 9.9
+        self.assertEqual(self.cache.get_many([1])[1], [])
+        self.now = 10.0
+        self.assertEqual(self.cache.get_many([1])[1], [1])
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put_many({1: None, 2: None, 3: None})
+        self.cache.get_many([1])
+        self.cache.put_many({4: None})
+
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(sorted(self.cache.get_many([1, 2, 3, 4])[0]), [1, 3, 4])
+
+    def test_invalidate(self):
+        self.cache.put_many({1: self.renewal_date})
+        self.cache.invalidate(1)
+        self.assertEqual(self.cache.get_many([1])[1], [1])
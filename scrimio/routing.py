@@ -1 +1,5 @@
-routes=[]
+from channels.routing import include
+
+routes = [
+    include('mm_base.routing.mm_routes', path=r'^/mm'),
+]
@@ -182,12 +182,22 @@ REST_FRAMEWORK = {
 }
 
 # Channels Settings
+# In-memory layer for development (one process). Deployments set CHANNEL_REDIS_URL, so Celery
+# workers can send match notifications to sockets held by the interface servers
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "asgiref.inmemory.ChannelLayer",
         "ROUTING": "scrimio.routing.routes",
     },
 }
+if os.environ.get('CHANNEL_REDIS_URL'):
+    CHANNEL_LAYERS["default"] = {
+        "BACKEND": "asgi_redis.RedisChannelLayer",
+        "CONFIG": {
+            "hosts": [os.environ['CHANNEL_REDIS_URL']],
+        },
+        "ROUTING": "scrimio.routing.routes",
+    }
 
 # Celery Settings
 BROKER_URL = 'redis://localhost:6379/0'  # our redis address